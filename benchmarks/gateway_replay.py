@@ -0,0 +1,347 @@
+# Offline load test of loaded extensions driven by gateway events
+# Events are passed to parsers of disnake connection state exactly like events received from gateway, so objects, caches and dispatch are real
+# Discord API is not reachable, every request fails immediately (and is counted) so handlers behave like when API call fails
+#
+# `python -m benchmarks.gateway_replay synthetic --events 10000 --rate 500` generates guild with members and channels and mix of events
+# `python -m benchmarks.gateway_replay replay events.jsonl --speed 1` replays events recorded by bot (monitoring.record_gateway_events_file)
+# Database from config is used unless `--connect-string` is set (use local SQLite or Postgres, tables are created), `--output` saves report as JSON
+
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import random
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import disnake
+
+from config import config
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Gateway event name, payload and time offset in seconds (used when replaying with recorded timing)
+Event = Tuple[str, dict, float]
+
+WORDS = ("python", "pandas", "numpy", "tensorflow", "error", "help", "loop", "function", "class", "install", "import", "data", "model", "train",
+         "list", "dict", "string", "question", "how", "why", "does", "not", "work", "my", "code", "with", "the", "a", "in", "for")
+
+DEFAULT_MIX = "message=80,edit=6,delete=4,reaction=5,voice=4,join=1"
+
+class SnowflakeGenerator:
+  def __init__(self):
+    self.counter = itertools.count(disnake.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc)))
+
+  def __call__(self) -> int:
+    # Spread ids so each looks like it was created in different millisecond
+    return next(self.counter) + (1 << 22)
+
+class SyntheticGuild:
+  def __init__(self, members: int, text_channels: int, voice_channels: int, seed: int):
+    self.random = random.Random(seed)
+    self.next_id = SnowflakeGenerator()
+    self.now = datetime.datetime.now(datetime.timezone.utc)
+
+    # Configured ids are used so extensions filtering by them (AutoHelp, Warden, VCNotifier) process events too
+    self.guild_id = config.ids.main_guild if config.ids.main_guild > 0 else self.next_id()
+    self.text_channel_ids = list(dict.fromkeys([config.ids.help_channel, *config.ids.warden_channels_to_look_for, *[self.next_id() for _ in range(text_channels)]]))
+    self.voice_channel_ids = list(dict.fromkeys([*config.voice_channel_notifier.vc_channel_ids, *[self.next_id() for _ in range(voice_channels)]]))
+    self.user_ids = [self.next_id() for _ in range(members)]
+
+    self.recent_messages: Deque[dict] = collections.deque(maxlen=1000)
+    self.voice_states: Dict[int, Optional[int]] = {}
+
+  def user(self, user_id: int) -> dict:
+    return {"id": str(user_id), "username": f"user{user_id % 100000}", "discriminator": f"{user_id % 10000:04d}", "avatar": None, "bot": False}
+
+  def member(self, user_id: int) -> dict:
+    return {"user": self.user(user_id), "roles": [], "joined_at": self.now.isoformat(), "deaf": False, "mute": False, "nick": None}
+
+  def guild_create(self) -> dict:
+    channels = [{"id": str(channel_id), "type": 0, "name": f"text-{idx}", "position": idx, "permission_overwrites": [], "parent_id": None} for idx, channel_id in enumerate(self.text_channel_ids)]
+    channels.extend({"id": str(channel_id), "type": 2, "name": f"voice-{idx}", "position": idx, "permission_overwrites": [], "parent_id": None, "bitrate": 64000, "user_limit": 0} for idx, channel_id in enumerate(self.voice_channel_ids))
+    return {
+      "id": str(self.guild_id), "name": "Synthetic guild", "owner_id": str(self.user_ids[0]), "unavailable": False, "large": False, "member_count": len(self.user_ids),
+      "roles": [{"id": str(self.guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+      "channels": channels, "threads": [], "members": [self.member(user_id) for user_id in self.user_ids],
+      "presences": [{"user": {"id": str(user_id)}, "status": self.random.choice(("online", "idle", "dnd", "offline")), "activities": [], "client_status": {}} for user_id in self.user_ids],
+      "voice_states": [], "emojis": [], "stickers": [], "features": [], "premium_tier": 0, "verification_level": 0, "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0
+    }
+
+  def content(self) -> str:
+    return " ".join(self.random.choices(WORDS, k=self.random.randint(3, 25)))
+
+  def message_create(self) -> dict:
+    author_id = self.random.choice(self.user_ids)
+    # Some messages are reposted by same author so Warden finds duplicates
+    previous = self.random.choice(self.recent_messages) if self.recent_messages and self.random.random() < 0.05 else None
+    content = previous["content"] if previous is not None else self.content()
+    if previous is not None:
+      author_id = int(previous["author"]["id"])
+
+    message = {
+      "id": str(self.next_id()), "channel_id": str(self.random.choice(self.text_channel_ids)), "guild_id": str(self.guild_id), "author": self.user(author_id), "member": self.member(author_id),
+      "content": content, "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(), "edited_timestamp": None, "tts": False, "mention_everyone": False,
+      "mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False, "type": 0
+    }
+    self.recent_messages.append(message)
+    return message
+
+  def message_update(self) -> Optional[dict]:
+    if not self.recent_messages: return None
+    message = self.random.choice(self.recent_messages)
+    message["content"] = self.content()
+    message["edited_timestamp"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return dict(message)
+
+  def message_delete(self) -> Optional[dict]:
+    if not self.recent_messages: return None
+    message = self.recent_messages.pop()
+    return {"id": message["id"], "channel_id": message["channel_id"], "guild_id": str(self.guild_id)}
+
+  def reaction_add(self) -> Optional[dict]:
+    if not self.recent_messages: return None
+    message = self.random.choice(self.recent_messages)
+    user_id = self.random.choice(self.user_ids)
+    return {"user_id": str(user_id), "channel_id": message["channel_id"], "message_id": message["id"], "guild_id": str(self.guild_id), "member": self.member(user_id),
+            "emoji": {"id": None, "name": self.random.choice(("👍", "❤️", "😂", "🔖"))}}
+
+  def voice_state_update(self) -> Optional[dict]:
+    if not self.voice_channel_ids: return None
+    user_id = self.random.choice(self.user_ids)
+    # Members join voice channel and leave it again
+    channel_id = None if self.voice_states.get(user_id) is not None else self.random.choice(self.voice_channel_ids)
+    self.voice_states[user_id] = channel_id
+    return {"guild_id": str(self.guild_id), "channel_id": str(channel_id) if channel_id is not None else None, "user_id": str(user_id), "member": self.member(user_id),
+            "session_id": "synthetic", "deaf": False, "mute": False, "self_deaf": False, "self_mute": False, "self_video": False, "suppress": False, "request_to_speak_timestamp": None}
+
+  def member_add(self) -> dict:
+    user_id = self.next_id()
+    self.user_ids.append(user_id)
+    return {**self.member(user_id), "guild_id": str(self.guild_id)}
+
+  def events(self, count: int, mix: Dict[str, float]) -> Iterator[Event]:
+    generators = {
+      "message": ("MESSAGE_CREATE", self.message_create), "edit": ("MESSAGE_UPDATE", self.message_update), "delete": ("MESSAGE_DELETE", self.message_delete),
+      "reaction": ("MESSAGE_REACTION_ADD", self.reaction_add), "voice": ("VOICE_STATE_UPDATE", self.voice_state_update), "join": ("GUILD_MEMBER_ADD", self.member_add)
+    }
+    kinds = [kind for kind in mix.keys() if kind in generators.keys()]
+    weights = [mix[kind] for kind in kinds]
+
+    generated = 0
+    while generated < count:
+      event_name, generator = generators[self.random.choices(kinds, weights)[0]]
+      payload = generator()
+      if payload is None: continue
+      yield event_name, payload, 0.0
+      generated += 1
+
+def parse_mix(mix: str) -> Dict[str, float]:
+  result = {}
+  for item in mix.split(","):
+    kind, weight = item.split("=")
+    result[kind.strip()] = float(weight)
+  return result
+
+def load_recording(path: str) -> List[Event]:
+  events = []
+  with open(path, "r", encoding="utf-8") as fd:
+    for line in fd:
+      if not line.strip(): continue
+      item = json.loads(line)
+      events.append((item["t"], item["d"], item["time"]))
+  return events
+
+class OfflineResponse:
+  status = 503
+  reason = "Offline replay"
+
+class ReplayHarness:
+  def __init__(self, max_pending: int):
+    from features.base_bot import BaseAutoshardedBot
+
+    self.max_pending = max_pending
+    self.pending_tasks = set()
+    self.api_requests = collections.Counter()
+    self.handler_errors = collections.Counter()
+    self.event_counts = collections.Counter()
+
+    self.bot = BaseAutoshardedBot()
+    state = self.bot._connection
+    state.user = disnake.ClientUser(state=state, data={"id": str(disnake.utils.time_snowflake(datetime.datetime.now(datetime.timezone.utc))), "username": "sentdebot", "discriminator": "0000", "avatar": None, "bot": True})
+
+    self.bot.http.request = self.offline_request
+    self.bot.on_error = self.count_error
+    original_schedule_event = self.bot._schedule_event
+
+    # Every dispatched listener is tracked so run waits until all work caused by events is done
+    def schedule_event(*args, **kwargs):
+      task = original_schedule_event(*args, **kwargs)
+      self.pending_tasks.add(task)
+      task.add_done_callback(self.pending_tasks.discard)
+      return task
+    self.bot._schedule_event = schedule_event
+
+  async def offline_request(self, route, **_):
+    self.api_requests[f"{route.method} {route.path}"] += 1
+    raise disnake.HTTPException(OfflineResponse(), "Discord API is not available during replay")
+
+  async def count_error(self, event_name: str, *_, **__):
+    self.handler_errors[event_name] += 1
+
+  def feed(self, event_name: str, payload: dict):
+    parser = self.bot._connection.parsers.get(event_name)
+    if parser is None: return
+    self.event_counts[event_name] += 1
+    parser(payload)
+
+  async def wait_for_handlers(self):
+    while self.pending_tasks:
+      await asyncio.wait(list(self.pending_tasks))
+
+  # Guilds are created before measurement, their handlers fill database with guild, channels and members
+  async def setup(self, events: List[Event]):
+    for event_name, payload, _ in events:
+      self.feed(event_name, payload)
+    await self.wait_for_handlers()
+    self.event_counts.clear()
+
+  async def run(self, events: Iterator[Event], rate: float, speed: float) -> float:
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    first_offset = None
+
+    for idx, (event_name, payload, offset) in enumerate(events):
+      if rate > 0:
+        due_time = start_time + idx / rate
+      elif speed > 0:
+        first_offset = offset if first_offset is None else first_offset
+        due_time = start_time + (offset - first_offset) / speed
+      else:
+        due_time = None
+
+      if due_time is not None and due_time > loop.time():
+        await asyncio.sleep(due_time - loop.time())
+      elif idx % 50 == 0:
+        # Let handlers run even when replaying as fast as possible
+        await asyncio.sleep(0)
+
+      self.feed(event_name, payload)
+      if len(self.pending_tasks) >= self.max_pending:
+        await asyncio.wait(list(self.pending_tasks), return_when=asyncio.FIRST_COMPLETED)
+
+    await self.wait_for_handlers()
+    # Writes buffered by extensions are part of work caused by events
+    await asyncio.gather(*[cog.handle_shutdown() for cog in self.bot.cogs.values()], return_exceptions=True)
+    return loop.time() - start_time
+
+def build_report(harness: ReplayHarness, elapsed: float, mode: str) -> Dict[str, Any]:
+  from database import database, query_stats
+  from features import handler_metrics
+
+  events = sum(harness.event_counts.values())
+  statements = sum(stats.count for stats in query_stats.statements.values())
+  sampler = harness.bot.loop_lag_sampler
+
+  callers = collections.defaultdict(lambda: [0, 0.0])
+  for stats in query_stats.statements.values():
+    callers[stats.caller][0] += stats.count
+    callers[stats.caller][1] += stats.total_ms
+
+  return {
+    "mode": mode,
+    "timestamp": datetime.datetime.utcnow().isoformat(),
+    "database": database.db.dialect.name,
+    "events": events,
+    "events_by_type": dict(harness.event_counts),
+    "elapsed_s": elapsed,
+    "events_per_second": events / elapsed if elapsed > 0 else 0.0,
+    "db_statements": statements if config.db.query_stats else None,
+    "db_statements_per_event": statements / events if config.db.query_stats and events > 0 else None,
+    "db_statements_by_caller": {caller: {"count": count, "total_ms": total_ms} for caller, (count, total_ms) in sorted(callers.items(), key=lambda item: item[1][1], reverse=True)},
+    "handlers": [stats.to_dict() for stats in handler_metrics.get_top_handlers()],
+    "loop_lag_ms": {"average": sampler.average_ms, "p95": sampler.percentile_ms(0.95), "max": sampler.max_lag_ms},
+    "api_requests": dict(harness.api_requests),
+    "handler_errors": dict(harness.handler_errors)
+  }
+
+def log_report(report: Dict[str, Any]):
+  logger.info(f"{report['events']} events in {report['elapsed_s']:.2f}s, {report['events_per_second']:.1f} events/s")
+  if report["db_statements"] is not None:
+    logger.info(f"{report['db_statements']} database statements, {report['db_statements_per_event']:.2f} per event")
+  logger.info(f"Event loop lag avg {report['loop_lag_ms']['average']:.1f}ms, p95 {report['loop_lag_ms']['p95']:.1f}ms, max {report['loop_lag_ms']['max']:.1f}ms")
+  for stats in report["handlers"][:15]:
+    logger.info(f"{stats['kind']} {stats['name']}: {stats['count']}x, p50 {stats['p50_ms']:.2f}ms, p95 {stats['p95_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms, total {stats['total_ms']:.0f}ms")
+  if report["api_requests"]:
+    logger.info(f"Failed Discord API requests: {sum(report['api_requests'].values())} ({', '.join(f'{route}: {count}' for route, count in report['api_requests'].items())})")
+  if report["handler_errors"]:
+    logger.info(f"Handler errors: {', '.join(f'{event}: {count}' for event, count in report['handler_errors'].items())}")
+
+async def main(args):
+  from database import query_stats
+  from database.database_manipulation import init_tables, close_database
+  from features import handler_metrics
+
+  await init_tables()
+  harness = ReplayHarness(args.max_pending)
+
+  if args.mode == "synthetic":
+    guild = SyntheticGuild(args.members, args.channels, args.voice_channels, args.seed)
+    await harness.setup([("GUILD_CREATE", guild.guild_create(), 0.0)])
+    events = guild.events(args.events, parse_mix(args.mix))
+  else:
+    recording = load_recording(args.file)
+    await harness.setup([event for event in recording if event[0] == "GUILD_CREATE"])
+    events = iter([event for event in recording if event[0] != "GUILD_CREATE"])
+
+  # Only work caused by measured events is reported
+  query_stats.reset()
+  handler_metrics.reset()
+  harness.api_requests.clear()
+  harness.handler_errors.clear()
+  harness.bot.loop_lag_sampler.start()
+
+  elapsed = await harness.run(events, args.rate, args.speed)
+  harness.bot.loop_lag_sampler.stop()
+
+  report = build_report(harness, elapsed, args.mode)
+  log_report(report)
+  if args.output:
+    with open(args.output, "w", encoding="utf-8") as fd:
+      json.dump(report, fd, indent=2)
+    logger.info(f"Report written to `{args.output}`")
+
+  if harness.bot.gateway_recorder is not None:
+    await harness.bot.gateway_recorder.close()
+  await close_database()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Drive loaded extensions with synthetic or recorded gateway events and measure throughput")
+  parser.add_argument("--connect-string", default=None, help="Database used instead of the one from config")
+  parser.add_argument("--rate", type=float, default=0, help="Events per second, 0 for as fast as possible")
+  parser.add_argument("--max-pending", type=int, default=1000, help="Maximum number of running handlers before feeding of events waits")
+  parser.add_argument("--output", default=None, help="Path of JSON report")
+  subparsers = parser.add_subparsers(dest="mode", required=True)
+
+  synthetic_parser = subparsers.add_parser("synthetic", help="Generate guild and events")
+  synthetic_parser.add_argument("--events", type=int, default=10000)
+  synthetic_parser.add_argument("--members", type=int, default=1000)
+  synthetic_parser.add_argument("--channels", type=int, default=20)
+  synthetic_parser.add_argument("--voice-channels", type=int, default=3)
+  synthetic_parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Relative weights of event kinds (default {DEFAULT_MIX})")
+  synthetic_parser.add_argument("--seed", type=int, default=0)
+
+  replay_parser = subparsers.add_parser("replay", help="Replay events recorded by bot")
+  replay_parser.add_argument("file")
+  replay_parser.add_argument("--speed", type=float, default=0, help="Multiplier of recorded timing, 0 for as fast as possible (ignored when rate is set)")
+
+  args = parser.parse_args()
+  if args.mode == "synthetic":
+    args.speed = 0
+  if args.connect_string is not None:
+    # Has to be set before database module is imported
+    config.db.connect_string = args.connect_string
+
+  asyncio.run(main(args))
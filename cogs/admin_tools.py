@@ -1,18 +1,20 @@
 import asyncio
 import datetime
+import time
 import disnake
 from disnake.ext import commands
-from typing import Union, List, Optional
-from Levenshtein import ratio
+from typing import Union, Optional
 import humanize
 
 from config import cooldowns, config
 from features.base_cog import Base_Cog
 from util import general_util
-from database import messages_repo, users_repo, channels_repo
+from database import messages_repo, users_repo, message_rollups_repo
 from static_data.strings import Strings
 from util.logger import setup_custom_logger
 from features.paginator import EmbedView
+from features.backfill import HistoryBackfill
+from features import member_resolver
 
 logger = setup_custom_logger(__name__)
 
@@ -23,7 +25,7 @@ class AdminTools(Base_Cog):
   async def delete_users_messages(self, user_id: int, guild_id: int, hours_back: float):
     delete_message_count = 0
 
-    messages = messages_repo.get_messages_of_member(user_id, guild_id, hours_back)
+    messages = await messages_repo.get_messages_of_member(user_id, guild_id, hours_back)
     for message_it in messages:
       message = await message_it.to_object(self.bot)
       if message is None: continue
@@ -52,12 +54,12 @@ class AdminTools(Base_Cog):
     if first_message is None or last_message is None:
       return await general_util.generate_error_message(ctx, Strings.admin_tools_clean_raid_messages_not_found)
 
-    joined_users_items = users_repo.members_joined_in_timeframe(first_message.author.joined_at, last_message.author.joined_at, ctx.guild.id)
+    joined_users_items = await users_repo.members_joined_in_timeframe(first_message.author.joined_at, last_message.author.joined_at, ctx.guild.id)
 
     statuses = []
     some_failed = False
     for user_it in joined_users_items:
-      delete_message_count = await self.delete_users_messages(int(user_it.id), ctx.guild.id, hours_back)
+      delete_message_count = await self.delete_users_messages(user_it.id, ctx.guild.id, hours_back)
       statuses.append(f"{user_it.nick} - Deleted {delete_message_count} messages")
 
     embed = disnake.Embed(title="Clean raid report", description=general_util.truncate_string("\n".join(statuses), 4000), color=disnake.Color.orange() if some_failed else disnake.Color.green())
@@ -77,16 +79,18 @@ class AdminTools(Base_Cog):
     if first_message is None or last_message is None:
       return await general_util.generate_error_message(ctx, Strings.admin_tools_destroy_raid_messages_not_found)
 
-    joined_users_items = users_repo.members_joined_in_timeframe(first_message.author.joined_at, last_message.author.joined_at, ctx.guild.id)
+    joined_users_items = await users_repo.members_joined_in_timeframe(first_message.author.joined_at, last_message.author.joined_at, ctx.guild.id)
+
+    members = await member_resolver.get_members(ctx.guild, [user_it.id for user_it in joined_users_items])
 
     statuses = []
     some_failed = False
     for user_it in joined_users_items:
       delete_message_count = None
       if hours_back > 0:
-        delete_message_count = await self.delete_users_messages(int(user_it.id), ctx.guild.id, hours_back)
+        delete_message_count = await self.delete_users_messages(user_it.id, ctx.guild.id, hours_back)
 
-      member = await general_util.get_or_fetch_member(ctx.guild, int(user_it.id))
+      member = members.get(user_it.id)
       if member is None:
         statuses.append(f"{user_it.nick} not banned (not found)" + f" - Deleted {delete_message_count} messages" if delete_message_count is not None else "")
         some_failed = True
@@ -145,25 +149,16 @@ class AdminTools(Base_Cog):
                             search_term: str=commands.Param(description="Term to search in messages"),
                             match_with_levenshtein: bool=commands.Param(default=False, description="Use Levenshtein distance for searching"),
                             member: Optional[disnake.Member]=commands.Param(default=None, description="Filter only specific member"),
+                            channel: Optional[Union[disnake.TextChannel, disnake.Thread]]=commands.Param(default=None, description="Filter only specific channel or thread"),
                             limit: int=commands.Param(default=100, description="Limit number of messages to retrieve")):
     await inter.response.defer(with_message=True, ephemeral=True)
 
-    message_iterator = messages_repo.get_messages_iterator(inter.guild_id, member.id if member is not None else None)
-
-    messages = []
-    number_of_messages = 0
-    for message_item in message_iterator:
-      if message_item.content is None: continue
-      if (search_term.lower() in message_item.content.lower()) \
-          if not match_with_levenshtein else \
-          (ratio(search_term.lower(), message_item.content.lower()) > 0.7):
-        messages.append(message_item)
-        number_of_messages += 1
-        await asyncio.sleep(0.0005)
-        if number_of_messages >= limit:
-          break
-
-    if number_of_messages == 0:
+    if not match_with_levenshtein:
+      messages = await messages_repo.search_messages(inter.guild_id, search_term, member.id if member is not None else None, channel.id if channel is not None else None, limit=limit)
+    else:
+      messages = await messages_repo.search_messages_fuzzy(inter.guild_id, search_term, member.id if member is not None else None, channel.id if channel is not None else None, limit=limit)
+
+    if not messages:
       return await general_util.generate_error_message(inter, "No match found")
 
     messages.reverse()
@@ -198,66 +193,29 @@ class AdminTools(Base_Cog):
   @commands.max_concurrency(1, per=commands.BucketType.default)
   @cooldowns.huge_cooldown
   async def pull_data(self, inter: disnake.CommandInteraction, days_back: float=commands.Param(default=None, description="Days back to pull data", min_value=0.0)):
-    async def save_messages(message_it: disnake.abc.HistoryIterator):
-      retries = 0
-      while True:
-        try:
-          async for message in message_it:
-            if message.author.bot or message.author.system: continue
-            messages_repo.add_or_set_message(message, commit=False)
-            await asyncio.sleep(0.2)
-          break
-        except disnake.Forbidden:
-          return
-        except disnake.HTTPException:
-          retries += 1
-          if retries >= 10:
-            logger.warning("Limit reached 10x, skipping")
-            break
-
-          logger.warning("Limit reached, waiting")
-          await asyncio.sleep(60)
-
     await inter.response.defer(with_message=True, ephemeral=True)
-    logger.info("Starting members pulling")
-
-    for guild in self.bot.guilds:
-      members = guild.members
-      for member in members:
-        if member.bot or member.system: continue
-        users_repo.get_or_create_member_if_not_exist(member)
-
-    logger.info("Starting channels pulling")
-    channels = []
-    for guild in self.bot.guilds:
-      channels.extend(await guild.fetch_channels())
+    logger.info("Starting data pulling")
 
-    for channel in channels:
-      if isinstance(channel, (disnake.VoiceChannel, disnake.StageChannel, disnake.TextChannel, disnake.ForumChannel, disnake.Thread)):
-        channels_repo.get_or_create_text_channel_if_not_exist(channel)
-        await asyncio.sleep(0.2)
+    after = datetime.datetime.utcnow() - datetime.timedelta(days=config.essentials.delete_messages_after_days if days_back is None else days_back)
+    backfill = HistoryBackfill(self.bot, after, config.essentials.backfill_concurrency, config.essentials.backfill_page_size)
+    await backfill.run(self.bot.guilds)
 
-    channels_repo.session.commit()
-
-    logger.info("Starting messages pulling")
+    logger.info("Data pulling completed")
 
-    for channel in channels:
-      if isinstance(channel, (disnake.VoiceChannel, disnake.StageChannel, disnake.TextChannel, disnake.ForumChannel, disnake.Thread)):
-        messages_it = channel.history(limit=None, oldest_first=True, after=datetime.datetime.utcnow() - datetime.timedelta(days=config.essentials.delete_messages_after_days if days_back is None else days_back))
-        await save_messages(messages_it)
-        messages_repo.session.commit()
+    if not inter.is_expired():
+      await inter.send(content=Strings.admin_tools_pull_data_pulling_complete)
 
-        if hasattr(channel, "threads"):
-          threads: List[disnake.Thread] = channel.threads
-          for thread in threads:
-            messages_it = thread.history(limit=None, oldest_first=True, after=datetime.datetime.utcnow() - datetime.timedelta(days=config.essentials.delete_messages_after_days if days_back is None else days_back))
-            await save_messages(messages_it)
-            messages_repo.session.commit()
+  @essentials.sub_command(description=Strings.admin_tools_sync_history_description)
+  @commands.max_concurrency(1, per=commands.BucketType.default)
+  @cooldowns.huge_cooldown
+  async def sync_history(self, inter: disnake.CommandInteraction):
+    await inter.response.defer(with_message=True, ephemeral=True)
 
-    logger.info("Data pulling completed")
+    # Run by data collection so it's serialized with syncs on connect, flushes ingest queue first and enables moving of checkpoints by live messages
+    inserted_messages = await self.bot.get_cog("DataCollection").sync_history()
 
     if not inter.is_expired():
-      await inter.send(content=Strings.admin_tools_pull_data_pulling_complete)
+      await inter.send(content=Strings.admin_tools_sync_history_complete(messages=inserted_messages))
 
   @essentials.sub_command(description=Strings.admin_tools_purge_bot_messages_description)
   @cooldowns.default_cooldown
@@ -271,11 +229,22 @@ class AdminTools(Base_Cog):
       return
     await general_util.generate_error_message(inter, Strings.admin_tools_purge_bot_messages_invalid_channel)
 
+  @essentials.sub_command(description=Strings.admin_tools_rebuild_rollups_description)
+  @commands.max_concurrency(1, per=commands.BucketType.default)
+  @cooldowns.huge_cooldown
+  @commands.guild_only()
+  async def rebuild_rollups(self, inter: disnake.CommandInteraction):
+    await inter.response.defer(with_message=True, ephemeral=True)
+
+    start_time = time.perf_counter()
+    await message_rollups_repo.rebuild(inter.guild_id)
+    await general_util.generate_success_message(inter, Strings.admin_tools_rebuild_rollups_rebuilt(time=time.perf_counter() - start_time))
+
   @essentials.sub_command(name="remove_data", description=Strings.admin_tools_remove_message_data_description)
   @cooldowns.long_cooldown
   @commands.guild_only()
   async def remove_message_data(self, inter: disnake.CommandInteraction, member: disnake.Member=commands.Param(description="User for which delete the message data")):
-    messages_repo.remove_message_data(member.author.id, member.guild.id)
+    await messages_repo.remove_message_data(member.author.id, member.guild.id)
     await general_util.generate_success_message(inter, Strings.admin_tools_remove_message_data_deleted)
 
 def setup(bot):
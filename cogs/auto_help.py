@@ -13,24 +13,24 @@ from static_data.strings import Strings
 
 logger = setup_custom_logger(__name__)
 
-def getApproximateAnswer(q):
+async def getApproximateAnswer(q):
   max_score = 0
   answer_id = -1
   ref_question = None
 
-  questions = questions_and_answers_repo.get_all_questions()
+  questions = await questions_and_answers_repo.get_all_questions()
 
   for ans_id, question in questions:
     score = ratio(question, q)
     if score >= 0.9:
-      return question, questions_and_answers_repo.get_answer_by_id(ans_id), score
+      return question, await questions_and_answers_repo.get_answer_by_id(ans_id), score
     elif score > max_score:
       max_score = score
       answer_id = ans_id
       ref_question = question
 
   if (max_score * 100) > config.questions_and_answers.score_limit:
-    return ref_question, questions_and_answers_repo.get_answer_by_id(answer_id), max_score
+    return ref_question, await questions_and_answers_repo.get_answer_by_id(answer_id), max_score
   return None, None, None
 
 class AutoHelp(Base_Cog):
@@ -47,7 +47,7 @@ class AutoHelp(Base_Cog):
     channel = message.channel.parent if isinstance(message.channel, disnake.Thread) else message.channel
     if channel.id != config.ids.help_channel: return
 
-    ref_question, answer, score = getApproximateAnswer(message.content)
+    ref_question, answer, score = await getApproximateAnswer(message.content)
     if answer is None: return
 
     logger.info(f"Found answer for users question: `{message.content}`\nReference question: `{ref_question}`\nAnswer: `{answer}`")
@@ -66,13 +66,13 @@ class AutoHelp(Base_Cog):
   @question_and_answer.sub_command(name="remove", description=Strings.questions_and_answers_remove_description)
   @commands.check(general_util.is_mod)
   async def add_question_and_answer(self, inter: disnake.CommandInteraction, question: str):
-    questions_and_answers_repo.remove_question(question)
+    await questions_and_answers_repo.remove_question(question)
     await general_util.generate_success_message(inter, Strings.questions_and_answers_remove_removed)
 
   @question_and_answer.sub_command(name="list", description=Strings.questions_and_answers_list_description)
   @cooldowns.default_cooldown
   async def question_and_answer_list(self, inter: disnake.CommandInteraction):
-    data = questions_and_answers_repo.get_all()
+    data = await questions_and_answers_repo.get_all()
 
     question_answer_pairs = [f"**Question:** {question}\n**Answer:** {answer}\n" for question, answer in data]
 
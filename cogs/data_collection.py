@@ -1,19 +1,47 @@
+import asyncio
+import time
 import disnake
 from disnake.ext import commands, tasks
 from typing import Union
 
 from util.logger import setup_custom_logger
 from config import config
-from database import messages_repo, users_repo, user_metrics_repo, guilds_repo, channels_repo
+from database import database_manipulation, messages_repo, users_repo, user_metrics_repo, guilds_repo, channels_repo, identity_cache
 from features.base_cog import Base_Cog
 from features import before_message_context
+from features.message_ingest_queue import MessageIngestQueue
+from features.backfill import HistoryBackfill
 
 logger = setup_custom_logger(__name__)
 
+# Body of daily cleanup, outside of cog so benchmarks.repo_benchmark can run it without bot
+async def run_cleanup():
+  async def run_phase(name: str, coroutine):
+    start_time = time.perf_counter()
+    removed = await coroutine
+    logger.info(f"Cleanup phase `{name}` removed {removed} rows in {time.perf_counter() - start_time:.2f}s")
+
+  logger.info("Starting cleanup")
+  await database_manipulation.maintain_partitions()
+  if config.essentials.delete_left_users_after_days > 0:
+    await run_phase("left members", users_repo.delete_left_members(config.essentials.delete_left_users_after_days, config.essentials.cleanup_chunk_size))
+  if config.essentials.delete_messages_after_days > 0:
+    await run_phase("old messages", messages_repo.delete_old_messages(config.essentials.delete_messages_after_days, config.essentials.cleanup_chunk_size))
+
+  await run_phase("users without members", users_repo.delete_users_without_members())
+  logger.info("Cleanup finished")
+
 class DataCollection(Base_Cog):
   def __init__(self, bot):
     super(DataCollection, self).__init__(bot, __file__)
 
+    self.ingest_queue = MessageIngestQueue(config.essentials.message_ingest_batch_size, config.essentials.message_ingest_max_attempts, config.essentials.message_ingest_max_retry_seconds)
+    self.history_sync_lock = asyncio.Lock()
+    # Number of gateway disconnects, sync during which bot disconnected can't cover what was missed
+    self.disconnects = 0
+    if not self.ingest_flush_task.is_running():
+      self.ingest_flush_task.start()
+
     if not self.cleanup_taks.is_running():
       self.cleanup_taks.start()
 
@@ -32,6 +60,36 @@ class DataCollection(Base_Cog):
     if not self.user_update_task.is_running():
       self.user_update_task.start()
 
+    if config.essentials.sync_history_on_connect:
+      await self.sync_history()
+
+  @commands.Cog.listener()
+  async def on_resumed(self):
+    # Events missed during short disconnect are replayed by gateway, only cached channels are checked without expensive discovery
+    if config.essentials.sync_history_on_connect:
+      await self.sync_history(discover=False)
+
+  @commands.Cog.listener()
+  async def on_disconnect(self):
+    # Messages missed until next sync must not be skipped by checkpoints moved by live messages
+    self.disconnects += 1
+    self.ingest_queue.advance_checkpoints = False
+
+  # Collect messages sent while bot was offline, returns number of new messages
+  # Sync requested while other one runs waits for it, running one may not cover newer disconnect
+  async def sync_history(self, discover: bool=True) -> int:
+    async with self.history_sync_lock:
+      disconnects = self.disconnects
+      # Write what was already received so checkpoints don't skip over it
+      await self.ingest_queue.flush()
+      backfill = HistoryBackfill(self.bot, None, config.essentials.backfill_concurrency, config.essentials.backfill_page_size, discover=discover)
+      await backfill.run(self.bot.guilds)
+
+      # Gap of disconnect during sync or of failed channel is still open, next sync enables it
+      if disconnects == self.disconnects and backfill.failed_channels == 0:
+        self.ingest_queue.advance_checkpoints = True
+      return backfill.inserted_messages
+
   def cog_unload(self) -> None:
     if self.cleanup_taks.is_running():
       self.cleanup_taks.cancel()
@@ -40,40 +98,49 @@ class DataCollection(Base_Cog):
       self.user_stats_task.cancel()
 
     if self.user_update_task.is_running():
-      self.user_update_task.start()
+      self.user_update_task.cancel()
+
+    # Stop gracefully so running flush isn't interrupted and write the rest
+    self.ingest_flush_task.stop()
+    self.ingest_queue.close_in_background()
+
+  async def handle_shutdown(self):
+    self.ingest_flush_task.stop()
+    await self.ingest_queue.close()
+
+  @tasks.loop(seconds=config.essentials.message_ingest_flush_interval_ms / 1000)
+  async def ingest_flush_task(self):
+    await self.ingest_queue.flush()
 
   @tasks.loop(minutes=5)
   async def user_stats_task(self):
     guilds = self.bot.guilds
     for guild in guilds:
-      user_metrics_repo.add_user_metrics(guild)
-    user_metrics_repo.session.commit()
+      await user_metrics_repo.add_user_metrics(guild)
+
+    await user_metrics_repo.downsample_user_metrics(config.essentials.user_metrics_raw_retention_days, config.essentials.user_metrics_hourly_retention_days)
 
   @commands.Cog.listener()
   async def on_raw_thread_update(self, after: disnake.Thread):
-    thread_it = channels_repo.get_thread(after.id)
-    if thread_it is not None:
-      thread_it.archived = after.archived
-      thread_it.locked = after.locked
-      channels_repo.session.commit()
+    await channels_repo.update_thread(after)
 
   @commands.Cog.listener()
   async def on_thread_create(self, thread: disnake.Thread):
-    channels_repo.get_or_create_text_thread(thread)
+    await channels_repo.get_or_create_text_thread(thread)
 
   @commands.Cog.listener()
   async def on_raw_thread_delete(self, payload: disnake.RawThreadDeleteEvent):
-    channels_repo.remove_thread(payload.thread_id)
+    await channels_repo.remove_thread(payload.thread_id)
 
   @commands.Cog.listener()
   async def on_guild_channel_create(self, channel: disnake.abc.GuildChannel):
     if isinstance(channel, (disnake.TextChannel, disnake.VoiceChannel, disnake.StageChannel, disnake.ForumChannel)):
-      channels_repo.get_or_create_text_channel_if_not_exist(channel)
+      await channels_repo.ensure_text_channel(channel)
 
   @commands.Cog.listener()
   async def on_guild_channel_delete(self, channel: disnake.abc.GuildChannel):
     if isinstance(channel, (disnake.TextChannel, disnake.VoiceChannel, disnake.StageChannel, disnake.ForumChannel)):
-      channels_repo.remove_channel(channel.id)
+      await channels_repo.remove_channel(channel.id)
 
   @commands.Cog.listener()
   async def on_message(self, message: disnake.Message):
@@ -81,87 +148,58 @@ class DataCollection(Base_Cog):
     if message.author.bot or message.author.system: return
     if message.content.startswith(config.base.command_prefix): return
 
-    messages_repo.add_or_set_message(message, commit=True)
+    self.ingest_queue.push_message(message)
 
   async def handle_message_edited(self, _, after: disnake.Message):
     if after.guild is None: return
     if after.author.bot or after.author.system: return
     if after.content.startswith(config.base.command_prefix): return
 
-    if not users_repo.can_collect_data(after.author.id, after.guild.id):
-      return
-
-    messages_repo.add_or_set_message(after)
+    self.ingest_queue.push_message(after)
 
   async def handle_message_deleted(self, message: Union[disnake.RawMessageDeleteEvent, before_message_context.BeforeMessageContext]):
     message_id = message.message_id if isinstance(message, disnake.RawMessageDeleteEvent) else message.id
-    messages_repo.delete_message(message_id, commit=True)
+    self.ingest_queue.push_delete(message_id)
 
   @commands.Cog.listener()
   async def on_member_update(self, _, after: disnake.Member):
-    user_it = users_repo.get_or_create_member_if_not_exist(after)
-    user_it.nick = after.display_name
-    user_it.icon_url = after.display_avatar.url
-    user_it.premium = after.premium_since is not None
-    users_repo.session.commit()
+    await users_repo.update_member(after)
 
   @commands.Cog.listener()
   async def on_user_update(self, _, after: disnake.User):
-    user_it = users_repo.get_or_create_user_if_not_exist(after)
-    user_it.name = after.name
-    users_repo.session.commit()
+    await users_repo.update_user(after)
 
   @commands.Cog.listener()
   async def on_member_join(self, member: disnake.Member):
-    users_repo.get_or_create_member_if_not_exist(member)
+    await users_repo.ensure_member(member)
 
   @commands.Cog.listener()
   async def on_member_remove(self, member: disnake.Member):
-    users_repo.set_member_left(member)
+    await users_repo.set_member_left(member)
 
   @commands.Cog.listener()
   async def on_guild_join(self, guild: disnake.Guild):
-    guilds_repo.get_or_create_guild_if_not_exist(guild)
-    for member in guild.members:
-      users_repo.get_or_create_member_if_not_exist(member)
+    await guilds_repo.get_or_create_guild_if_not_exist(guild)
+    await users_repo.get_or_create_members(guild.members)
 
   @commands.Cog.listener()
   async def on_guild_remove(self, guild: disnake.Guild):
-    guilds_repo.remove_guild(guild.id)
+    await guilds_repo.remove_guild(guild.id)
 
   @tasks.loop(hours=24)
   async def cleanup_taks(self):
-    logger.info("Starting cleanup")
-    if config.essentials.delete_left_users_after_days > 0:
-      users_repo.delete_left_members(config.essentials.delete_left_users_after_days, commit=False)
-    if config.essentials.delete_messages_after_days > 0:
-      messages_repo.delete_old_messages(config.essentials.delete_messages_after_days, commit=False)
-
-    user_iterator = users_repo.get_all_users_iterator()
-    for user_it in user_iterator:
-      if len(user_it.members) == 0:
-        users_repo.session.delete(user_it)
-
-    users_repo.session.commit()
-    logger.info("Cleanup finished")
+    await run_cleanup()
 
   @tasks.loop(hours=1)
   async def user_update_task(self):
-    members = self.bot.get_all_members()
-    updated_users = []
-
-    for member in members:
-      if member.id not in updated_users:
-        updated_users.append(member.id)
-
-        user_it = users_repo.get_user(member.id)
-        if user_it is None:
-          users_repo.get_or_create_user_if_not_exist(member)
-          continue
+    members = {}
+    for member in self.bot.get_all_members():
+      if member.id not in members.keys():
+        members[member.id] = member
 
-        user_it.status = member.status
+    await users_repo.update_users_status(members.values())
 
-    users_repo.session.commit()
+    logger.info(f"Identity cache stats: {identity_cache.format_stats()}")
 
 def setup(bot):
   bot.add_cog(DataCollection(bot))
@@ -7,6 +7,7 @@ from PIL import Image, ImageDraw
 
 from config import cooldowns
 from features.base_cog import Base_Cog
+from features import cache_metrics
 from static_data.strings import Strings
 
 class Fun(Base_Cog):
@@ -14,6 +15,7 @@ class Fun(Base_Cog):
     super(Fun, self).__init__(bot, __file__)
 
     self.pet_cache = cachetools.LRUCache(maxsize=20)
+    self.pet_cache_metrics = cache_metrics.register("pet", lambda: len(self.pet_cache), self.pet_cache.maxsize)
 
   @commands.slash_command(name="pet", description=Strings.common_pet_brief)
   @cooldowns.short_cooldown
@@ -22,8 +24,10 @@ class Fun(Base_Cog):
       user = inter.author
 
     if user.id in self.pet_cache.keys():
+      self.pet_cache_metrics.hit()
       image_binary = self.pet_cache.get(user.id)
     else:
+      self.pet_cache_metrics.miss()
       if not user.avatar:
         url = user.display_avatar.with_format('png').url
       else:
@@ -12,6 +12,7 @@ from features.base_cog import Base_Cog
 from config import config, cooldowns
 from static_data.strings import Strings
 from features.paginator import EmbedView
+from features import member_resolver
 from database import help_threads_repo
 from util.logger import setup_custom_logger
 from util import general_util
@@ -43,14 +44,14 @@ class HelpThreader(Base_Cog):
     if isinstance(message.channel, disnake.Thread):
       thread = message.channel
 
-      if help_threads_repo.thread_exists(thread.id):
-        help_threads_repo.update_thread_activity(thread.id, datetime.datetime.utcnow())
+      if await help_threads_repo.thread_exists(thread.id):
+        await help_threads_repo.update_thread_activity(thread.id, datetime.datetime.utcnow())
 
   @tasks.loop(hours=24)
   async def close_unactive_threads_task(self):
     logger.info("[Auto close task] Starting cleaning cycle")
 
-    unactive_help_requests = help_threads_repo.get_unactive(config.help_threader.close_request_after_days_of_inactivity)
+    unactive_help_requests = await help_threads_repo.get_unactive(config.help_threader.close_request_after_days_of_inactivity)
     help_channel: Optional[disnake.TextChannel] = self.bot.get_channel(config.ids.help_channel)
 
     if help_channel is None:
@@ -58,7 +59,7 @@ class HelpThreader(Base_Cog):
       return
 
     for help_req_item in unactive_help_requests:
-      thread: Optional[disnake.Thread] = help_req_item.thread.to_object(self.bot)
+      thread: Optional[disnake.Thread] = await help_req_item.thread.to_object(self.bot)
       if thread is None:
         # Thread don't exist
         logger.info(f"[Auto close task] Thread {help_req_item.thread_id} don't exist")
@@ -106,15 +107,12 @@ class HelpThreader(Base_Cog):
           logger.info(f"[Auto close task] Last activity date for thread {thread.id} was outdated, updating it")
 
           if last_message.created_at > help_req_item.last_activity_time:
-            help_req_item.last_activity_time = last_message.created_at
+            await help_threads_repo.update_thread_activity(thread.id, last_message.created_at)
 
       # Some delay to easy the strain on discord api
       await asyncio.sleep(10)
 
-      # Commit potential updates of last activity
-    help_threads_repo.session.commit()
-
-    help_threads_repo.delete_unactive(config.help_threader.close_request_after_days_of_inactivity)
+    await help_threads_repo.delete_unactive(config.help_threader.close_request_after_days_of_inactivity)
 
     logger.info("[Auto close task] Cleaning cycle finished")
 
@@ -135,7 +133,7 @@ class HelpThreader(Base_Cog):
       thread = await help_channel.create_thread(name=title, message=message, auto_archive_duration=1440, reason=f"Help request from {main_guild_member}")
       await thread.add_user(interaction.author)
 
-      if help_threads_repo.create_thread(thread, main_guild_member, tags) is None:
+      if await help_threads_repo.create_thread(thread, main_guild_member, tags) is None:
         return await general_util.generate_error_message(interaction, Strings.help_threader_request_create_failed)
 
       await thread.send(Strings.help_threader_announcement)
@@ -162,30 +160,32 @@ class HelpThreader(Base_Cog):
   @cooldowns.long_cooldown
   async def help_requests_list(self, inter: disnake.CommandInteraction):
     unanswered_threads = []
-    all_records = help_threads_repo.get_all()
+    all_records = await help_threads_repo.get_all()
     help_channel: Optional[disnake.TextChannel] = self.bot.get_channel(config.ids.help_channel)
 
     if help_channel is None:
       return await general_util.generate_error_message(inter, Strings.help_threader_help_channel_not_found)
 
+    owners = await member_resolver.get_members(help_channel.guild, [record.member.id for record in all_records if record.member_iid is not None])
+
     for record in all_records:
       help_thread: Optional[disnake.Thread] = await record.thread.to_object(self.bot)
       if help_thread is None:
         logger.info(f"Thread {record.thread_id} don't exist")
-        help_threads_repo.delete_thread(int(record.thread_id))
+        await help_threads_repo.delete_thread(record.thread_id)
         continue
 
       if help_thread.locked:
         # Thread is closed
         logger.info(f"Thread {help_thread.id} is closed")
-        help_threads_repo.delete_thread(help_thread.id)
+        await help_threads_repo.delete_thread(help_thread.id)
         continue
 
-      owner = await record.member.to_object(self.bot) if record.member_iid is not None else None
+      owner = owners.get(record.member.id) if record.member_iid is not None else None
       if owner is None:
         # Owner of that thread is not on server anymore
         logger.info(f"Owner of thread {help_thread.id} is not on server anymore")
-        help_threads_repo.delete_thread(help_thread.id)
+        await help_threads_repo.delete_thread(help_thread.id)
         continue
 
       if help_thread.archived:
@@ -219,16 +219,16 @@ class HelpThreader(Base_Cog):
   @help_requests.sub_command(name="solved", description=Strings.help_threader_request_solved_brief)
   async def help_requests_solved(self, inter: disnake.CommandInteraction):
     thread_message_id = inter.channel_id
-    record = help_threads_repo.get_thread(thread_message_id)
+    record = await help_threads_repo.get_thread(thread_message_id)
 
     if record is None:
       return await general_util.generate_error_message(inter, Strings.help_threader_request_solved_not_found)
 
 
-    if (record.member is None or int(record.member.id) != inter.author.id) and not general_util.is_mod(inter):
+    if (record.member is None or record.member.id != inter.author.id) and not general_util.is_mod(inter):
       return await general_util.generate_error_message(inter, Strings.help_threader_request_solved_not_owner)
 
-    help_threads_repo.delete_thread(thread_message_id)
+    await help_threads_repo.delete_thread(thread_message_id)
     await general_util.generate_success_message(inter, Strings.help_threader_request_solved_closed)
 
     try:
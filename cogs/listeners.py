@@ -59,7 +59,7 @@ class Listeners(Base_Cog):
     if payload.cached_message is not None:
       before = BeforeMessageContext.from_message(payload.cached_message)
     else:
-      message_item = messages_repo.get_message(payload.message_id)
+      message_item = await messages_repo.get_message(payload.message_id)
       if message_item is None:
         before = payload
       else:
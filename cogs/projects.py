@@ -29,7 +29,7 @@ class Projects(Base_Cog):
 
   @staticmethod
   async def projects_list_autocomplete(_, search_string: str):
-    projects = projects_repo.get_all()
+    projects = await projects_repo.get_all()
     project_names = [project.name for project in projects]
     if search_string is None or search_string == "":
       return project_names
@@ -38,7 +38,7 @@ class Projects(Base_Cog):
   @projects.sub_command(name="remove", description=Strings.projects_remove_project_brief)
   @commands.check(general_util.is_mod)
   async def remove_project(self, inter: disnake.CommandInteraction, project_name: str = commands.Param(autocomplete=projects_list_autocomplete, description="Name of project to delete")):
-    if projects_repo.remove_project(project_name):
+    if await projects_repo.remove_project(project_name):
       await general_util.generate_success_message(inter, Strings.projects_remove_project_removed(name=project_name))
     else:
       await general_util.generate_error_message(inter, Strings.projects_remove_project_failed(name=project_name))
@@ -46,7 +46,7 @@ class Projects(Base_Cog):
   @projects.sub_command(name="get", description=Strings.projects_project_get_brief)
   @cooldowns.short_cooldown
   async def project_get(self, inter: disnake.CommandInteraction, project_name: str = commands.Param(autocomplete=projects_list_autocomplete, description="Name of project to show")):
-    project = projects_repo.get_by_name(project_name)
+    project = await projects_repo.get_by_name(project_name)
     if project is None:
       return await general_util.generate_error_message(inter, Strings.projects_project_get_not_found(name=project_name))
 
@@ -58,7 +58,7 @@ class Projects(Base_Cog):
   @commands.Cog.listener()
   async def on_modal_submit(self, inter: disnake.ModalInteraction):
     if inter.custom_id == "add_project":
-      project = projects_repo.add_project(project_name=inter.text_values["add_project:name"], project_description=inter.text_values["add_project:description"])
+      project = await projects_repo.add_project(project_name=inter.text_values["add_project:name"], project_description=inter.text_values["add_project:description"])
       if project is None:
         await general_util.generate_error_message(inter, Strings.projects_add_project_failed(name=inter.text_values["add_project:name"]))
       else:
@@ -1,48 +1,136 @@
 # Collect and show stats of main guild
 
+import asyncio
 import datetime
+import traceback
 import disnake
-from disnake.ext import commands
-from typing import Tuple, Dict
-import pandas as pd
-import numpy as np
-from collections import Counter
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import matplotlib.dates as mdates
-from matplotlib import style
-from matplotlib.font_manager import FontProperties
+from disnake.ext import commands, tasks
+from typing import Tuple, Dict, List, Optional, Set
 import io
 
-style.use("dark_background")
-font_prop = FontProperties()
-font_prop.set_file("static_data/STIXTwoText-Bold.ttf")
-plt.rcParams["font.family"] = font_prop.get_family()
-
-style.use("dark_background")
-
 from config import cooldowns
 from util import general_util
 from config import config
 from features.base_cog import Base_Cog
-from database import user_metrics_repo, messages_repo
+from features import cache_metrics, member_resolver
+from features.chart_renderer import ChartRenderer, render_versioned, user_activity_chart, community_report_chart
+from features.chart_cache import ChartCache
+from database import user_metrics_repo, message_rollups_repo
 from static_data.strings import Strings
 from util.logger import setup_custom_logger
 
 logger = setup_custom_logger(__name__)
 
-def df_match(c1, c2):
-  if c1 == c2:
-    return np.nan
-  else:
-    return c1
+USER_ACTIVITY_CHART = "user-activity"
+COMMUNITY_REPORT_CHART = "community-report"
 
 class Stats(Base_Cog):
   def __init__(self, bot):
     super(Stats, self).__init__(bot, __file__)
 
-    self.user_activity_image: Dict[int, Tuple[io.BytesIO, datetime.datetime]] = {}
-    self.community_report_image: Dict[int, Tuple[io.BytesIO, datetime.datetime]] = {}
+    self.chart_renderer = ChartRenderer(config.stats.chart_render_workers, config.stats.chart_render_timeout_seconds)
+    self.chart_cache = ChartCache(config.stats.chart_cache_directory, config.stats.chart_cache_max_mb * 1024 * 1024)
+    self.chart_locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+    # Refreshes of stale charts started by requests, referenced until they finish
+    self.refresh_tasks: Set[asyncio.Task] = set()
+    # Guild id -> time of last stats command, charts of guilds where stats are used are kept fresh
+    self.last_requests: Dict[int, datetime.datetime] = {}
+    self.user_activity_image_metrics = cache_metrics.register("stats_user_activity", lambda: self.count_cached_charts(USER_ACTIVITY_CHART))
+    self.community_report_image_metrics = cache_metrics.register("stats_community_report", lambda: self.count_cached_charts(COMMUNITY_REPORT_CHART))
+
+    self.chart_refresh_task.change_interval(minutes=config.stats.max_graph_minutes_age_for_regenerate)
+    if self.bot.is_ready() and not self.chart_refresh_task.is_running():
+      self.chart_refresh_task.start()
+
+  def cog_unload(self) -> None:
+    if self.chart_refresh_task.is_running():
+      self.chart_refresh_task.cancel()
+    for task in self.refresh_tasks:
+      task.cancel()
+    self.chart_renderer.close()
+
+  @commands.Cog.listener()
+  async def on_ready(self):
+    if not self.chart_refresh_task.is_running():
+      self.chart_refresh_task.start()
+
+  def count_cached_charts(self, chart: str) -> int:
+    return sum(1 for entry in self.chart_cache.entries.values() if entry.chart == chart)
+
+  def get_active_guilds(self) -> List[disnake.Guild]:
+    threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=config.stats.active_guild_hours)
+    guild_ids = {config.ids.main_guild, *[guild_id for guild_id, requested_at in self.last_requests.items() if requested_at > threshold]}
+    guilds = [self.bot.get_guild(guild_id) for guild_id in guild_ids]
+    return [guild for guild in guilds if guild is not None]
+
+  async def resolve_names(self, guild: disnake.Guild, counts: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+    names = await member_resolver.get_names(guild, [author_id for author_id, _ in counts])
+    return [(general_util.truncate_string(names[author_id], limit=config.stats.name_length_limit), count) for author_id, count in counts if author_id in names.keys()]
+
+  # Returns (version, image) where image is None when data didn't change since cached version, None when rendering failed
+  async def render_chart(self, guild: disnake.Guild, chart: str) -> Optional[Tuple[str, Optional[bytes]]]:
+    cached = self.chart_cache.get(guild.id, chart)
+    known_version = cached.version if cached is not None else None
+
+    if chart == USER_ACTIVITY_CHART:
+      all_channels = [channel.id for channel in guild.channels]
+      from_date = datetime.datetime.utcnow() - datetime.timedelta(days=config.stats.days_back)
+      top_authors = await message_rollups_repo.get_top_authors(guild.id, {"overall": all_channels, "help": [config.ids.help_channel]}, from_date, limit=10)
+
+      return await self.chart_renderer.render(render_versioned, user_activity_chart, known_version, await self.resolve_names(guild, top_authors["overall"]), await self.resolve_names(guild, top_authors["help"]),
+                                              config.stats.days_back, config.stats.graph_bg_color_code)
+
+    message_volume = await message_rollups_repo.get_message_volume(guild.id, config.stats.days_back)
+    users_metrics = await user_metrics_repo.get_user_metrics(guild.id, config.stats.days_back)
+    return await self.chart_renderer.render(render_versioned, community_report_chart, known_version, message_volume, users_metrics, config.stats.graph_bg_color_code)
+
+  async def refresh_chart(self, guild: disnake.Guild, chart: str) -> bool:
+    lock = self.chart_locks.setdefault((guild.id, chart), asyncio.Lock())
+    async with lock:
+      result = await self.render_chart(guild, chart)
+      if result is None: return False
+
+      version, image = result
+      if image is None:
+        await self.chart_cache.touch(guild.id, chart)
+      else:
+        await self.chart_cache.store(guild.id, chart, version, image)
+    return True
+
+  @tasks.loop(minutes=20)
+  async def chart_refresh_task(self):
+    for guild in self.get_active_guilds():
+      for chart in (USER_ACTIVITY_CHART, COMMUNITY_REPORT_CHART):
+        await self.refresh_chart(guild, chart)
+
+  def refresh_in_background(self, guild: disnake.Guild, chart: str):
+    task = asyncio.create_task(self.refresh_chart(guild, chart))
+    self.refresh_tasks.add(task)
+    task.add_done_callback(self.refresh_done)
+
+  def refresh_done(self, task: asyncio.Task):
+    self.refresh_tasks.discard(task)
+    if task.cancelled() or task.exception() is None: return
+
+    exception = task.exception()
+    logger.error(f"Background refresh of chart failed\n{''.join(traceback.format_exception(type(exception), exception, exception.__traceback__))}")
+
+  # Chart is always sent from cache, it's rendered on request only when guild has none yet
+  async def get_chart(self, guild: disnake.Guild, chart: str, metrics: cache_metrics.CacheMetrics) -> Optional[Tuple[bytes, datetime.datetime]]:
+    self.last_requests[guild.id] = datetime.datetime.utcnow()
+
+    cached = await self.chart_cache.read(guild.id, chart)
+    if cached is not None:
+      metrics.hit()
+      # Guild wasn't active so its chart is old, this time it's sent as it is and refreshed in background
+      if datetime.datetime.utcnow() - cached[1] > datetime.timedelta(minutes=config.stats.max_graph_minutes_age_for_regenerate):
+        self.refresh_in_background(guild, chart)
+      return cached
+
+    logger.info(f"Generating new {chart} chart")
+    metrics.miss()
+    if not await self.refresh_chart(guild, chart): return None
+    return await self.chart_cache.read(guild.id, chart)
 
   @commands.command(brief=Strings.stats_stats_brief)
   @cooldowns.default_cooldown
@@ -55,77 +143,14 @@ class Stats(Base_Cog):
   async def user_activity(self, ctx: commands.Context):
     await general_util.delete_message(self.bot, ctx)
 
-    if ctx.guild.id in self.user_activity_image.keys() and datetime.datetime.utcnow() - self.user_activity_image[ctx.guild.id][1] < datetime.timedelta(minutes=config.stats.max_graph_minutes_age_for_regenerate):
-      logger.info("Taking user activity from cache")
-
-      self.user_activity_image[ctx.guild.id][0].seek(0)
-      embed = disnake.Embed(title="User activity", color=disnake.Color.dark_blue())
-      general_util.add_author_footer(embed, ctx.author)
-      embed.set_image(file=disnake.File(self.user_activity_image[ctx.guild.id][0], "user_activity.png"))
-      return await ctx.send(embed=embed)
-
-    logger.info("Generating new user activity")
-    all_channels = [channel.id for channel in ctx.guild.channels]
-
-    message_history = messages_repo.get_message_metrics(ctx.guild.id, config.stats.days_back)
-    dataframe = pd.DataFrame.from_records(message_history, columns=["message_id", "timestamp", "author_id", "channel_id"])
-    dataframe["date"] = pd.to_datetime(dataframe["timestamp"], unit="s")
-    dataframe.set_index("date", inplace=True)
-    dataframe.drop("timestamp", axis=1, inplace=True)
-
-    user_id_counts_overall = Counter(dataframe[dataframe["channel_id"].isin(all_channels)]["author_id"].values).most_common(10)
-    uids_in_help = Counter(dataframe[dataframe["channel_id"].isin([config.ids.help_channel])]["author_id"].values).most_common(10)
-
-    fig = plt.figure(facecolor=config.stats.graph_bg_color_code)
-    fig.set_dpi(200)
-
-    ax1 = plt.subplot2grid((2, 1), (0, 0))
-
-    plt.xlabel("Message Volume")
-    plt.title(f"General User Activity (past {config.stats.days_back} days)")
-    ax1.set_facecolor(config.stats.graph_bg_color_code)
-
-    users = []
-    msgs = []
-    for pair in user_id_counts_overall[::-1]:
-      member = await general_util.get_or_fetch_member(ctx.guild, pair[0])
-      if member is not None:
-        users.append(general_util.truncate_string(member.display_name, limit=config.stats.name_length_limit))
-        msgs.append(pair[1])
-
-    y_pos = np.arange(len(users))
-    ax1.barh(y_pos, msgs, align='center', alpha=0.5)
-    plt.yticks(y_pos, users)
-
-    ax2 = plt.subplot2grid((2, 1), (1, 0))
-    plt.title(f"Help Channel Activity (past {config.stats.days_back} days)")
-    plt.xlabel("Help Channel\nMsg Volume")
-    ax2.set_facecolor(config.stats.graph_bg_color_code)
-
-    users = []
-    msgs = []
-    for pair in uids_in_help[::-1]:
-      member = await general_util.get_or_fetch_member(ctx.guild, pair[0])
-      if member is not None:
-        users.append(general_util.truncate_string(member.display_name, limit=config.stats.name_length_limit))
-        msgs.append(pair[1])
-
-    y_pos = np.arange(len(users))
-    ax2.barh(y_pos, msgs, align='center', alpha=0.5)
-    plt.yticks(y_pos, users)
-
-    plt.subplots_adjust(left=0.30, bottom=0.15, right=0.99, top=0.95, wspace=0.2, hspace=0.55)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, facecolor=fig.get_facecolor(), format='png')
-    buf.seek(0)
-    plt.clf()
-
-    self.user_activity_image[ctx.guild.id] = (buf, datetime.datetime.utcnow())
+    chart = await self.get_chart(ctx.guild, USER_ACTIVITY_CHART, self.user_activity_image_metrics)
+    if chart is None:
+      return await general_util.generate_error_message(ctx, Strings.stats_render_failed)
 
-    embed = disnake.Embed(title="User activity", color=disnake.Color.dark_blue())
+    image, rendered_at = chart
+    embed = disnake.Embed(title="User activity", color=disnake.Color.dark_blue(), timestamp=rendered_at.replace(tzinfo=datetime.timezone.utc))
     general_util.add_author_footer(embed, ctx.author)
-    embed.set_image(file=disnake.File(buf, "user_activity.png"))
+    embed.set_image(file=disnake.File(io.BytesIO(image), "user_activity.png"))
     await ctx.send(embed=embed)
 
   @commands.command(brief=Strings.stats_community_report_brief)
@@ -133,104 +158,15 @@ class Stats(Base_Cog):
   async def community_report(self, ctx: commands.Context):
     await general_util.delete_message(self.bot, ctx)
 
-    if ctx.guild.id in self.community_report_image.keys() and datetime.datetime.utcnow() - self.community_report_image[ctx.guild.id][1] < datetime.timedelta(minutes=config.stats.max_graph_minutes_age_for_regenerate):
-      logger.info("Taking community report from cache")
-
-      self.community_report_image[ctx.guild.id][0].seek(0)
-
-      online, idle, offline = general_util.get_user_stats(ctx.guild)
-      embed = disnake.Embed(title="Community report", description=f"Online: {online}\nIdle/busy/dnd: {idle}\nOffline: {offline}", color=disnake.Color.dark_blue())
-      general_util.add_author_footer(embed, ctx.author)
-      embed.set_image(file=disnake.File(self.community_report_image[ctx.guild.id][0], "community_report.png"))
-      return await ctx.send(embed=embed)
-
-    logger.info("Generating new community report")
-
-    message_history = messages_repo.get_message_metrics(ctx.guild.id, config.stats.days_back)
-    message_df = pd.DataFrame.from_records(
-      message_history,
-      columns=["message_id", "timestamp", "author_id", "channel_id"]
-    )
-    volume_df = (
-      message_df
-      .assign(date=lambda df: pd.to_datetime(df.timestamp, unit='s').dt.floor('H'))
-      .groupby('date')
-      .size()
-    )
-
-    users_metrics = user_metrics_repo.get_user_metrics(ctx.guild.id, config.stats.days_back)
-    users_metrics_df = pd.DataFrame.from_records(
-      users_metrics,
-      columns=["timestamp", "online", "idle", "offline"]
-    )
-    users_metrics_df = (
-      users_metrics_df
-      .assign(date=lambda df: pd.to_datetime(df.timestamp, unit='s').dt.floor('H'),
-              total=lambda df: df.online + df.offline + df.idle)
-      .drop(columns='timestamp')
-      .groupby('date')
-      .mean()
-    )
-    users_metrics_dataframe = pd.concat(
-      [users_metrics_df, volume_df.rename('count')],
-      axis=1
-    ).fillna(0)
-
-    fig = plt.figure(facecolor=config.stats.graph_bg_color_code)
-    fig.set_dpi(200)
-
-    ax1 = plt.subplot2grid((3, 1), (0, 0))
-    plt.ylabel("Active Users")
-    plt.title("Community Report")
-    ax1.set_facecolor(config.stats.graph_bg_color_code)
-    ax1v = ax1.twinx()
-    plt.ylabel("Message Volume")
-
-    ax2 = plt.subplot2grid((3, 1), (1, 0))
-    plt.ylabel("Users")
-    ax2.set_facecolor(config.stats.graph_bg_color_code)
-
-    ax3 = plt.subplot2grid((3, 1), (2, 0))
-    plt.ylabel("Total Users")
-    ax3.set_facecolor(config.stats.graph_bg_color_code)
-
-    ax1.plot(users_metrics_dataframe.index, users_metrics_dataframe.online, label="Active Users\n(Not Idle)")
-    # ax1v.bar(df.index, df["count"], width=0.01)
-
-    ax1v.fill_between(users_metrics_dataframe.index, 0, users_metrics_dataframe["count"], facecolor="w", alpha=0.2, label="Message Volume")
-    ax1.legend(loc=2)
-    ax1v.legend(loc=9)
-
-    ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.online.rolling(3).mean(), label="Online Users")
-    ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.idle.rolling(3).mean(), label="Idle Users")
-    ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.offline.rolling(3).mean(), label="Offline Users")
-    ax2.legend(loc=2)
-    ax2.get_xaxis().set_visible(False)
-
-    ax3.plot(users_metrics_dataframe.index, users_metrics_dataframe.total, label="Total Users")
-    ax3.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d\n%H:%M'))
-
-    # for label in ax2.xaxis.get_ticklabels():
-    #        label.set_rotation(45)
-    ax3.xaxis.set_major_locator(mticker.MaxNLocator(nbins=5, prune='lower'))
-    ax3.legend()
-
-    plt.subplots_adjust(left=0.11, bottom=0.10, right=0.89, top=0.95, wspace=0.2, hspace=0)
-    ax1.get_xaxis().set_visible(False)
-
-    ax1v.set_ylim(0, 3 * users_metrics_dataframe["count"].values.max())
-
-    buf = io.BytesIO()
-    plt.savefig(buf, facecolor=fig.get_facecolor(), format='png')
-    buf.seek(0)
-    plt.clf()
-
-    self.community_report_image[ctx.guild.id] = (buf, datetime.datetime.utcnow())
+    chart = await self.get_chart(ctx.guild, COMMUNITY_REPORT_CHART, self.community_report_image_metrics)
+    if chart is None:
+      return await general_util.generate_error_message(ctx, Strings.stats_render_failed)
 
+    image, rendered_at = chart
     online, idle, offline = general_util.get_user_stats(ctx.guild)
-    embed = disnake.Embed(title="Community report", description=f"Online: {online}\nIdle/busy/dnd: {idle}\nOffline: {offline}", color=disnake.Color.dark_blue())
+    embed = disnake.Embed(title="Community report", description=f"Online: {online}\nIdle/busy/dnd: {idle}\nOffline: {offline}", color=disnake.Color.dark_blue(), timestamp=rendered_at.replace(tzinfo=datetime.timezone.utc))
     general_util.add_author_footer(embed, ctx.author)
-    embed.set_image(file=disnake.File(buf, "community_report.png"))
+    embed.set_image(file=disnake.File(io.BytesIO(image), "community_report.png"))
     await ctx.send(embed=embed)
 
 def setup(bot):
@@ -1,8 +1,9 @@
 # Administration extension
 
 import disnake
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 import asyncio
+import datetime
 import math
 from typing import Optional
 
@@ -12,6 +13,8 @@ from util import general_util
 from util.logger import setup_custom_logger
 from static_data.strings import Strings
 from features.paginator import EmbedView
+from database import query_stats
+from features import handler_metrics
 
 logger = setup_custom_logger(__name__)
 
@@ -62,6 +65,27 @@ class System(Base_Cog):
     global_bot_reference = bot
     super(System, self).__init__(bot, __file__)
 
+    if config.monitoring.handler_metrics_file and config.monitoring.handler_metrics_export_interval_minutes > 0:
+      self.handler_metrics_export_task.change_interval(minutes=config.monitoring.handler_metrics_export_interval_minutes)
+      if not self.handler_metrics_export_task.is_running():
+        self.handler_metrics_export_task.start()
+
+  def cog_unload(self) -> None:
+    if self.handler_metrics_export_task.is_running():
+      self.handler_metrics_export_task.cancel()
+
+  async def export_handler_metrics(self):
+    await asyncio.to_thread(handler_metrics.write_snapshot, handler_metrics.snapshot(), config.monitoring.handler_metrics_file)
+
+  async def handle_shutdown(self):
+    if config.monitoring.handler_metrics_file and handler_metrics.handlers:
+      await self.export_handler_metrics()
+
+  @tasks.loop(minutes=5)
+  async def handler_metrics_export_task(self):
+    if handler_metrics.handlers:
+      await self.export_handler_metrics()
+
   @commands.slash_command(name="extensions")
   async def extensions(self, inter: disnake.CommandInteraction):
     pass
@@ -179,6 +203,81 @@ class System(Base_Cog):
 
     await EmbedView(inter.author, pages, perma_lock=True).run(inter)
 
+  @commands.slash_command(name="system")
+  async def system(self, inter: disnake.CommandInteraction):
+    pass
+
+  @system.sub_command(name="db_stats", description=Strings.system_db_stats_brief)
+  @commands.is_owner()
+  async def db_stats(self, inter: disnake.CommandInteraction, count: int=commands.Param(default=5, min_value=1, max_value=10, description="Number of queries shown on each page")):
+    if not config.db.query_stats:
+      return await general_util.generate_error_message(inter, Strings.system_db_stats_disabled)
+
+    if not query_stats.statements:
+      return await general_util.generate_error_message(inter, Strings.system_db_stats_empty)
+
+    pages = []
+    for order_by, title in (("total", "Top queries by total time"), ("count", "Top queries by count")):
+      embed = disnake.Embed(title=title, color=disnake.Color.dark_magenta())
+      for stats in query_stats.get_top_statements(order_by, count):
+        embed.add_field(name=general_util.truncate_string(stats.caller, 256),
+                        value=f"**{stats.count}x**, total {stats.total_ms:.0f}ms, avg {stats.average_ms:.1f}ms, p50 {stats.percentile_ms(0.5):.1f}ms, p95 {stats.percentile_ms(0.95):.1f}ms, max {stats.max_ms:.1f}ms\n```sql\n{general_util.truncate_string(stats.statement, 400)}\n```",
+                        inline=False)
+      pages.append(embed)
+
+    await EmbedView(inter.author, pages, perma_lock=True, invisible=True).run(inter)
+
+  @system.sub_command(name="loop_stats", description=Strings.system_loop_stats_brief)
+  @commands.is_owner()
+  async def loop_stats(self, inter: disnake.CommandInteraction):
+    sampler = self.bot.loop_lag_sampler
+    embed = disnake.Embed(title="Event loop", color=disnake.Color.dark_magenta())
+    embed.add_field(name="Lag", value=f"current {sampler.current_ms:.1f}ms, avg {sampler.average_ms:.1f}ms, p95 {sampler.percentile_ms(0.95):.1f}ms, p99 {sampler.percentile_ms(0.99):.1f}ms\nmax since start {sampler.max_lag_ms:.1f}ms ({len(sampler.samples)} samples)", inline=False)
+    embed.add_field(name="Gateway latency", value=", ".join(f"shard {shard_id}: {latency * 1000:.0f}ms" for shard_id, latency in self.bot.latencies) or "-", inline=False)
+    pages = [embed]
+
+    detector = self.bot.slow_callback_detector
+    if detector is None:
+      embed.add_field(name="Slow callbacks", value=Strings.system_loop_stats_detector_disabled, inline=False)
+    else:
+      slow_callbacks = detector.get_slow_callbacks()
+      embed.add_field(name="Slow callbacks", value=f"{len(slow_callbacks)} steps blocked loop longer than {detector.threshold * 1000:.0f}ms", inline=False)
+
+      for slow_callback in slow_callbacks:
+        page = disnake.Embed(title=f"Blocked for {slow_callback.duration_ms:.0f}ms", description=general_util.truncate_string(slow_callback.callback, 4000), color=disnake.Color.orange(), timestamp=slow_callback.timestamp.replace(tzinfo=datetime.timezone.utc))
+        if slow_callback.stack is not None:
+          page.add_field(name="Stack", value=f"```\n{general_util.truncate_string(slow_callback.stack, 1000, from_beginning=True)}\n```", inline=False)
+        pages.append(page)
+
+    await EmbedView(inter.author, pages, perma_lock=True, invisible=True).run(inter)
+
+  @system.sub_command(name="handler_stats", description=Strings.system_handler_stats_brief)
+  @commands.is_owner()
+  async def handler_stats(self, inter: disnake.CommandInteraction,
+                          order_by: str=commands.Param(default="total", choices=["total", "p95", "count"], description="Order of handlers"),
+                          export: bool=commands.Param(default=False, description="Also write statistics of all handlers to metrics file")):
+    if not handler_metrics.handlers:
+      return await general_util.generate_error_message(inter, Strings.system_handler_stats_empty)
+
+    if export:
+      if not config.monitoring.handler_metrics_file:
+        return await general_util.generate_error_message(inter, Strings.system_handler_stats_export_disabled)
+      await self.export_handler_metrics()
+      await general_util.generate_success_message(inter, Strings.system_handler_stats_exported(path=config.monitoring.handler_metrics_file))
+
+    handlers = handler_metrics.get_top_handlers(order_by)
+    pages = []
+    for batch in [handlers[i: i + 10] for i in range(0, len(handlers), 10)]:
+      embed = disnake.Embed(title="Handler latency", description=f"Ordered by {order_by}, percentiles of last {config.monitoring.handler_latency_samples} calls", color=disnake.Color.dark_magenta())
+      for stats in batch:
+        p50, p95, p99 = stats.percentiles_ms(0.5, 0.95, 0.99)
+        embed.add_field(name=general_util.truncate_string(f"{stats.kind}: {stats.name}", 256),
+                        value=f"**{stats.count}x** ({stats.failures} failed), total {stats.total_ms:.0f}ms\np50 {p50:.1f}ms, p95 {p95:.1f}ms, p99 {p99:.1f}ms, max {stats.max_ms:.1f}ms",
+                        inline=False)
+      pages.append(embed)
+
+    await EmbedView(inter.author, pages, perma_lock=True, invisible=True).run(inter)
+
   @commands.command(brief=Strings.system_logout_brief, aliases=["gtfo"])
   @commands.is_owner()
   async def logout(self, ctx: commands.Context):
@@ -13,10 +13,13 @@ from features.base_cog import Base_Cog
 from util.logger import setup_custom_logger
 from util import general_util
 from features.base_bot import BaseAutoshardedBot
+from features import cache_metrics
 
 logger = setup_custom_logger(__name__)
 
 message_cache = cachetools.FIFOCache(config.warden.message_cache_size)
+# Hit is message found to be duplicate of cached one
+message_cache_metrics = cache_metrics.register("warden_message_cache", lambda: len(message_cache), config.warden.message_cache_size)
 
 @dataclasses.dataclass
 class WardenMessageData:
@@ -158,6 +161,7 @@ class Warden(Base_Cog):
     # logger.info("Duplicate check finished")
 
     if content_max_similarity >= config.warden.medium_similarity or att_similar_object is not None:
+      message_cache_metrics.hit()
       if message.author.id in self.strikes.keys():
         self.strikes[message.author.id] += 1
       else:
@@ -168,6 +172,8 @@ class Warden(Base_Cog):
           await self.announce_content_duplicate(message, similar_object, content_max_similarity)
         if att_similar_object is not None and att_similar_object != similar_object:
           await self.announce_attachment_duplicate(message, att_similar_object)
+    else:
+      message_cache_metrics.miss()
 
   async def announce_content_duplicate(self, message: disnake.Message, similar_object: WardenMessageData, content_similarity: float):
     report_channel = await general_util.get_or_fetch_channel(self.bot, config.ids.warden_report_channel)
@@ -10,6 +10,7 @@ import cachetools
 from config import cooldowns
 from util import general_util
 from features.base_cog import Base_Cog
+from features import cache_metrics
 from features.paginator import EmbedView
 from database import weather_settings_repo
 from static_data.strings import Strings
@@ -148,6 +149,7 @@ class Weather(Base_Cog):
     super(Weather, self).__init__(bot, __file__)
 
     self.place_weather_prediction_cache = cachetools.LRUCache(maxsize=20)
+    self.place_weather_prediction_cache_metrics = cache_metrics.register("weather", lambda: len(self.place_weather_prediction_cache), self.place_weather_prediction_cache.maxsize)
 
   @commands.slash_command()
   async def weather(self, inter: disnake.CommandInteraction):
@@ -159,13 +161,13 @@ class Weather(Base_Cog):
     if not _place_is_valid(place):
       return general_util.generate_error_message(inter, Strings.weather_set_place_invalid_place)
 
-    weather_settings_repo.set_weather_settings(inter.author.id, place)
+    await weather_settings_repo.set_weather_settings(inter.author.id, place)
     await general_util.generate_success_message(inter, Strings.weather_set_place_set(place=place))
 
   @weather.sub_command(name="unset_place", description=Strings.weather_unset_place_brief)
   @cooldowns.default_cooldown
   async def unset_weather_place(self, inter: disnake.CommandInteraction):
-    if not weather_settings_repo.remove_weather_settings(inter.author.id):
+    if not await weather_settings_repo.remove_weather_settings(inter.author.id):
       return await general_util.generate_error_message(inter, Strings.weather_unset_place_not_place_to_remove)
     await general_util.generate_success_message(inter, Strings.weather_unset_place_removed)
 
@@ -176,7 +178,7 @@ class Weather(Base_Cog):
 
     if place is None:
       # try to get user preference
-      place_it = weather_settings_repo.get_weather_settings(inter.author.id)
+      place_it = await weather_settings_repo.get_weather_settings(inter.author.id)
       if place_it is not None:
         place = place_it.place
 
@@ -186,14 +188,17 @@ class Weather(Base_Cog):
     if place in self.place_weather_prediction_cache.keys():
       cache_item = self.place_weather_prediction_cache.get(place)
       if datetime.datetime.utcnow() - cache_item[0] > datetime.timedelta(minutes=20):
+        self.place_weather_prediction_cache_metrics.miss()
         self.place_weather_prediction_cache.pop(place)
 
         embeds = await _create_embeds(inter, place)
         if embeds is not None:
           self.place_weather_prediction_cache[place] = (datetime.datetime.utcnow(), embeds)
       else:
+        self.place_weather_prediction_cache_metrics.hit()
         embeds = cache_item[1]
     else:
+      self.place_weather_prediction_cache_metrics.miss()
       embeds = await _create_embeds(inter, place)
       if embeds is not None:
         self.place_weather_prediction_cache[place] = (datetime.datetime.utcnow(), embeds)
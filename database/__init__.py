@@ -1,5 +1,11 @@
-from sqlalchemy import create_engine, BigInteger
-from sqlalchemy.orm import sessionmaker, Session
+import asyncio
+import datetime
+from typing import Optional, Iterable, Callable, Awaitable
+from sqlalchemy import BigInteger, DateTime, func, select, delete, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects import postgresql, sqlite
 
@@ -8,6 +14,19 @@ from util.logger import setup_custom_logger
 
 logger = setup_custom_logger(__name__)
 
+# Async drivers used for each of supported database backends
+ASYNC_DRIVERS = {
+  "postgresql": "asyncpg",
+  "sqlite": "aiosqlite"
+}
+
+def to_async_connect_string(connect_string: str):
+  url = make_url(connect_string)
+  backend = url.get_backend_name()
+  if backend not in ASYNC_DRIVERS.keys():
+    raise ValueError(f"Unsupported database backend `{backend}`")
+  return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
 class Database:
   def __init__(self):
     if config.db.connect_string is None or config.db.connect_string == "":
@@ -16,21 +35,113 @@ class Database:
 
     try:
       self.base = declarative_base()
-      self.db = create_engine(config.db.connect_string)
+      self.db = create_async_engine(to_async_connect_string(config.db.connect_string))
 
     except Exception as e:
       logger.error(f"Failed to create database connection\n{e}")
       exit(-1)
 
+    if config.db.query_stats:
+      from database import query_stats
+      event.listen(self.db.sync_engine, "before_cursor_execute", query_stats.before_cursor_execute)
+      event.listen(self.db.sync_engine, "after_cursor_execute", query_stats.after_cursor_execute)
+
     logger.info("Database opened")
 
 try:
   database:Database = Database()
-  session:Session = sessionmaker(database.db)()
+  # Every repo operation opens its own short lived session so concurrent event handlers never share one
+  session_maker = sessionmaker(database.db, class_=AsyncSession, expire_on_commit=False)
 except Exception as e:
   logger.error(f"Failed to create database session\n{e}")
   exit(-1)
 
+# Delete rows matching filters in chunks each in its own transaction so locks are short and event loop can run between them
+# before_delete(session, ids) runs in transaction of each chunk, for changes which depend on rows removed with it
+async def delete_in_chunks(id_column, filters: list, chunk_size: int, before_delete: Optional[Callable[[AsyncSession, list], Awaitable]]=None) -> int:
+  deleted = 0
+  while True:
+    async with session_maker() as session:
+      result = await session.execute(select(id_column).filter(*filters).limit(chunk_size))
+      ids = [row[0] for row in result.all()]
+      if not ids: break
+
+      if before_delete is not None:
+        await before_delete(session, ids)
+      await session.execute(delete(id_column.class_).filter(id_column.in_(ids)).execution_options(synchronize_session=False))
+      await session.commit()
+
+    deleted += len(ids)
+    if len(ids) < chunk_size: break
+    await asyncio.sleep(0)
+  return deleted
+
+# Insert statement of used dialect, supports ON CONFLICT clauses
+def dialect_insert(table):
+  if database.db.dialect.name == "postgresql":
+    return postgresql.insert(table)
+  return sqlite.insert(table)
+
+# INSERT ... ON CONFLICT DO UPDATE, conflicting rows get update_columns from inserted row and values from set_
+# Rows are updated only when they match where, without anything to update conflicting rows are left as they are (index_elements can be omitted then)
+def upsert(table, values, index_elements: Optional[list]=None, update_columns: Iterable[str]=(), set_: Optional[dict]=None, where=None):
+  statement = dialect_insert(table).values(values)
+  set_ = {**{column: statement.excluded[column] for column in update_columns}, **(set_ if set_ is not None else {})}
+  if not set_:
+    return statement.on_conflict_do_nothing(index_elements=index_elements)
+  return statement.on_conflict_do_update(index_elements=index_elements, set_=set_, where=where)
+
+# Execute single row upsert and return resulting row as ORM object
+# Postgres returns it directly, on SQLite (no RETURNING support) or when row was left untouched it's selected in same transaction
+async def upsert_returning(session, model, statement, key_filter: list):
+  if database.db.dialect.full_returning:
+    result = await session.execute(select(model).from_statement(statement.returning(*model.__table__.columns)).execution_options(populate_existing=True))
+    item = result.scalar_one_or_none()
+    if item is not None: return item
+  else:
+    await session.execute(statement)
+
+  result = await session.execute(select(model).filter(*key_filter).execution_options(populate_existing=True))
+  return result.scalar_one()
+
+def to_row(item) -> dict:
+  # Column values explicitly set on ORM object, used for building multi-row inserts
+  return {key: value for key, value in vars(item).items() if not key.startswith("_")}
+
+# Interval of time partitions for large tables, None when partitioning is disabled or not supported by backend
+def get_partition_interval() -> Optional[str]:
+  if config.db.partition_interval in ("month", "week") and make_url(config.db.connect_string).get_backend_name() == "postgresql":
+    return config.db.partition_interval
+  return None
+
 BigIntegerType = BigInteger()
 BigIntegerType = BigIntegerType.with_variant(postgresql.BIGINT(), 'postgresql')
-BigIntegerType = BigIntegerType.with_variant(sqlite.INTEGER(), 'sqlite')
\ No newline at end of file
+BigIntegerType = BigIntegerType.with_variant(sqlite.INTEGER(), 'sqlite')
+
+class NaiveUTCDateTime(TypeDecorator):
+  # Discord objects carry timezone aware datetimes but columns are stored as naive UTC (asyncpg refuses to mix them)
+  impl = DateTime
+  cache_ok = True
+
+  def process_bind_param(self, value, dialect):
+    if value is not None and value.tzinfo is not None:
+      value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+DateTimeType = NaiveUTCDateTime()
+
+# Start of hour or day bucket in which naive UTC timestamp lies
+def time_bucket(timestamp: datetime.datetime, unit: str) -> datetime.datetime:
+  if timestamp.tzinfo is not None:
+    timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+  timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+  if unit == "day":
+    timestamp = timestamp.replace(hour=0)
+  return timestamp
+
+# SQL version of time_bucket
+def time_bucket_expression(column, unit: str, dialect_name: str):
+  if dialect_name == "postgresql":
+    return func.date_trunc(unit, column)
+  # Have to produce same text format as SQLAlchemy uses for storing datetimes in SQLite
+  return func.strftime("%Y-%m-%d %H:00:00.000000" if unit == "hour" else "%Y-%m-%d 00:00:00.000000", column)
@@ -5,23 +5,26 @@ from typing import Optional
 
 from features import before_message_context
 from database.tables.audit_log import AuditLog, AuditLogItemType
-from database import session
+
+from database import database, session_maker, partitioning, delete_in_chunks
 from database import users_repo
 from database.tables import messages
 
-def auditlog_member_joined(member: disnake.Member) -> AuditLog:
-  item = AuditLog(guild_id=str(member.guild.id), data={"user_id": member.id}, log_type=AuditLogItemType.MEMBER_JOINED, timestamp=member.joined_at)
-  session.add(item)
-  session.commit()
+async def auditlog_member_joined(member: disnake.Member) -> AuditLog:
+  item = AuditLog(guild_id=member.guild.id, data={"user_id": member.id}, log_type=AuditLogItemType.MEMBER_JOINED, timestamp=member.joined_at)
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
   return item
 
-def auditlog_member_left(member: disnake.Member) -> AuditLog:
-  item = AuditLog(guild_id=str(member.guild.id), data={"user_id": member.id}, log_type=AuditLogItemType.MEMBER_LEFT)
-  session.add(item)
-  session.commit()
+async def auditlog_member_left(member: disnake.Member) -> AuditLog:
+  item = AuditLog(guild_id=member.guild.id, data={"user_id": member.id}, log_type=AuditLogItemType.MEMBER_LEFT)
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
   return item
 
-def auditlog_member_updated(before: disnake.Member, after: disnake.Member) -> Optional[AuditLog]:
+async def auditlog_member_updated(before: disnake.Member, after: disnake.Member) -> Optional[AuditLog]:
   before_data = {}
   after_data = {}
 
@@ -41,14 +44,15 @@ def auditlog_member_updated(before: disnake.Member, after: disnake.Member) -> Op
   if not before_data.keys():
     return None
 
-  users_repo.get_or_create_member_if_not_exist(after)
-  member_iid = users_repo.member_identifier_to_member_iid(after.id, after.guild.id)
-  item = AuditLog(user_id=str(after.id), guild_id=str(after.guild.id), member_iid=member_iid, log_type=AuditLogItemType.MEMBER_UPDATED, data={"before": before_data, "after": after_data})
-  session.add(item)
-  session.commit()
+  member_identity = await users_repo.ensure_member(after)
+  member_iid = member_identity.member_iid
+  item = AuditLog(user_id=after.id, guild_id=after.guild.id, member_iid=member_iid, log_type=AuditLogItemType.MEMBER_UPDATED, data={"before": before_data, "after": after_data})
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
   return item
 
-def auditlog_user_update(before: disnake.User, after: disnake.User):
+async def auditlog_user_update(before: disnake.User, after: disnake.User):
   before_data = {}
   after_data = {}
 
@@ -59,13 +63,14 @@ def auditlog_user_update(before: disnake.User, after: disnake.User):
   if not before_data.keys():
     return None
 
-  users_repo.get_or_create_user_if_not_exist(after)
-  item = AuditLog(user_id=str(after.id), log_type=AuditLogItemType.USER_UPDATED, data={"before": before_data, "after": after_data})
-  session.add(item)
-  session.commit()
+  await users_repo.ensure_user(after)
+  item = AuditLog(user_id=after.id, log_type=AuditLogItemType.USER_UPDATED, data={"before": before_data, "after": after_data})
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
   return item
 
-def auditlog_message_edited(before: Optional[before_message_context.BeforeMessageContext], after: disnake.Message) -> Optional[AuditLog]:
+async def auditlog_message_edited(before: Optional[before_message_context.BeforeMessageContext], after: disnake.Message) -> Optional[AuditLog]:
   before_data = {}
   after_data = {}
 
@@ -86,38 +91,42 @@ def auditlog_message_edited(before: Optional[before_message_context.BeforeMessag
     return None
 
   if after.guild is not None and isinstance(after.author, disnake.Member):
-    guild_id = str(after.guild.id)
-    users_repo.get_or_create_member_if_not_exist(after.author)
-    member_iid = users_repo.member_identifier_to_member_iid(after.author.id, after.guild.id)
+    guild_id = after.guild.id
+    member_identity = await users_repo.ensure_member(after.author)
+    member_iid = member_identity.member_iid
   else:
-    users_repo.get_or_create_user_if_not_exist(after.author)
+    await users_repo.ensure_user(after.author)
     guild_id = None
     member_iid = None
 
   channel_id = after.channel.id if not isinstance(after.channel, disnake.DMChannel) else None
 
-  item = AuditLog(user_id=str(after.author.id), guild_id=guild_id, member_iid=member_iid, log_type=AuditLogItemType.MESSAGE_EDITED, data={"message_id": after.id, "channel_id": channel_id, "before": before_data, "after": after_data})
-  session.add(item)
-  session.commit()
+  item = AuditLog(user_id=after.author.id, guild_id=guild_id, member_iid=member_iid, log_type=AuditLogItemType.MESSAGE_EDITED, data={"message_id": after.id, "channel_id": channel_id, "before": before_data, "after": after_data})
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
   return item
 
-def auditlog_message_deleted(message: before_message_context.BeforeMessageContext):
+async def auditlog_message_deleted(message: before_message_context.BeforeMessageContext):
   if message.guild is not None and isinstance(message.author, disnake.Member):
-    guild_id = str(message.guild.id)
-    users_repo.get_or_create_member_if_not_exist(message.author)
-    member_iid = users_repo.member_identifier_to_member_iid(message.author.id, message.guild.id)
+    guild_id = message.guild.id
+    member_identity = await users_repo.ensure_member(message.author)
+    member_iid = member_identity.member_iid
   else:
-    users_repo.get_or_create_user_if_not_exist(message.author)
+    await users_repo.ensure_user(message.author)
     guild_id = None
     member_iid = None
 
   channel_id = message.channel.id if not isinstance(message.channel, disnake.DMChannel) else None
 
-  item = AuditLog(user_id=str(message.author.id), guild_id=guild_id, member_iid=member_iid, log_type=AuditLogItemType.MESSAGE_DELETED, data={"message_id": message.id, "channel_id": channel_id, "content": message.content, "attachments": messages.message_to_message_data(message)["attachments"]})
-  session.add(item)
-  session.commit()
+  item = AuditLog(user_id=message.author.id, guild_id=guild_id, member_iid=member_iid, log_type=AuditLogItemType.MESSAGE_DELETED, data={"message_id": message.id, "channel_id": channel_id, "content": message.content, "attachments": messages.message_to_message_data(message)["attachments"]})
+  async with session_maker() as session:
+    session.add(item)
+    await session.commit()
 
-def delete_old_auditlogs(days_back: int):
+async def delete_old_auditlogs(days_back: int, chunk_size: int=5000) -> int:
   threshold = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
-  session.query(AuditLog).filter(AuditLog.timestamp < threshold).delete()
-  session.commit()
+  async with database.db.begin() as connection:
+    await connection.run_sync(partitioning.drop_partitions_before, "audit_log", threshold)
+
+  return await delete_in_chunks(AuditLog.id, [AuditLog.timestamp < threshold], chunk_size)
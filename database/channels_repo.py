@@ -1,48 +1,101 @@
 import disnake
-from typing import Optional
+from typing import Optional, Iterable
+from sqlalchemy import select, update, delete
 
-from database import session
+from database import session_maker, to_row, upsert, upsert_returning, identity_cache
 from database.tables.channels import TextChannel, TextThread
 from database import guilds_repo
 
-def get_thread(thread_id: int) -> Optional[TextThread]:
-  return session.query(TextThread).filter(TextThread.id == str(thread_id)).one_or_none()
-
-def get_or_create_text_thread(thread: disnake.Thread) -> TextThread:
-  thread_it = get_thread(thread.id)
-  if thread_it is None:
-    thread_it = TextThread.from_thread(thread)
-    session.add(thread_it)
-    session.commit()
-  else:
-    if thread_it.archived != thread.archived or thread_it.locked != thread_it.locked:
-      thread_it.archived = thread.archived
-      thread_it.locked = thread.locked
-      session.commit()
+async def get_thread(thread_id: int) -> Optional[TextThread]:
+  async with session_maker() as session:
+    result = await session.execute(select(TextThread).filter(TextThread.id == thread_id))
+    return result.scalar_one_or_none()
+
+async def get_or_create_text_thread(thread: disnake.Thread) -> TextThread:
+  await ensure_text_channel(thread.parent)
+
+  statement = upsert(TextThread, to_row(TextThread.from_thread(thread)), [TextThread.id], update_columns=["archived", "locked"])
+  async with session_maker() as session:
+    thread_it = await upsert_returning(session, TextThread, statement, [TextThread.id == thread.id])
+    await session.commit()
+  identity_cache.threads.set(thread.id, (thread.parent.id, thread.guild.id))
   return thread_it
 
-def remove_thread(thread_id: int):
-  session.query(TextThread).filter(TextThread.id == str(thread_id)).delete()
-  session.commit()
+async def update_thread(thread: disnake.Thread):
+  async with session_maker() as session:
+    await session.execute(update(TextThread).filter(TextThread.id == thread.id).values(archived=thread.archived, locked=thread.locked))
+    await session.commit()
 
-def get_text_channel(channel_id: int) -> Optional[TextChannel]:
-  return session.query(TextChannel).filter(TextChannel.id == str(channel_id)).one_or_none()
+async def remove_thread(thread_id: int):
+  async with session_maker() as session:
+    await session.execute(delete(TextThread).filter(TextThread.id == thread_id))
+    await session.commit()
+  identity_cache.invalidate_thread(thread_id)
 
-def get_or_create_text_channel_if_not_exist(channel) -> TextChannel:
-  guilds_repo.get_or_create_guild_if_not_exist(channel.guild)
+async def get_text_channel(channel_id: int) -> Optional[TextChannel]:
+  async with session_maker() as session:
+    result = await session.execute(select(TextChannel).filter(TextChannel.id == channel_id))
+    return result.scalar_one_or_none()
 
+async def get_or_create_text_channel_if_not_exist(channel) -> TextChannel:
+  thread = None
   if isinstance(channel, disnake.Thread):
-    get_or_create_text_thread(channel)
+    thread = channel
     channel = channel.parent
 
-  channel_it = get_text_channel(channel.id)
-  if channel_it is None:
-    channel_it = TextChannel.from_text_channel(channel)
-    session.add(channel_it)
-    session.commit()
+  await guilds_repo.ensure_guild(channel.guild)
+
+  async with session_maker() as session:
+    channel_it = await upsert_returning(session, TextChannel, upsert(TextChannel, to_row(TextChannel.from_text_channel(channel)), [TextChannel.id]), [TextChannel.id == channel.id])
+    await session.commit()
+  identity_cache.channels.set(channel.id, channel.guild.id)
+
+  if thread is not None:
+    await get_or_create_text_thread(thread)
 
   return channel_it
 
-def remove_channel(channel_id: int):
-  session.query(TextChannel).filter(TextChannel.id == str(channel_id)).delete()
-  session.commit()
+# Make sure that channel (and thread) exists in database, answered from identity cache when possible
+async def ensure_text_channel(channel):
+  thread = None
+  if isinstance(channel, disnake.Thread):
+    thread = channel
+    channel = channel.parent
+
+  if identity_cache.channels.get(channel.id) is None:
+    await get_or_create_text_channel_if_not_exist(channel)
+
+  if thread is not None and identity_cache.threads.get(thread.id) is None:
+    await get_or_create_text_thread(thread)
+
+async def create_missing_text_channels(channels: Iterable):
+  text_channels = {}
+  threads = {}
+  for channel in channels:
+    if isinstance(channel, disnake.Thread):
+      if identity_cache.threads.get(channel.id) is None:
+        threads[channel.id] = channel
+      channel = channel.parent
+    if identity_cache.channels.get(channel.id) is None:
+      text_channels[channel.id] = channel
+
+  if not text_channels and not threads: return
+  await guilds_repo.create_missing_guilds(channel.guild for channel in text_channels.values())
+
+  async with session_maker() as session:
+    if text_channels:
+      await session.execute(upsert(TextChannel, [to_row(TextChannel.from_text_channel(channel)) for channel in text_channels.values()], [TextChannel.id]))
+    if threads:
+      await session.execute(upsert(TextThread, [to_row(TextThread.from_thread(thread)) for thread in threads.values()], [TextThread.id]))
+    await session.commit()
+
+  for channel in text_channels.values():
+    identity_cache.channels.set(channel.id, channel.guild.id)
+  for thread in threads.values():
+    identity_cache.threads.set(thread.id, (thread.parent.id, thread.guild.id))
+
+async def remove_channel(channel_id: int):
+  async with session_maker() as session:
+    await session.execute(delete(TextChannel).filter(TextChannel.id == channel_id))
+    await session.commit()
+  identity_cache.invalidate_channel(channel_id)
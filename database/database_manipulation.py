@@ -1,4 +1,5 @@
-from database import session, database
+from database import database
+from database import partitioning
 import pkgutil
 import importlib
 
@@ -12,10 +13,30 @@ def load_sub_modules(module):
   for _, name, _ in pkgutil.iter_modules(package.__path__):
     importlib.import_module(f'{package.__name__}.{name}')
 
-def init_tables():
+def create_missing_indexes(connection):
+  for table in database.base.metadata.sorted_tables:
+    for index in table.indexes:
+      index.create(connection, checkfirst=True)
+
+async def init_tables():
   load_sub_modules("database.tables")
+  # Imported after tables are loaded, tables import bot module which imports this module
+  from database.tables.messages import create_full_text_index
+
+  async with database.db.begin() as connection:
+    await connection.run_sync(database.base.metadata.create_all)
+    # create_all skips existing tables so indexes added later have to be created separately
+    await connection.run_sync(create_missing_indexes)
+    await connection.run_sync(create_full_text_index)
+    await connection.run_sync(partitioning.ensure_partitions)
+
+  logger.info("Initializating all loaded tables")
 
-  database.base.metadata.create_all(database.db)
-  session.commit()
+# Create partitions for upcoming period
+async def maintain_partitions():
+  async with database.db.begin() as connection:
+    await connection.run_sync(partitioning.ensure_partitions)
 
-  logger.info("Initializating all loaded tables")
\ No newline at end of file
+async def close_database():
+  await database.db.dispose()
+  logger.info("Database closed")
@@ -1,20 +1,39 @@
 import disnake
-from typing import Optional
+from typing import Optional, Iterable
+from sqlalchemy import select, delete
 
-from database import session
+from database import session_maker, to_row, upsert, upsert_returning, identity_cache
 from database.tables.guilds import Guild
 
-def get_guild(guild_id: int) -> Optional[Guild]:
-  return session.query(Guild).filter(Guild.id == str(guild_id)).one_or_none()
+async def get_guild(guild_id: int) -> Optional[Guild]:
+  async with session_maker() as session:
+    result = await session.execute(select(Guild).filter(Guild.id == guild_id))
+    return result.scalar_one_or_none()
 
-def get_or_create_guild_if_not_exist(guild: disnake.Guild) -> Guild:
-  guild_it = get_guild(guild.id)
-  if guild_it is None:
-    guild_it = Guild.from_guild(guild)
-    session.add(guild_it)
-    session.commit()
+async def get_or_create_guild_if_not_exist(guild: disnake.Guild) -> Guild:
+  async with session_maker() as session:
+    guild_it = await upsert_returning(session, Guild, upsert(Guild, to_row(Guild.from_guild(guild)), [Guild.id]), [Guild.id == guild.id])
+    await session.commit()
+  identity_cache.guilds.set(guild.id, True)
   return guild_it
 
-def remove_guild(guild_id: int):
-  session.query(Guild).filter(Guild.id == str(guild_id)).delete()
-  session.commit()
+async def ensure_guild(guild: disnake.Guild):
+  if identity_cache.guilds.get(guild.id) is None:
+    await get_or_create_guild_if_not_exist(guild)
+
+async def create_missing_guilds(guilds: Iterable[disnake.Guild]):
+  guilds = {guild.id: guild for guild in guilds if identity_cache.guilds.get(guild.id) is None}
+  if not guilds: return
+
+  async with session_maker() as session:
+    await session.execute(upsert(Guild, [{"id": guild_id} for guild_id in guilds.keys()], [Guild.id]))
+    await session.commit()
+
+  for guild_id in guilds.keys():
+    identity_cache.guilds.set(guild_id, True)
+
+async def remove_guild(guild_id: int):
+  async with session_maker() as session:
+    await session.execute(delete(Guild).filter(Guild.id == guild_id))
+    await session.commit()
+  identity_cache.invalidate_guild(guild_id)
@@ -1,45 +1,57 @@
 from typing import Optional, List
 import datetime
 import disnake
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import selectinload
 
-from database import session
+from database import session_maker
 from database.tables.help_threads import HelpThread
 from database import users_repo, channels_repo
 
-def get_thread(thread_id: int) -> Optional[HelpThread]:
-  return session.query(HelpThread).filter(HelpThread.thread_id == str(thread_id)).one_or_none()
+async def get_thread(thread_id: int) -> Optional[HelpThread]:
+  async with session_maker() as session:
+    result = await session.execute(select(HelpThread).options(selectinload(HelpThread.member)).filter(HelpThread.thread_id == thread_id))
+    return result.scalar_one_or_none()
 
-def thread_exists(thread_id: int):
-  return get_thread(thread_id) is not None
+async def thread_exists(thread_id: int):
+  async with session_maker() as session:
+    result = await session.execute(select(HelpThread.thread_id).filter(HelpThread.thread_id == thread_id))
+    return result.first() is not None
 
-def update_thread_activity(thread_id: int, new_activity: datetime.datetime, commit: bool=True):
-  session.query(HelpThread).filter(HelpThread.thread_id == str(thread_id)).update({HelpThread.last_activity_time : new_activity})
+async def update_thread_activity(thread_id: int, new_activity: datetime.datetime):
+  async with session_maker() as session:
+    await session.execute(update(HelpThread).filter(HelpThread.thread_id == thread_id).values(last_activity_time=new_activity))
+    await session.commit()
 
-  if commit:
-    session.commit()
+async def create_thread(thread: disnake.Thread, owner: disnake.Member, tags: Optional[str]=None) -> Optional[HelpThread]:
+  member = await users_repo.ensure_member(owner)
 
-def create_thread(thread: disnake.Thread, owner: disnake.Member, tags: Optional[str]=None) -> Optional[HelpThread]:
-  member = users_repo.get_or_create_member_if_not_exist(owner)
-
-  channels_repo.get_or_create_text_thread(thread)
-  item = HelpThread(thread_id=str(thread.id), member_iid=member.member_iid, owner_id=str(owner.id), tags=tags)
-  session.add(item)
-  session.commit()
+  await channels_repo.get_or_create_text_thread(thread)
+  async with session_maker() as session:
+    item = HelpThread(thread_id=thread.id, member_iid=member.member_iid, owner_id=owner.id, tags=tags)
+    session.add(item)
+    await session.commit()
 
   return item
 
-def get_all() -> List[HelpThread]:
-  return session.query(HelpThread).order_by(HelpThread.last_activity_time.desc()).all()
+async def get_all() -> List[HelpThread]:
+  async with session_maker() as session:
+    result = await session.execute(select(HelpThread).options(selectinload(HelpThread.thread), selectinload(HelpThread.member)).order_by(HelpThread.last_activity_time.desc()))
+    return result.scalars().all()
 
-def delete_thread(thread_id: int):
-  session.query(HelpThread).filter(HelpThread.thread_id == str(thread_id)).delete()
-  session.commit()
+async def delete_thread(thread_id: int):
+  async with session_maker() as session:
+    await session.execute(delete(HelpThread).filter(HelpThread.thread_id == thread_id))
+    await session.commit()
 
-def get_unactive(days_threshold: int) -> List[HelpThread]:
+async def get_unactive(days_threshold: int) -> List[HelpThread]:
   date_threshold = datetime.datetime.utcnow() - datetime.timedelta(days=days_threshold)
-  return session.query(HelpThread).filter(HelpThread.last_activity_time < date_threshold).all()
+  async with session_maker() as session:
+    result = await session.execute(select(HelpThread).options(selectinload(HelpThread.thread), selectinload(HelpThread.member)).filter(HelpThread.last_activity_time < date_threshold))
+    return result.scalars().all()
 
-def delete_unactive(days_threshold: int):
+async def delete_unactive(days_threshold: int):
   date_threshold = datetime.datetime.utcnow() - datetime.timedelta(days=days_threshold)
-  session.query(HelpThread).filter(HelpThread.last_activity_time < date_threshold).delete()
-  session.commit()
+  async with session_maker() as session:
+    await session.execute(delete(HelpThread).filter(HelpThread.last_activity_time < date_threshold))
+    await session.commit()
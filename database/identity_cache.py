@@ -0,0 +1,95 @@
+# In-process identity map of rows that are known to exist in database
+# Used to skip existence checks for users, members, channels, threads and guilds on hot paths
+# Also holds last metric message of each channel/thread used for deduplication of consecutive messages
+
+import dataclasses
+import cachetools
+from typing import Any, Callable, Dict, Hashable, Optional, Iterable
+
+from config import config
+
+@dataclasses.dataclass
+class MemberIdentity:
+  member_iid: int
+  collect_data: bool
+
+@dataclasses.dataclass
+class LastMetricMessage:
+  author_id: int
+  message_id: int
+
+class IdentityCache:
+  def __init__(self, name: str, maxsize: int):
+    self.name = name
+    self.cache = cachetools.LRUCache(maxsize=maxsize)
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: Hashable) -> Optional[Any]:
+    value = self.cache.get(key)
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def set(self, key: Hashable, value: Any):
+    self.cache[key] = value
+
+  def invalidate(self, key: Hashable):
+    self.cache.pop(key, None)
+
+  def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+    for key in [key for key, value in self.cache.items() if predicate(key, value)]:
+      self.cache.pop(key, None)
+
+  def clear(self):
+    self.cache.clear()
+
+  def get_stats(self) -> Dict[str, Any]:
+    requests = self.hits + self.misses
+    return {"size": len(self.cache), "maxsize": self.cache.maxsize, "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / requests if requests > 0 else 0.0}
+
+# Values: True
+guilds = IdentityCache("guilds", config.essentials.identity_cache_size)
+# Values: True
+users = IdentityCache("users", config.essentials.identity_cache_size)
+# Key: (user_id, guild_id), Values: MemberIdentity
+members = IdentityCache("members", config.essentials.identity_cache_size)
+# Values: guild_id
+channels = IdentityCache("channels", config.essentials.identity_cache_size)
+# Values: (channel_id, guild_id)
+threads = IdentityCache("threads", config.essentials.identity_cache_size)
+# Key: (channel_id, thread_id or None), Values: LastMetricMessage
+last_metric_messages = IdentityCache("last_metric_messages", config.essentials.identity_cache_size)
+
+all_caches = [guilds, users, members, channels, threads, last_metric_messages]
+
+def invalidate_guild(guild_id: int):
+  guilds.invalidate(guild_id)
+  members.invalidate_where(lambda key, _: key[1] == guild_id)
+  channels.invalidate_where(lambda _, value: value == guild_id)
+  threads.invalidate_where(lambda _, value: value[1] == guild_id)
+  # Keys don't contain guild
+  last_metric_messages.clear()
+
+def invalidate_channel(channel_id: int):
+  channels.invalidate(channel_id)
+  threads.invalidate_where(lambda _, value: value[0] == channel_id)
+  last_metric_messages.invalidate_where(lambda key, _: key[0] == channel_id)
+
+def invalidate_thread(thread_id: int):
+  threads.invalidate(thread_id)
+  last_metric_messages.invalidate_where(lambda key, _: key[1] == thread_id)
+
+# Last metric message of some channels is deleted and have to be loaded again
+def invalidate_last_metric_messages(message_ids: Iterable[int]):
+  message_ids = set(message_ids)
+  if message_ids:
+    last_metric_messages.invalidate_where(lambda _, value: value.message_id in message_ids)
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+  return {cache.name: cache.get_stats() for cache in all_caches}
+
+def format_stats() -> str:
+  return ", ".join(f"{name}: {stats['hits']}/{stats['hits'] + stats['misses']} hits ({stats['hit_rate'] * 100:.1f}%), {stats['size']} items" for name, stats in get_stats().items())
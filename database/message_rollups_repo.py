@@ -0,0 +1,105 @@
+import datetime
+from typing import Dict, Tuple, List, Optional, Iterable
+from sqlalchemy import select, delete, and_, func, literal_column, union_all
+
+from database import database, session_maker, dialect_insert
+from database.tables.messages import Message
+from database.tables.message_rollups import MessageRollup, hour_bucket, rollups_from_messages_statement
+
+# (guild_id, channel_id, author_id, hour)
+RollupKey = Tuple[int, int, int, datetime.datetime]
+
+def rollup_key(guild_id: int, channel_id: int, author_id: int, created_at: datetime.datetime) -> RollupKey:
+  return guild_id, channel_id, author_id, hour_bucket(created_at)
+
+def count_rollup_changes(rows: Iterable[Tuple[int, int, int, datetime.datetime]], change: int) -> Dict[RollupKey, int]:
+  changes = {}
+  for row in rows:
+    key = rollup_key(*row)
+    changes[key] = changes.get(key, 0) + change
+  return changes
+
+# Apply count changes in session of caller so they are commited together with messages
+async def apply_changes(session, changes: Dict[RollupKey, int]):
+  changes = {key: value for key, value in changes.items() if value != 0}
+  if not changes: return
+
+  rows = [{"guild_id": key[0], "channel_id": key[1], "author_id": key[2], "hour": key[3], "count": value} for key, value in changes.items()]
+  statement = dialect_insert(MessageRollup).values(rows)
+  statement = statement.on_conflict_do_update(index_elements=[MessageRollup.guild_id, MessageRollup.channel_id, MessageRollup.author_id, MessageRollup.hour],
+                                              set_={"count": MessageRollup.count + statement.excluded.count})
+  await session.execute(statement)
+
+  if any(value < 0 for value in changes.values()):
+    await session.execute(delete(MessageRollup).filter(MessageRollup.hour.in_(set(key[3] for key in changes.keys())), MessageRollup.count <= 0))
+
+async def get_deleted_messages_changes(session, message_filter) -> Dict[RollupKey, int]:
+  result = await session.execute(select(Message.guild_id, Message.channel_id, Message.author_id, Message.created_at).filter(message_filter, Message.use_for_metrics == True, Message.guild_id != None))
+  return count_rollup_changes(result.all(), -1)
+
+# Recompute rollups from messages table, whole table when no range is specified
+async def rebuild(guild_id: Optional[int]=None, from_hour: Optional[datetime.datetime]=None, to_hour: Optional[datetime.datetime]=None, session=None):
+  async def _rebuild(session):
+    rollup_filters = []
+    message_filters = []
+    if guild_id is not None:
+      rollup_filters.append(MessageRollup.guild_id == guild_id)
+      message_filters.append(Message.guild_id == guild_id)
+    if from_hour is not None:
+      rollup_filters.append(MessageRollup.hour >= from_hour)
+      message_filters.append(Message.created_at >= from_hour)
+    if to_hour is not None:
+      rollup_filters.append(MessageRollup.hour < to_hour)
+      message_filters.append(Message.created_at < to_hour)
+
+    await session.execute(delete(MessageRollup).filter(*rollup_filters))
+    await session.execute(rollups_from_messages_statement(database.db.dialect.name, and_(*message_filters) if message_filters else None))
+
+  if session is not None:
+    await _rebuild(session)
+  else:
+    async with session_maker() as session:
+      await _rebuild(session)
+      await session.commit()
+
+# Drop rollups of messages removed by retention, hour in which threshold lies is recomputed from remaining messages
+async def apply_retention(session, threshold: datetime.datetime):
+  threshold_hour = hour_bucket(threshold)
+  await session.execute(delete(MessageRollup).filter(MessageRollup.hour < threshold_hour))
+  await rebuild(from_hour=threshold_hour, to_hour=threshold_hour + datetime.timedelta(hours=1), session=session)
+
+async def get_message_volume(guild_id: int, days_back: int) -> List[Tuple[datetime.datetime, int, int, int]]:
+  threshold_hour = hour_bucket(datetime.datetime.utcnow() - datetime.timedelta(days=days_back))
+  async with session_maker() as session:
+    result = await session.execute(select(MessageRollup.hour, MessageRollup.author_id, MessageRollup.channel_id, MessageRollup.count).filter(MessageRollup.guild_id == guild_id, MessageRollup.hour >= threshold_hour).order_by(MessageRollup.hour))
+    data = result.all()
+  return [tuple(d) for d in data]
+
+# Authors with most metric messages in guild, each leaderboard has its own channel filter (None for all channels)
+# All leaderboards are aggregated in database by single query, returns leaderboard name -> [(author_id, count)] ordered from highest count
+async def get_top_authors(guild_id: int, leaderboards: Dict[str, Optional[Iterable[int]]], from_date: datetime.datetime, to_date: Optional[datetime.datetime]=None, limit: int=10) -> Dict[str, List[Tuple[int, int]]]:
+  time_filters = [MessageRollup.hour >= hour_bucket(from_date)]
+  if to_date is not None:
+    time_filters.append(MessageRollup.hour < to_date)
+
+  names = list(leaderboards.keys())
+  queries = []
+  for idx, channel_ids in enumerate(leaderboards.values()):
+    message_count = func.sum(MessageRollup.count).label("message_count")
+    # Leaderboard is identified by inlined index, untyped bind parameter in select list isn't accepted by asyncpg
+    query = select(literal_column(str(idx)).label("leaderboard"), MessageRollup.author_id, message_count).filter(MessageRollup.guild_id == guild_id, *time_filters)
+    if channel_ids is not None:
+      query = query.filter(MessageRollup.channel_id.in_(list(channel_ids)))
+    # Wrapped in subquery because SQLite doesn't allow LIMIT on members of compound select
+    queries.append(select(query.group_by(MessageRollup.author_id).order_by(message_count.desc(), MessageRollup.author_id).limit(limit).subquery()))
+
+  result = {name: [] for name in names}
+  if not queries: return result
+
+  async with session_maker() as session:
+    rows = (await session.execute(union_all(*queries) if len(queries) > 1 else queries[0])).all()
+  for idx, author_id, count in rows:
+    result[names[idx]].append((author_id, int(count)))
+  for items in result.values():
+    items.sort(key=lambda item: (-item[1], item[0]))
+  return result
@@ -1,24 +1,45 @@
 import disnake
 import datetime
-from typing import List, Tuple, Optional, Iterator
+from typing import List, Tuple, Optional, AsyncIterator, Iterable, Set
+from Levenshtein import ratio
+from sqlalchemy import select, update, delete, bindparam, tuple_, or_, func, literal, literal_column
 
-from database import session
-from database.tables.messages import Message
-from database import users_repo, channels_repo
+from database import database, session_maker, to_row, partitioning, delete_in_chunks, upsert
+from database.tables import messages as messages_table
+from database.tables.messages import Message, messages_fts, messages_trigram, content_tsvector
+from database import users_repo, channels_repo, message_rollups_repo, identity_cache
+from database.identity_cache import LastMetricMessage
 
-def get_message(message_id: int) -> Optional[Message]:
-  return session.query(Message).filter(Message.id == str(message_id)).one_or_none()
+async def get_message(message_id: int) -> Optional[Message]:
+  async with session_maker() as session:
+    result = await session.execute(select(Message).filter(Message.id == message_id))
+    return result.scalar_one_or_none()
 
-def get_author_of_last_message_metric(channel_id: int, thread_id: Optional[int]) -> Optional[int]:
-  user_id = session.query(Message.author_id).filter(Message.channel_id == str(channel_id), Message.thread_id == (str(thread_id) if thread_id is not None else None), Message.use_for_metrics == True).order_by(Message.created_at.desc()).first()
-  return int(user_id[0]) if user_id is not None else None
+# Last metric message is cached per channel/thread, database is asked only on first message after start or invalidation
+async def get_author_of_last_message_metric(channel_id: int, thread_id: Optional[int]) -> Optional[int]:
+  last_message = identity_cache.last_metric_messages.get((channel_id, thread_id))
+  if last_message is None:
+    async with session_maker() as session:
+      result = await session.execute(select(Message.author_id, Message.id).filter(Message.channel_id == channel_id, Message.thread_id == thread_id, Message.use_for_metrics == True).order_by(Message.created_at.desc()).limit(1))
+      data = result.first()
+    if data is None: return None
 
-def add_or_set_message(message: disnake.Message, commit: bool=True) -> Optional[Message]:
+    last_message = LastMetricMessage(data[0], data[1])
+    identity_cache.last_metric_messages.set((channel_id, thread_id), last_message)
+  return last_message.author_id
+
+def set_last_metric_message(channel_id: int, thread_id: Optional[int], author_id: int, message_id: int):
+  last_message = identity_cache.last_metric_messages.get((channel_id, thread_id))
+  # Message ids are ordered by time so older messages (from backfill) don't replace newer ones
+  if last_message is None or last_message.message_id < message_id:
+    identity_cache.last_metric_messages.set((channel_id, thread_id), LastMetricMessage(author_id, message_id))
+
+async def add_or_set_message(message: disnake.Message) -> Optional[Message]:
   if message.guild is None or not isinstance(message.author, disnake.Member):
     return None
 
-  users_repo.get_or_create_member_if_not_exist(message.author)
-  can_collect_data = users_repo.can_collect_data(message.author.id, message.guild.id)
+  member_identity = await users_repo.ensure_member(message.author)
+  can_collect_data = member_identity.collect_data
 
   thread = None
   channel = message.channel
@@ -27,63 +48,302 @@ def add_or_set_message(message: disnake.Message, commit: bool=True) -> Optional[
     channel = channel.parent
 
   if message.channel is not None:
-    channels_repo.get_or_create_text_channel_if_not_exist(message.channel)
-
-  message_it = get_message(message.id)
-  if message_it is None:
-    use_for_metrics = get_author_of_last_message_metric(channel.id, thread.id if thread is not None else None) != message.author.id
-
-    message_it = Message.from_message(message)
-    message_it.use_for_metrics = use_for_metrics
-    session.add(message_it)
-  else:
-    message_it.content = message.content
-    message_it.edited_at = message.edited_at
+    await channels_repo.ensure_text_channel(message.channel)
 
+  message_it = Message.from_message(message, member_identity.member_iid)
   if not can_collect_data:
     message_it.content = None
     message_it.data = None
+  message_it.use_for_metrics = await get_author_of_last_message_metric(channel.id, thread.id if thread is not None else None) != message.author.id
+
+  async with session_maker() as session:
+    # New messages are written by single insert, conflict means that message exists and only its edit is saved
+    result = await session.execute(upsert(Message, to_row(message_it)))
+    created = result.rowcount == 1
+
+    if created:
+      if message_it.use_for_metrics:
+        await message_rollups_repo.apply_changes(session, message_rollups_repo.count_rollup_changes([(message_it.guild_id, message_it.channel_id, message_it.author_id, message_it.created_at)], 1))
+    else:
+      edited_values = {"content": message_it.content, "edited_at": message_it.edited_at}
+      if not can_collect_data:
+        edited_values["data"] = None
+      await session.execute(update(Message).filter(Message.id == message.id).values(**edited_values))
+      result = await session.execute(select(Message).filter(Message.id == message.id))
+      message_it = result.scalar_one()
+
+    await session.commit()
 
-  if commit:
-    session.commit()
+  if created and message_it.use_for_metrics:
+    set_last_metric_message(channel.id, thread.id if thread is not None else None, message.author.id, message.id)
   return message_it
 
-def get_messages_iterator(guild_id: int, author_id: Optional[int]) -> Iterator[Message]:
-  def get_messages(index: int):
+def get_channel_and_thread_id(message: disnake.Message) -> Tuple[int, Optional[int]]:
+  if isinstance(message.channel, disnake.Thread):
+    return message.channel.parent.id, message.channel.id
+  return message.channel.id, None
+
+# Insert rows of messages skipping already stored ones, returns ids of inserted messages
+# Conflict target is left to database because key of partitioned table is (id, created_at)
+async def insert_new_messages(session, rows: List[dict], chunk_size: int) -> Set[int]:
+  inserted_ids = set()
+  if database.db.dialect.full_returning:
+    for i in range(0, len(rows), chunk_size):
+      result = await session.execute(upsert(Message, rows[i:i + chunk_size]).returning(Message.__table__.c.id))
+      inserted_ids.update(message_id for message_id, in result.all())
+  else:
+    # Without RETURNING (SQLite) rows are inserted one by one in same transaction so it's known which of them conflicted
+    for row in rows:
+      result = await session.execute(upsert(Message, row))
+      if result.rowcount == 1:
+        inserted_ids.add(row["id"])
+  return inserted_ids
+
+# Write batch of created/edited messages and deletions using multi-row statements
+async def write_messages_batch(messages: Iterable[disnake.Message], deleted_message_ids: Iterable[int], chunk_size: int=500):
+  messages = [message for message in messages if message.guild is not None and isinstance(message.author, disnake.Member)]
+  deleted_message_ids = list(deleted_message_ids)
+
+  members = {}
+  last_metric_messages = []
+  if messages:
+    members = await users_repo.get_or_create_members(message.author for message in messages)
+    await channels_repo.create_missing_text_channels(message.channel for message in messages if message.channel is not None)
+
+  async with session_maker() as session:
+    if messages:
+      result = await session.execute(select(Message.id).filter(Message.id.in_([message.id for message in messages])))
+      existing_ids = set(message_id for message_id, in result.all())
+
+      new_messages = sorted([message for message in messages if message.id not in existing_ids], key=lambda message: message.created_at)
+      edited_messages = [message for message in messages if message.id in existing_ids]
+
+      last_authors = {}
+      new_rows = []
+      for message in new_messages:
+        channel_key = get_channel_and_thread_id(message)
+        if channel_key not in last_authors.keys():
+          last_authors[channel_key] = await get_author_of_last_message_metric(*channel_key)
+
+        member_identity = members[(message.author.id, message.guild.id)]
+        message_it = Message.from_message(message, member_identity.member_iid)
+        message_it.use_for_metrics = last_authors[channel_key] != message.author.id
+        if not member_identity.collect_data:
+          message_it.content = None
+          message_it.data = None
+
+        last_authors[channel_key] = message.author.id
+        new_rows.append(to_row(message_it))
+
+      # Message can be written by backfill or single message write after existing ids were selected, such message is saved as edit
+      inserted_ids = await insert_new_messages(session, new_rows, chunk_size)
+      edited_messages.extend(message for message in new_messages if message.id not in inserted_ids)
+
+      rollup_rows = []
+      for message, row in zip(new_messages, new_rows):
+        if message.id not in inserted_ids or not row["use_for_metrics"]: continue
+        last_metric_messages.append((*get_channel_and_thread_id(message), message.author.id, message.id))
+        rollup_rows.append((row["guild_id"], row["channel_id"], row["author_id"], row["created_at"]))
+      await message_rollups_repo.apply_changes(session, message_rollups_repo.count_rollup_changes(rollup_rows, 1))
+
+      if edited_messages:
+        await session.execute(
+          update(Message.__table__).where(Message.__table__.c.id == bindparam("message_id")).values(content=bindparam("new_content"), edited_at=bindparam("new_edited_at")),
+          [{"message_id": message.id,
+            "new_content": message.content if members[(message.author.id, message.guild.id)].collect_data else None,
+            "new_edited_at": message.edited_at} for message in edited_messages])
+
+    for i in range(0, len(deleted_message_ids), chunk_size):
+      message_filter = Message.id.in_(deleted_message_ids[i:i + chunk_size])
+      await message_rollups_repo.apply_changes(session, await message_rollups_repo.get_deleted_messages_changes(session, message_filter))
+      await session.execute(delete(Message).filter(message_filter))
+
+    await session.commit()
+
+  for last_metric_message in last_metric_messages:
+    set_last_metric_message(*last_metric_message)
+  identity_cache.invalidate_last_metric_messages(deleted_message_ids)
+
+# Write page of channel history (ordered from oldest) fetched by backfill, already stored messages are skipped
+# Returns number of inserted messages and author of last message for next page of same channel
+async def insert_history_page(messages: List[disnake.Message], last_author_id: Optional[int], chunk_size: int=500) -> Tuple[int, Optional[int]]:
+  messages = sorted([message for message in messages if message.guild is not None and isinstance(message.author, disnake.Member)], key=lambda message: message.created_at)
+  if not messages: return 0, last_author_id
+
+  members = await users_repo.get_or_create_members(message.author for message in messages)
+
+  last_metric_messages = []
+  async with session_maker() as session:
+    result = await session.execute(select(Message.id).filter(Message.id.in_([message.id for message in messages])))
+    existing_ids = set(message_id for message_id, in result.all())
+
+    new_rows = []
+    rollup_rows = []
+    for message in messages:
+      use_for_metrics = last_author_id != message.author.id
+      last_author_id = message.author.id
+      if message.id in existing_ids: continue
+
+      member_identity = members[(message.author.id, message.guild.id)]
+      message_it = Message.from_message(message, member_identity.member_iid)
+      message_it.use_for_metrics = use_for_metrics
+      if not member_identity.collect_data:
+        message_it.content = None
+        message_it.data = None
+
+      new_rows.append(to_row(message_it))
+      if use_for_metrics:
+        last_metric_messages.append((*get_channel_and_thread_id(message), message.author.id, message.id))
+        rollup_rows.append((message_it.guild_id, message_it.channel_id, message_it.author_id, message_it.created_at))
+
+    # Conflicts can still happen with messages written by ingestion in meantime
+    for i in range(0, len(new_rows), chunk_size):
+      await session.execute(upsert(Message, new_rows[i:i + chunk_size]))
+    await message_rollups_repo.apply_changes(session, message_rollups_repo.count_rollup_changes(rollup_rows, 1))
+    await session.commit()
+
+  for last_metric_message in last_metric_messages:
+    set_last_metric_message(*last_metric_message)
+  return len(new_rows), last_author_id
+
+# Iterate messages from newest to oldest, pages are seeked by (created_at, id) of last message so every page costs the same
+async def get_messages_iterator(guild_id: int, author_id: Optional[int], batch_size: int=2000) -> AsyncIterator[Message]:
+  async def get_messages(last_message: Optional[Message]):
+    query = select(Message).filter(Message.guild_id == guild_id)
     if author_id is not None:
-      return session.query(Message).filter(Message.author_id == str(author_id), Message.guild_id == str(guild_id)).order_by(Message.created_at.desc()).offset(index * 2000).limit(2000).all()
-    else:
-      return session.query(Message).filter(Message.guild_id == str(guild_id)).order_by(Message.created_at.desc()).offset(index * 2000).limit(2000).all()
+      query = query.filter(Message.author_id == author_id)
+    if last_message is not None:
+      # Values are bound with column types, asyncpg can't infer them inside row comparison
+      query = query.filter(tuple_(Message.created_at, Message.id) < tuple_(literal(last_message.created_at, Message.created_at.type), literal(last_message.id, Message.id.type)))
 
-  iter_index = 0
-  messages = get_messages(iter_index)
+    async with session_maker() as session:
+      result = await session.execute(query.order_by(Message.created_at.desc(), Message.id.desc()).limit(batch_size))
+      return result.scalars().all()
+
+  messages = await get_messages(None)
   while messages:
     for message in messages:
       yield message
 
-    iter_index += 1
-    messages = get_messages(iter_index)
+    if len(messages) < batch_size: break
+    messages = await get_messages(messages[-1])
+
+def fts5_query(search_term: str) -> str:
+  # Quote every word so user input can't break FTS5 query syntax, words are matched with AND
+  return " ".join('"' + word.replace('"', '""') + '"' for word in search_term.split())
+
+# Search messages by words using full text index, results are ordered by relevance and then by age
+async def search_messages(guild_id: int, search_term: str, author_id: Optional[int]=None, channel_id: Optional[int]=None, from_date: Optional[datetime.datetime]=None, to_date: Optional[datetime.datetime]=None, limit: int=100) -> List[Message]:
+  if not search_term.split(): return []
+
+  query = select(Message).filter(Message.guild_id == guild_id)
+  if author_id is not None:
+    query = query.filter(Message.author_id == author_id)
+  if channel_id is not None:
+    query = query.filter(or_(Message.channel_id == channel_id, Message.thread_id == channel_id))
+  if from_date is not None:
+    query = query.filter(Message.created_at >= from_date)
+  if to_date is not None:
+    query = query.filter(Message.created_at <= to_date)
+
+  dialect = database.db.dialect.name
+  if dialect == "postgresql":
+    ts_query = func.plainto_tsquery(literal_column("'simple'::regconfig"), search_term)
+    query = query.filter(content_tsvector().op("@@")(ts_query)).order_by(func.ts_rank(content_tsvector(), ts_query).desc(), Message.created_at.desc())
+  elif dialect == "sqlite":
+    query = query.join(messages_fts, Message.id == messages_fts.c.rowid).filter(literal_column("messages_fts").op("MATCH")(fts5_query(search_term))).order_by(messages_fts.c.rank, Message.created_at.desc())
+  else:
+    query = query.filter(Message.content.ilike(f"%{search_term}%")).order_by(Message.created_at.desc())
+
+  async with session_maker() as session:
+    result = await session.execute(query.limit(limit))
+    return result.scalars().all()
 
-def get_message_metrics(guild_id: int, days_back: int) -> List[Tuple[int, datetime.datetime, int, int]]:
+def fts5_trigram_query(search_term: str) -> str:
+  search_term = search_term.lower()
+  trigrams = set(search_term[i:i + 3] for i in range(len(search_term) - 2))
+  return " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in trigrams)
+
+# Search messages similar to search term by Levenshtein ratio
+# Candidates that share most trigrams with search term are selected by database and only those are scored exactly
+async def search_messages_fuzzy(guild_id: int, search_term: str, author_id: Optional[int]=None, channel_id: Optional[int]=None, limit: int=100, min_ratio: float=0.7, candidates_multiplier: int=20) -> List[Message]:
+  search_term = search_term.strip()
+  if not search_term: return []
+
+  def filter_query(query):
+    query = query.filter(Message.guild_id == guild_id, Message.content != None)
+    if author_id is not None:
+      query = query.filter(Message.author_id == author_id)
+    if channel_id is not None:
+      query = query.filter(or_(Message.channel_id == channel_id, Message.thread_id == channel_id))
+    return query
+
+  def score(message: Message) -> float:
+    return ratio(search_term.lower(), message.content.lower())
+
+  dialect = database.db.dialect.name
+  number_of_candidates = max(limit * candidates_multiplier, 500)
+  if messages_table.trigram_index_available and (dialect == "postgresql" or len(search_term) >= 3):
+    query = filter_query(select(Message))
+    if dialect == "postgresql":
+      query = query.filter(Message.content.op("%")(search_term)).order_by(func.similarity(Message.content, search_term).desc())
+    else:
+      query = query.join(messages_trigram, Message.id == messages_trigram.c.rowid).filter(literal_column("messages_trigram").op("MATCH")(fts5_trigram_query(search_term))).order_by(messages_trigram.c.rank)
+
+    async with session_maker() as session:
+      result = await session.execute(query.limit(number_of_candidates))
+      candidates = result.scalars().all()
+
+    scored_messages = [(score(message), message) for message in candidates]
+  else:
+    # No trigram index so all messages have to be scored
+    scored_messages = []
+    async for message in get_messages_iterator(guild_id, author_id):
+      if message.content is None: continue
+      if channel_id is not None and message.channel_id != channel_id and (message.thread_id is None or message.thread_id != channel_id): continue
+      scored_messages.append((score(message), message))
+
+  scored_messages = [scored_message for scored_message in scored_messages if scored_message[0] > min_ratio]
+  scored_messages.sort(key=lambda scored_message: scored_message[0], reverse=True)
+  return [message for _, message in scored_messages[:limit]]
+
+async def get_message_metrics(guild_id: int, days_back: int) -> List[Tuple[int, datetime.datetime, int, int]]:
   threshold_date = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
-  data = session.query(Message.id, Message.created_at, Message.author_id, Message.channel_id).filter(Message.created_at > threshold_date, Message.use_for_metrics == True, Message.guild_id == str(guild_id)).order_by(Message.created_at.desc()).all()
-  return [(int(d[0]), d[1], int(d[2]), int(d[3])) for d in data]
+  async with session_maker() as session:
+    result = await session.execute(select(Message.id, Message.created_at, Message.author_id, Message.channel_id).filter(Message.created_at > threshold_date, Message.use_for_metrics == True, Message.guild_id == guild_id).order_by(Message.created_at.desc()))
+    data = result.all()
+  return [tuple(d) for d in data]
 
-def get_messages_of_member(member_id: int, guild_id: int, hours_back: float) -> List[Message]:
+async def get_messages_of_member(member_id: int, guild_id: int, hours_back: float) -> List[Message]:
   threshold = datetime.datetime.utcnow() - datetime.timedelta(hours=hours_back)
-  return session.query(Message).filter(Message.author_id == str(member_id), Message.guild_id == str(guild_id), Message.created_at > threshold).order_by(Message.created_at.desc()).all()
+  async with session_maker() as session:
+    result = await session.execute(select(Message).filter(Message.author_id == member_id, Message.guild_id == guild_id, Message.created_at > threshold).order_by(Message.created_at.desc()))
+    return result.scalars().all()
 
-def delete_message(message_id: int, commit: bool=True):
-  session.query(Message).filter(Message.id == str(message_id)).delete()
-  if commit:
-    session.commit()
+async def delete_message(message_id: int):
+  async with session_maker() as session:
+    message_filter = Message.id == message_id
+    await message_rollups_repo.apply_changes(session, await message_rollups_repo.get_deleted_messages_changes(session, message_filter))
+    await session.execute(delete(Message).filter(message_filter))
+    await session.commit()
+  identity_cache.invalidate_last_metric_messages([message_id])
 
-def delete_old_messages(days: int, commit: bool=True):
+# Returns number of deleted messages (not counting dropped partitions)
+async def delete_old_messages(days: int, chunk_size: int=5000) -> int:
   threshold = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-  session.query(Message).filter(Message.created_at <= threshold).delete()
-  if commit:
-    session.commit()
+  async with database.db.begin() as connection:
+    await connection.run_sync(partitioning.drop_partitions_before, "messages", threshold)
+
+  # Rest of old messages from partially expired or default partition
+  deleted = await delete_in_chunks(Message.id, [Message.created_at <= threshold], chunk_size)
+
+  async with session_maker() as session:
+    await message_rollups_repo.apply_retention(session, threshold)
+    await session.commit()
+  identity_cache.last_metric_messages.clear()
+  return deleted
 
-def remove_message_data(user_id: int, guild_id: int):
-  session.query(Message).filter(Message.author_id == str(user_id), Message.guild_id == str(guild_id)).update({Message.content: None, Message.data: None})
-  session.commit()
+async def remove_message_data(user_id: int, guild_id: int):
+  async with session_maker() as session:
+    await session.execute(update(Message).filter(Message.author_id == user_id, Message.guild_id == guild_id).values(content=None, data=None))
+    await session.commit()
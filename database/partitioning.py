@@ -0,0 +1,178 @@
+# Optional time partitioning of large append only tables on Postgres
+# Partitions are named <table>_p<YYYYMMDD> after date of their start, rows older than first partition go to default partition
+# Run as `python -m database.partitioning` to convert existing tables to partitioned layout
+
+import asyncio
+import datetime
+from typing import List, Tuple, Optional
+from sqlalchemy import text
+
+from config import config
+from database import database, get_partition_interval
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Table name: partition key column
+PARTITIONED_TABLES = {
+  "messages": "created_at",
+  "audit_log": "timestamp"
+}
+
+def partition_start(date: datetime.datetime, interval: str) -> datetime.datetime:
+  date = date.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+  if interval == "week":
+    return date - datetime.timedelta(days=date.weekday())
+  return date.replace(day=1)
+
+def next_partition_start(start: datetime.datetime, interval: str) -> datetime.datetime:
+  if interval == "week":
+    return start + datetime.timedelta(days=7)
+  return (start + datetime.timedelta(days=32)).replace(day=1)
+
+def partition_name(table: str, start: datetime.datetime) -> str:
+  return f"{table}_p{start.strftime('%Y%m%d')}"
+
+def is_partitioned(connection, table: str) -> bool:
+  return connection.execute(text("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"), {"table": table}).first() is not None
+
+# Returns (name, start) of all range partitions of table ordered by start
+def get_partitions(connection, table: str) -> List[Tuple[str, datetime.datetime]]:
+  result = connection.execute(text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"), {"table": table})
+
+  partitions = []
+  for name, in result.all():
+    suffix = name[len(table) + 2:]
+    if not name.startswith(f"{table}_p") or not suffix.isdigit(): continue
+    partitions.append((name, datetime.datetime.strptime(suffix, "%Y%m%d")))
+  partitions.sort(key=lambda partition: partition[1])
+  return partitions
+
+# Default partition can already contain rows of range of new partition (bot was offline longer than partitions ahead)
+# Postgres refuses to create partition over them so they are moved to it while default partition is detached
+def create_partition(connection, table: str, start: datetime.datetime, end: datetime.datetime):
+  name = partition_name(table, start)
+  bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+  range_filter = f"{PARTITIONED_TABLES[table]} >= '{start.isoformat()}' AND {PARTITIONED_TABLES[table]} < '{end.isoformat()}'"
+
+  if connection.execute(text(f"SELECT 1 FROM {table}_default WHERE {range_filter} LIMIT 1")).first() is None:
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} {bounds}"))
+    logger.info(f"Created partition `{name}`")
+    return
+
+  columns = ", ".join(column.name for column in database.base.metadata.tables[table].columns)
+  connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {table}_default"))
+  connection.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {bounds}"))
+  result = connection.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_default WHERE {range_filter}"))
+  connection.execute(text(f"DELETE FROM {table}_default WHERE {range_filter}"))
+  connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {table}_default DEFAULT"))
+  logger.info(f"Created partition `{name}` and moved {result.rowcount} rows to it from default partition")
+
+# Create default partition and partitions from from_date (or now) to configured number of intervals in future
+def ensure_table_partitions(connection, table: str, from_date: Optional[datetime.datetime]=None):
+  interval = get_partition_interval()
+  if interval is None: return
+
+  if not is_partitioned(connection, table):
+    logger.warning(f"Table `{table}` is not partitioned, run `python -m database.partitioning` to convert it")
+    return
+
+  connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+
+  existing_starts = set(start for _, start in get_partitions(connection, table))
+  start = partition_start(from_date if from_date is not None else datetime.datetime.utcnow(), interval)
+  if existing_starts and from_date is None:
+    # Don't fill gaps before newest partition, old rows belong to default partition
+    start = max(start, max(existing_starts))
+
+  last_start = partition_start(datetime.datetime.utcnow(), interval)
+  for _ in range(config.db.partitions_ahead):
+    last_start = next_partition_start(last_start, interval)
+
+  while start <= last_start:
+    end = next_partition_start(start, interval)
+    if start not in existing_starts:
+      # Failure of one partition doesn't stop creation of the others, rows of its range stay in default partition
+      try:
+        with connection.begin_nested():
+          create_partition(connection, table, start, end)
+      except Exception as e:
+        logger.error(f"Failed to create partition `{partition_name(table, start)}`\n{e}")
+    start = end
+
+def ensure_partitions(connection):
+  if get_partition_interval() is None: return
+
+  for table in PARTITIONED_TABLES.keys():
+    ensure_table_partitions(connection, table)
+
+# Detach and drop partitions which contains only rows older than threshold, returns number of dropped partitions
+def drop_partitions_before(connection, table: str, threshold: datetime.datetime) -> int:
+  interval = get_partition_interval()
+  if interval is None or not is_partitioned(connection, table): return 0
+
+  dropped = 0
+  for name, start in get_partitions(connection, table):
+    if next_partition_start(start, interval) > threshold: break
+
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+    connection.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"Dropped partition `{name}`")
+    dropped += 1
+  return dropped
+
+# Move existing unpartitioned table aside, create partitioned one in its place and copy all rows into it
+def migrate_table(connection, table: str):
+  if is_partitioned(connection, table):
+    logger.info(f"Table `{table}` is already partitioned")
+    return
+
+  legacy_table = f"{table}_legacy"
+  partition_column = PARTITIONED_TABLES[table]
+  table_object = database.base.metadata.tables[table]
+
+  serial_sequence = connection.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+
+  connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy_table}"))
+  # Names of indexes and sequences are global in schema so old ones have to be removed from the way
+  connection.execute(text(f"ALTER TABLE {legacy_table} RENAME CONSTRAINT {table}_pkey TO {legacy_table}_pkey"))
+  for constraint, in connection.execute(text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'u'"), {"table": legacy_table}).all():
+    connection.execute(text(f"ALTER TABLE {legacy_table} DROP CONSTRAINT {constraint}"))
+  for index, in connection.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexname != :primary_key"), {"table": legacy_table, "primary_key": f"{legacy_table}_pkey"}).all():
+    connection.execute(text(f"DROP INDEX {index}"))
+  if serial_sequence is not None:
+    connection.execute(text(f"ALTER SEQUENCE {serial_sequence} RENAME TO {legacy_table}_id_seq"))
+
+  table_object.create(connection)
+  oldest = connection.execute(text(f"SELECT min({partition_column}) FROM {legacy_table}")).scalar()
+  ensure_table_partitions(connection, table, oldest)
+
+  columns = ", ".join(column.name for column in table_object.columns)
+  result = connection.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy_table}"))
+  logger.info(f"Copied {result.rowcount} rows to partitioned table `{table}`")
+
+  if serial_sequence is not None:
+    connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"))
+
+  connection.execute(text(f"DROP TABLE {legacy_table}"))
+
+async def migrate():
+  from database.database_manipulation import load_sub_modules, init_tables
+
+  if get_partition_interval() is None:
+    logger.error("Partitioning is not enabled, set `partition_interval` in `db` section of config (postgresql only)")
+    return
+
+  load_sub_modules("database.tables")
+  async with database.db.begin() as connection:
+    for table in PARTITIONED_TABLES.keys():
+      exists = (await connection.execute(text("SELECT to_regclass(:table)"), {"table": table})).scalar() is not None
+      if exists:
+        await connection.run_sync(migrate_table, table)
+
+  # Recreate full text indexes and rest of partitions
+  await init_tables()
+  await database.db.dispose()
+
+if __name__ == "__main__":
+  asyncio.run(migrate())
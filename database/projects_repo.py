@@ -1,27 +1,30 @@
 from typing import Optional, List
+from sqlalchemy import select, delete
 
-from database import session
+from database import session_maker
 from database.tables.projects import Project
 
-def get_by_name(name: str) -> Optional[Project]:
-  return session.query(Project).filter(Project.name == name).one_or_none()
+async def get_by_name(name: str) -> Optional[Project]:
+  async with session_maker() as session:
+    result = await session.execute(select(Project).filter(Project.name == name))
+    return result.scalar_one_or_none()
 
-def add_project(project_name: str, project_description: str) -> Optional[Project]:
-  if get_by_name(project_name) is None:
-    item = Project(name=project_name, description=project_description)
-    session.add(item)
-    session.commit()
+async def add_project(project_name: str, project_description: str) -> Optional[Project]:
+  if await get_by_name(project_name) is None:
+    async with session_maker() as session:
+      item = Project(name=project_name, description=project_description)
+      session.add(item)
+      await session.commit()
     return item
   return None
 
-def remove_project(project_name: str) -> bool:
-  project = get_by_name(project_name)
-  if project is None:
-    return False
+async def remove_project(project_name: str) -> bool:
+  async with session_maker() as session:
+    result = await session.execute(delete(Project).filter(Project.name == project_name))
+    await session.commit()
+  return result.rowcount == 1
 
-  session.delete(project)
-  session.commit()
-  return True
-
-def get_all() -> List[Project]:
-  return session.query(Project).all()
+async def get_all() -> List[Project]:
+  async with session_maker() as session:
+    result = await session.execute(select(Project))
+    return result.scalars().all()
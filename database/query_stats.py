@@ -0,0 +1,133 @@
+# Latency statistics of executed SQL statements grouped by function which issued them
+# Hooked to engine cursor events, statements slower than configured threshold are written to slow query log with parameters redacted
+
+import logging
+import os
+import re
+import sys
+import time
+import greenlet
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import config
+from util.logger import setup_custom_logger, formater
+
+slow_query_logger = setup_custom_logger("slow_queries")
+
+if config.db.slow_query_log_file:
+  slow_query_file_handler = logging.FileHandler(config.db.slow_query_log_file)
+  slow_query_file_handler.setFormatter(formater)
+  slow_query_logger.addHandler(slow_query_file_handler)
+
+# Upper bounds of histogram buckets in ms, last one takes everything slower
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Shared helpers of repos, their callers are reported instead
+SKIPPED_FILES = (os.path.join(PROJECT_ROOT, "database", "__init__.py"), os.path.abspath(__file__))
+
+# Lists of placeholders (IN lists, rows of multi-row inserts) vary in length, they are collapsed so same statement is counted together
+PLACEHOLDERS_REGEX = re.compile(r"(?:\?|%s|\$\d+)(?:\s*,\s*(?:\?|%s|\$\d+))+")
+ROWS_REGEX = re.compile(r"\(\?\.\.\.\)(?:\s*,\s*\(\?\.\.\.\))+")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+class StatementStats:
+  def __init__(self, caller: str, statement: str):
+    self.caller = caller
+    self.statement = statement
+    self.count = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+    self.buckets = [0] * len(BUCKETS)
+
+  def record(self, duration_ms: float):
+    self.count += 1
+    self.total_ms += duration_ms
+    self.max_ms = max(self.max_ms, duration_ms)
+    for idx, bound in enumerate(BUCKETS):
+      if duration_ms <= bound:
+        self.buckets[idx] += 1
+        break
+
+  @property
+  def average_ms(self) -> float:
+    return self.total_ms / self.count if self.count > 0 else 0.0
+
+  # Upper bound of bucket in which percentile lies (max duration for last bucket)
+  def percentile_ms(self, percentile: float) -> float:
+    target = self.count * percentile
+    cumulative = 0
+    for idx, count in enumerate(self.buckets):
+      cumulative += count
+      if count > 0 and cumulative >= target:
+        return min(BUCKETS[idx], self.max_ms)
+    return self.max_ms
+
+# Key: (caller, normalized statement)
+statements: Dict[Tuple[str, str], StatementStats] = {}
+# Code objects are checked only once
+_project_code: Dict[Any, bool] = {}
+
+def normalize_statement(statement: str) -> str:
+  statement = WHITESPACE_REGEX.sub(" ", statement).strip()
+  statement = PLACEHOLDERS_REGEX.sub("?...", statement)
+  return ROWS_REGEX.sub("(?...), ...", statement)
+
+def is_project_code(code) -> bool:
+  result = _project_code.get(code)
+  if result is None:
+    # Code generated at runtime has filenames like <string>
+    filename = os.path.abspath(code.co_filename)
+    result = code.co_filename.endswith(".py") and filename.startswith(PROJECT_ROOT) and filename not in SKIPPED_FILES
+    _project_code[code] = result
+  return result
+
+# Async engine runs statements in greenlet so stack of awaiting coroutines continues in frame of parent greenlet
+def get_caller() -> str:
+  frame = sys._getframe(2)
+  current = greenlet.getcurrent()
+  while True:
+    while frame is not None:
+      if is_project_code(frame.f_code):
+        module = os.path.relpath(frame.f_code.co_filename, PROJECT_ROOT)[:-3].replace(os.sep, ".")
+        return f"{module}.{frame.f_code.co_name}"
+      frame = frame.f_back
+
+    current = current.parent
+    if current is None: return "unknown"
+    frame = current.gr_frame
+
+def redact_parameters(parameters, executemany: bool) -> str:
+  if executemany:
+    return f"<{len(parameters)} parameter sets>"
+  if isinstance(parameters, dict):
+    return "{" + ", ".join(f"{key}: <{type(value).__name__}>" for key, value in parameters.items()) + "}"
+  if isinstance(parameters, (list, tuple)):
+    return "(" + ", ".join(f"<{type(value).__name__}>" for value in parameters) + ")"
+  return f"<{type(parameters).__name__}>"
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  context._query_start_time = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  start_time = getattr(context, "_query_start_time", None)
+  if start_time is None: return
+  duration_ms = (time.perf_counter() - start_time) * 1000
+
+  caller = get_caller()
+  normalized = normalize_statement(statement)
+  stats = statements.get((caller, normalized))
+  if stats is None:
+    stats = statements[(caller, normalized)] = StatementStats(caller, normalized)
+  stats.record(duration_ms)
+
+  if 0 <= config.db.slow_query_threshold_ms <= duration_ms:
+    slow_query_logger.warning(f"Slow query ({duration_ms:.1f}ms) from `{caller}`: {WHITESPACE_REGEX.sub(' ', statement).strip()} parameters: {redact_parameters(parameters, executemany)}")
+
+def get_top_statements(order_by: str="total", limit: Optional[int]=None) -> List[StatementStats]:
+  key = (lambda stats: stats.count) if order_by == "count" else (lambda stats: stats.total_ms)
+  result = sorted(statements.values(), key=key, reverse=True)
+  return result[:limit] if limit is not None else result
+
+def reset():
+  statements.clear()
@@ -0,0 +1,227 @@
+# Conversion of discord snowflake columns stored as strings (databases created by older versions) to BIGINT
+# Columns to convert are found by comparing types in database with table definitions, so it can be run repeatedly
+#
+# Postgres (can run while old version of bot is still running):
+#   `python -m database.snowflake_migration backfill` adds shadow BIGINT column for each converted column, trigger keeping it in sync with new writes
+#   and fills existing rows in batches each in its own short transaction
+#   `python -m database.snowflake_migration finish` (bot stopped) swaps shadow columns in place and recreates keys, indexes and foreign keys
+# SQLite (bot stopped, SQLite can't change type of column):
+#   every table is copied in batches to new table with correct schema which then replaces the old one
+# Running without step does both steps
+
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import text, inspect
+from sqlalchemy.schema import CreateTable, AddConstraint
+from sqlalchemy.sql import sqltypes
+from sqlalchemy.sql.schema import PrimaryKeyConstraint, UniqueConstraint, ForeignKeyConstraint
+
+from database import database, BigIntegerType
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+SHADOW_SUFFIX = "_bigint"
+
+# Table name: names of snowflake columns which are still stored as strings
+def get_columns_to_convert(connection) -> Dict[str, List[str]]:
+  inspector = inspect(connection)
+  existing_tables = set(inspector.get_table_names())
+
+  tables = {}
+  for table in database.base.metadata.sorted_tables:
+    if table.name not in existing_tables: continue
+
+    stored_types = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+    columns = [column.name for column in table.columns if column.type is BigIntegerType and isinstance(stored_types.get(column.name), sqltypes.String)]
+    if columns:
+      tables[table.name] = columns
+  return tables
+
+def get_primary_key(connection, table: str) -> List[str]:
+  return inspect(connection).get_pk_constraint(table)["constrained_columns"]
+
+def row_value(columns: List[str]) -> str:
+  return f"({', '.join(columns)})" if len(columns) > 1 else columns[0]
+
+# Last key of next batch of rows ordered by key columns, None when there are no rows left
+def get_batch_end(connection, table: str, key_columns: List[str], batch_start: Optional[tuple], batch_size: int) -> Optional[tuple]:
+  params = {"limit": batch_size}
+  condition = ""
+  if batch_start is not None:
+    condition = f"WHERE {row_value(key_columns)} > {row_value([f':start_{i}' for i in range(len(key_columns))])}"
+    params.update({f"start_{i}": value for i, value in enumerate(batch_start)})
+
+  rows = connection.execute(text(f"SELECT {', '.join(key_columns)} FROM {table} {condition} ORDER BY {', '.join(key_columns)} LIMIT :limit"), params).all()
+  return tuple(rows[-1]) if rows else None
+
+def batch_condition(key_columns: List[str], batch_start: Optional[tuple], batch_end: tuple) -> Tuple[str, dict]:
+  params = {f"end_{i}": value for i, value in enumerate(batch_end)}
+  condition = f"{row_value(key_columns)} <= {row_value([f':end_{i}' for i in range(len(key_columns))])}"
+  if batch_start is not None:
+    params.update({f"start_{i}": value for i, value in enumerate(batch_start)})
+    condition = f"{row_value(key_columns)} > {row_value([f':start_{i}' for i in range(len(key_columns))])} AND {condition}"
+  return condition, params
+
+# Run statement (with {condition} placeholder) over whole table in keyset batches, each batch in its own transaction
+async def run_in_batches(table: str, key_columns: List[str], statement: str, batch_size: int) -> int:
+  processed = 0
+  batch_start = None
+  start_time = time.perf_counter()
+
+  while True:
+    async with database.db.begin() as connection:
+      batch_end = await connection.run_sync(get_batch_end, table, key_columns, batch_start, batch_size)
+      if batch_end is None: break
+
+      condition, params = batch_condition(key_columns, batch_start, batch_end)
+      result = await connection.execute(text(statement.format(condition=condition)), params)
+
+    processed += result.rowcount
+    batch_start = batch_end
+    logger.info(f"`{table}`: {processed} rows converted ({processed / max(time.perf_counter() - start_time, 0.001):.0f} rows/s)")
+  return processed
+
+# Postgres
+def postgres_missing_condition(columns: List[str]) -> str:
+  return " OR ".join(f"({column}{SHADOW_SUFFIX} IS NULL AND {column} IS NOT NULL)" for column in columns)
+
+def postgres_shadow_assignments(columns: List[str]) -> str:
+  return ", ".join(f"{column}{SHADOW_SUFFIX} = CAST({column} AS BIGINT)" for column in columns)
+
+def postgres_create_shadow_columns(connection, table: str, columns: List[str]):
+  for column in columns:
+    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}{SHADOW_SUFFIX} BIGINT"))
+
+  assignments = " ".join(f"NEW.{column}{SHADOW_SUFFIX} := CAST(NEW.{column} AS BIGINT);" for column in columns)
+  connection.execute(text(f"CREATE OR REPLACE FUNCTION {table}_snowflake_sync() RETURNS trigger AS $$ BEGIN {assignments} RETURN NEW; END $$ LANGUAGE plpgsql"))
+  connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_snowflake_sync ON {table}"))
+  connection.execute(text(f"CREATE TRIGGER {table}_snowflake_sync BEFORE INSERT OR UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION {table}_snowflake_sync()"))
+
+# Already filled rows are skipped so interrupted backfill can be simply run again
+async def postgres_backfill(tables: Dict[str, List[str]], batch_size: int):
+  for table, columns in tables.items():
+    async with database.db.begin() as connection:
+      await connection.run_sync(postgres_create_shadow_columns, table, columns)
+      key_columns = await connection.run_sync(get_primary_key, table)
+
+    filled = await run_in_batches(table, key_columns, f"UPDATE {table} SET {postgres_shadow_assignments(columns)} WHERE {{condition}} AND ({postgres_missing_condition(columns)})", batch_size)
+    logger.info(f"Shadow columns of `{table}` filled, {filled} rows")
+
+def postgres_swap_columns(connection, tables: Dict[str, List[str]]):
+  for table, columns in tables.items():
+    # Safety net for rows changed after backfill batch passed them, normally trigger already handled them
+    connection.execute(text(f"UPDATE {table} SET {postgres_shadow_assignments(columns)} WHERE {postgres_missing_condition(columns)}"))
+
+    connection.execute(text(f"DROP TRIGGER IF EXISTS {table}_snowflake_sync ON {table}"))
+    connection.execute(text(f"DROP FUNCTION IF EXISTS {table}_snowflake_sync()"))
+
+  # Dropping old columns removes all keys, indexes and foreign keys using them (even from other tables)
+  for table, columns in tables.items():
+    for column in columns:
+      connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {column} CASCADE"))
+      connection.execute(text(f"ALTER TABLE {table} RENAME COLUMN {column}{SHADOW_SUFFIX} TO {column}"))
+
+  converted = set((table, column) for table, columns in tables.items() for column in columns)
+  metadata_tables = database.base.metadata.tables
+
+  for table, columns in tables.items():
+    table_object = metadata_tables[table]
+    for column in columns:
+      if not table_object.columns[column].nullable and not table_object.columns[column].primary_key:
+        connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL"))
+
+    for constraint in table_object.constraints:
+      if isinstance(constraint, (PrimaryKeyConstraint, UniqueConstraint)) and any((table, column.name) in converted for column in constraint.columns):
+        connection.execute(AddConstraint(constraint))
+
+  from database.database_manipulation import create_missing_indexes
+  create_missing_indexes(connection)
+
+  # Foreign keys are created last when all referenced keys exist again
+  for table_object in database.base.metadata.sorted_tables:
+    for constraint in table_object.constraints:
+      if not isinstance(constraint, ForeignKeyConstraint): continue
+      if any((table_object.name, column.name) in converted or (element.column.table.name, element.column.name) in converted for column, element in zip(constraint.columns, constraint.elements)):
+        connection.execute(AddConstraint(constraint))
+
+  for table in tables.keys():
+    connection.execute(text(f"ANALYZE {table}"))
+
+async def postgres_finish(tables: Dict[str, List[str]], batch_size: int):
+  # Only rows changed since last backfill are converted here so final transaction stays short
+  await postgres_backfill(tables, batch_size)
+
+  start_time = time.perf_counter()
+  async with database.db.begin() as connection:
+    await connection.run_sync(postgres_swap_columns, tables)
+  logger.info(f"Columns swapped in {time.perf_counter() - start_time:.1f}s")
+
+# SQLite
+def sqlite_create_table_copy(connection, table: str):
+  connection.execute(text(f"DROP TABLE IF EXISTS {table}{SHADOW_SUFFIX}"))
+  create_statement = str(CreateTable(database.base.metadata.tables[table]).compile(dialect=connection.dialect))
+  connection.execute(text(create_statement.replace(f"CREATE TABLE {table} ", f"CREATE TABLE {table}{SHADOW_SUFFIX} ", 1)))
+
+def sqlite_replace_table(connection, table: str):
+  # Indexes and triggers are dropped together with old table
+  connection.execute(text(f"DROP TABLE {table}"))
+  connection.execute(text(f"ALTER TABLE {table}{SHADOW_SUFFIX} RENAME TO {table}"))
+  connection.execute(text(f"ANALYZE {table}"))
+
+async def sqlite_migrate(tables: Dict[str, List[str]], batch_size: int):
+  for table, columns in tables.items():
+    async with database.db.begin() as connection:
+      await connection.run_sync(sqlite_create_table_copy, table)
+
+    column_names = [column.name for column in database.base.metadata.tables[table].columns]
+    values = ", ".join(f"CAST({column} AS INTEGER)" if column in columns else column for column in column_names)
+    copied = await run_in_batches(table, ["rowid"], f"INSERT INTO {table}{SHADOW_SUFFIX} ({', '.join(column_names)}) SELECT {values} FROM {table} WHERE {{condition}}", batch_size)
+
+    async with database.db.begin() as connection:
+      await connection.run_sync(sqlite_replace_table, table)
+    logger.info(f"Table `{table}` converted, {copied} rows")
+
+async def migrate(step: str, batch_size: int):
+  from database.database_manipulation import load_sub_modules, init_tables
+
+  load_sub_modules("database.tables")
+  async with database.db.connect() as connection:
+    tables = await connection.run_sync(get_columns_to_convert)
+
+  if not tables:
+    logger.info("All snowflake columns are already stored as BIGINT")
+  else:
+    logger.info(f"Converting {', '.join(f'{table} ({len(columns)})' for table, columns in tables.items())}")
+
+    start_time = time.perf_counter()
+    if database.db.dialect.name == "postgresql":
+      if step in ("backfill", "all"):
+        await postgres_backfill(tables, batch_size)
+      if step in ("finish", "all"):
+        await postgres_finish(tables, batch_size)
+    else:
+      await sqlite_migrate(tables, batch_size)
+    logger.info(f"Conversion finished in {time.perf_counter() - start_time:.1f}s")
+
+    if step != "backfill" or database.db.dialect.name != "postgresql":
+      # Recreate indexes and full text triggers removed together with old columns or tables
+      await init_tables()
+
+    if database.db.dialect.name == "sqlite":
+      # Space of old tables stays in file until vacuum, it can't run inside transaction
+      async with database.db.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("VACUUM"))
+
+  await database.db.dispose()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Convert discord snowflake columns stored as strings to BIGINT")
+  parser.add_argument("step", nargs="?", choices=("backfill", "finish", "all"), default="all")
+  parser.add_argument("--batch-size", type=int, default=10000)
+  args = parser.parse_args()
+
+  asyncio.run(migrate(args.step, args.batch_size))
@@ -0,0 +1,42 @@
+import datetime
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import select, func
+
+from database import database, session_maker, dialect_insert
+from database.tables.sync_checkpoints import SyncCheckpoint
+from database.tables.messages import Message
+
+async def get_checkpoints(channel_ids: Iterable[int]) -> Dict[int, int]:
+  channel_ids = list(channel_ids)
+  if not channel_ids: return {}
+
+  async with session_maker() as session:
+    result = await session.execute(select(SyncCheckpoint.id, SyncCheckpoint.last_message_id).filter(SyncCheckpoint.id.in_(channel_ids)))
+    return {channel_id: last_message_id for channel_id, last_message_id in result.all()}
+
+# Checkpoints are (channel or thread id, guild id, last message id) and only move forward
+async def set_checkpoints(checkpoints: List[Tuple[int, int, int]]):
+  if not checkpoints: return
+
+  rows = {}
+  for channel_id, guild_id, message_id in checkpoints:
+    if channel_id not in rows.keys() or rows[channel_id]["last_message_id"] < message_id:
+      rows[channel_id] = {"id": channel_id, "guild_id": guild_id, "last_message_id": message_id, "updated_at": datetime.datetime.utcnow()}
+
+  greatest = func.greatest if database.db.dialect.name == "postgresql" else func.max
+  statement = dialect_insert(SyncCheckpoint).values(list(rows.values()))
+  statement = statement.on_conflict_do_update(index_elements=[SyncCheckpoint.id],
+                                              set_={"last_message_id": greatest(SyncCheckpoint.last_message_id, statement.excluded.last_message_id), "updated_at": statement.excluded.updated_at})
+  async with session_maker() as session:
+    await session.execute(statement)
+    await session.commit()
+
+async def set_checkpoint(channel_id: int, guild_id: int, message_id: int):
+  await set_checkpoints([(channel_id, guild_id, message_id)])
+
+# Newest stored message of each channel and thread, used as checkpoint for channels synced for first time
+async def get_newest_stored_message_ids(guild_ids: Iterable[int]) -> Dict[int, int]:
+  guild_ids = list(guild_ids)
+  async with session_maker() as session:
+    result = await session.execute(select(func.coalesce(Message.thread_id, Message.channel_id), func.max(Message.id)).filter(Message.guild_id.in_(guild_ids)).group_by(func.coalesce(Message.thread_id, Message.channel_id)))
+    return {channel_id: message_id for channel_id, message_id in result.all()}
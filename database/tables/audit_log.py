@@ -1,9 +1,9 @@
-from sqlalchemy import Column, DateTime, String, Enum, JSON, ForeignKey
+from sqlalchemy import Column, Enum, JSON, ForeignKey
 from sqlalchemy.orm import relationship
 import enum
 import datetime
 
-from database import database, BigIntegerType
+from database import database, BigIntegerType, DateTimeType, get_partition_interval
 
 class AuditLogItemType(enum.Enum):
   USER_UPDATED = 1
@@ -15,12 +15,14 @@ class AuditLogItemType(enum.Enum):
 
 class AuditLog(database.base):
   __tablename__ = "audit_log"
+  # Primary key of partitioned table have to contain partition key
+  __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"} if get_partition_interval() is not None else {}
 
-  id = Column(BigIntegerType, primary_key=True, index=True, autoincrement=True, unique=True)
-  timestamp = Column(DateTime, index=True, nullable=False, default=datetime.datetime.utcnow)
+  id = Column(BigIntegerType, primary_key=True, index=True, autoincrement=True, unique=get_partition_interval() is None)
+  timestamp = Column(DateTimeType, index=True, nullable=False, default=datetime.datetime.utcnow, primary_key=get_partition_interval() is not None)
 
-  user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=True)
-  guild_id = Column(String, ForeignKey("guilds.id", ondelete="CASCADE"), index=True, nullable=True)
+  user_id = Column(BigIntegerType, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=True)
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), index=True, nullable=True)
   member_iid = Column(BigIntegerType, ForeignKey("members.member_iid", ondelete="CASCADE"), index=True, nullable=True)
 
   member = relationship("Member", back_populates="audit_logs", uselist=False)
@@ -1,15 +1,16 @@
 import disnake
 from typing import Optional
-from sqlalchemy import Column, String
+from sqlalchemy import Column
 from sqlalchemy.orm import relationship
 
-from database import database
+from database import database, BigIntegerType
+from util import general_util
 from features.base_bot import BaseAutoshardedBot
 
 class Guild(database.base):
   __tablename__ = "guilds"
 
-  id = Column(String, primary_key=True, unique=True, index=True)
+  id = Column(BigIntegerType, primary_key=True, autoincrement=False, unique=True, index=True)
 
   text_channels = relationship("TextChannel", back_populates="guild", uselist=True)
   members = relationship("Member", back_populates="guild", uselist=True)
@@ -17,13 +18,7 @@ class Guild(database.base):
 
   @classmethod
   def from_guild(cls, guild: disnake.Guild):
-    return cls(id=str(guild.id))
+    return cls(id=guild.id)
 
   async def to_object(self, bot: BaseAutoshardedBot) -> Optional[disnake.Guild]:
-    guild = bot.get_guild(int(self.id))
-    if guild is None:
-      try:
-        guild = await bot.fetch_guild(int(self.id))
-      except disnake.NotFound:
-        return None
-    return guild
\ No newline at end of file
+    return await general_util.get_or_fetch_guild(bot, self.id)
\ No newline at end of file
@@ -1,17 +1,17 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, ForeignKey
 from sqlalchemy.orm import relationship
 import datetime
 
-from database import database, BigIntegerType
+from database import database, BigIntegerType, DateTimeType
 
 class HelpThread(database.base):
   __tablename__ = "help_threads"
 
-  thread_id = Column(String, ForeignKey("text_threads.id", ondelete="CASCADE"), primary_key=True, unique=True, index=True)
-  owner_id = Column(String, ForeignKey("users.id", ondelete="SET NULL"), index=True)
+  thread_id = Column(BigIntegerType, ForeignKey("text_threads.id", ondelete="CASCADE"), primary_key=True, unique=True, index=True)
+  owner_id = Column(BigIntegerType, ForeignKey("users.id", ondelete="SET NULL"), index=True)
   member_iid = Column(BigIntegerType, ForeignKey("members.member_iid", ondelete="SET NULL"), index=True)
   tags = Column(String, nullable=True)
-  last_activity_time = Column(DateTime, index=True, default=datetime.datetime.utcnow)
+  last_activity_time = Column(DateTimeType, index=True, default=datetime.datetime.utcnow)
 
   thread = relationship("TextThread", uselist=False)
   member = relationship("Member", uselist=False)
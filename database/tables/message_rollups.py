@@ -0,0 +1,33 @@
+import datetime
+from sqlalchemy import Column, ForeignKey, select, insert, func, event, literal_column
+
+from database import database, BigIntegerType, DateTimeType, time_bucket, time_bucket_expression
+from database.tables.messages import Message
+
+def hour_bucket(timestamp: datetime.datetime) -> datetime.datetime:
+  return time_bucket(timestamp, "hour")
+
+# Hourly count of metric messages, maintained incrementally by message ingestion and deletion
+class MessageRollup(database.base):
+  __tablename__ = "message_rollups"
+
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), primary_key=True)
+  channel_id = Column(BigIntegerType, ForeignKey("text_channels.id", ondelete="CASCADE"), primary_key=True)
+  author_id = Column(BigIntegerType, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+  hour = Column(DateTimeType, primary_key=True, index=True)
+
+  count = Column(BigIntegerType, nullable=False, default=0)
+
+def rollups_from_messages_statement(dialect_name: str, message_filter=None):
+  message_query = select(Message.guild_id, Message.channel_id, Message.author_id, time_bucket_expression(Message.created_at, "hour", dialect_name).label("hour"), func.count(Message.id)).filter(Message.use_for_metrics == True, Message.guild_id != None)
+  if message_filter is not None:
+    message_query = message_query.filter(message_filter)
+  message_query = message_query.group_by(Message.guild_id, Message.channel_id, Message.author_id, literal_column("hour"))
+  return insert(MessageRollup).from_select([MessageRollup.guild_id, MessageRollup.channel_id, MessageRollup.author_id, MessageRollup.hour, MessageRollup.count], message_query)
+
+# Fill rollups from already collected messages when table is created
+@event.listens_for(MessageRollup.__table__, "after_create")
+def fill_created_table(target, connection, **kw):
+  # On fresh database messages table can be created after this one
+  if connection.dialect.has_table(connection, "messages"):
+    connection.execute(rollups_from_messages_statement(connection.dialect.name))
@@ -1,12 +1,14 @@
 import disnake
 from typing import Optional
-from sqlalchemy import Column, DateTime, String, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, String, ForeignKey, Boolean, JSON, Index, text, table, column, func, literal_column
 from sqlalchemy.orm import relationship
 
-from database import database, BigIntegerType
-from database import users_repo
+from database import database, BigIntegerType, DateTimeType, get_partition_interval
 from util import general_util
 from features.base_bot import BaseAutoshardedBot
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
 
 def message_to_message_data(message):
   return {
@@ -17,56 +19,126 @@ def message_to_message_data(message):
 
 class Message(database.base):
   __tablename__ = "messages"
+  # Primary key of partitioned table have to contain partition key
+  __table_args__ = (Index("ix_messages_guild_id_created_at_id", "guild_id", "created_at", "id"),
+                    {"postgresql_partition_by": "RANGE (created_at)"} if get_partition_interval() is not None else {})
 
-  id = Column(String, primary_key=True, unique=True, index=True)
-  author_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
-  guild_id = Column(String, ForeignKey("guilds.id", ondelete="CASCADE"), nullable=True, index=True)
+  id = Column(BigIntegerType, primary_key=True, autoincrement=False, unique=get_partition_interval() is None, index=True)
+  author_id = Column(BigIntegerType, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), nullable=True, index=True)
   member_iid = Column(BigIntegerType, ForeignKey("members.member_iid", ondelete="CASCADE"), index=True, nullable=True)
 
   member = relationship("Member", back_populates="messages", uselist=False)
   user = relationship("User", back_populates="messages", uselist=False)
 
-  created_at = Column(DateTime, index=True, nullable=False)
-  edited_at = Column(DateTime)
+  created_at = Column(DateTimeType, index=True, nullable=False, primary_key=get_partition_interval() is not None)
+  edited_at = Column(DateTimeType)
 
-  channel_id = Column(String, ForeignKey("text_channels.id", ondelete="CASCADE"), index=True, nullable=False)
-  thread_id = Column(String, ForeignKey("text_threads.id", ondelete="CASCADE"), index=True, nullable=True)
+  channel_id = Column(BigIntegerType, ForeignKey("text_channels.id", ondelete="CASCADE"), index=True, nullable=False)
+  thread_id = Column(BigIntegerType, ForeignKey("text_threads.id", ondelete="CASCADE"), index=True, nullable=True)
   channel = relationship("TextChannel", back_populates="messages", uselist=False)
   thread = relationship("TextThread", back_populates="messages", uselist=False)
 
-  content = Column(String, nullable=True, index=True)
+  content = Column(String, nullable=True)
   data = Column(JSON, nullable=True)
 
   use_for_metrics = Column(Boolean, nullable=False, default=False)
 
   @classmethod
-  def from_message(cls, message: disnake.Message):
+  def from_message(cls, message: disnake.Message, member_iid: Optional[int]=None):
     channel_is_thread = isinstance(message.channel, disnake.Thread)
     channel_id = message.channel.parent.id if channel_is_thread else message.channel.id
     thread_id = message.channel.id if channel_is_thread else None
     guild_id = message.guild.id if message.guild is not None else None
     user_id = message.author.id
-    member_iid = None
-    if guild_id is not None:
-      member_iid = users_repo.member_identifier_to_member_iid(user_id, guild_id)
 
-    return cls(id=str(message.id),
-               author_id=str(user_id),
-               guild_id=str(guild_id) if guild_id is not None else None,
+    return cls(id=message.id,
+               author_id=user_id,
+               guild_id=guild_id,
                member_iid=member_iid,
                created_at=message.created_at,
                edited_at=message.edited_at,
-               channel_id=str(channel_id),
-               thread_id=str(thread_id) if thread_id is not None else None,
+               channel_id=channel_id,
+               thread_id=thread_id,
                content=message.content,
                data=message_to_message_data(message))
 
   async def to_object(self, bot: BaseAutoshardedBot) -> Optional[disnake.Message]:
-    message = await general_util.get_or_fetch_message(bot, None, int(self.id))
+    message = await general_util.get_or_fetch_message(bot, None, self.id)
     if message is None:
-      channel = await self.channel.to_object(bot)
+      channel = await general_util.get_or_fetch_channel(bot, self.thread_id if self.thread_id is not None else self.channel_id)
       if channel is None: return None
 
-      message = await general_util.get_or_fetch_message(bot, channel, int(self.id))
+      message = await general_util.get_or_fetch_message(bot, channel, self.id)
 
     return message
+
+# Full text index of message content
+# Postgres uses expression GIN index over tsvector, SQLite uses FTS5 table with rowid equal to message id kept in sync by triggers
+messages_fts = table("messages_fts", column("rowid"), column("content"), column("rank"))
+# Trigram index used to prefilter candidates for fuzzy search, pg_trgm on Postgres and FTS5 trigram tokenizer on SQLite
+messages_trigram = table("messages_trigram", column("rowid"), column("content"), column("rank"))
+trigram_index_available = False
+
+def content_tsvector():
+  # Have to be same expression as the one in index to be used by planner
+  return func.to_tsvector(literal_column("'simple'::regconfig"), func.coalesce(Message.content, literal_column("''")))
+
+def create_full_text_index(connection):
+  # Replaced by full text index, b-tree over content is useless for searching
+  connection.execute(text("DROP INDEX IF EXISTS ix_messages_content"))
+
+  if connection.dialect.name == "postgresql":
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_content_fts ON messages USING gin (to_tsvector('simple'::regconfig, coalesce(content, '')))"))
+  elif connection.dialect.name == "sqlite":
+    fts_exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='messages_fts'")).first() is not None
+    if not fts_exists:
+      connection.execute(text("CREATE VIRTUAL TABLE messages_fts USING fts5(content)"))
+      connection.execute(text("INSERT INTO messages_fts(rowid, content) SELECT id, content FROM messages WHERE content IS NOT NULL"))
+
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages WHEN new.content IS NOT NULL BEGIN "
+                            "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"))
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+                            "DELETE FROM messages_fts WHERE rowid = old.id; END"))
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+                            "DELETE FROM messages_fts WHERE rowid = old.id; "
+                            "INSERT INTO messages_fts(rowid, content) SELECT new.id, new.content WHERE new.content IS NOT NULL; END"))
+
+  create_trigram_index(connection)
+
+def create_trigram_index(connection):
+  global trigram_index_available
+
+  if connection.dialect.name == "postgresql":
+    if connection.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is None:
+      logger.warning("pg_trgm extension is not available, fuzzy message search will scan all messages")
+      return
+
+    try:
+      with connection.begin_nested():
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception:
+      logger.warning("Failed to create pg_trgm extension, fuzzy message search will scan all messages")
+      return
+
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_content_trgm ON messages USING gin (content gin_trgm_ops)"))
+    trigram_index_available = True
+  elif connection.dialect.name == "sqlite":
+    sqlite_version = tuple(int(part) for part in connection.execute(text("SELECT sqlite_version()")).scalar().split("."))
+    if sqlite_version < (3, 34, 0):
+      logger.warning("SQLite 3.34.0+ is required for trigram tokenizer, fuzzy message search will scan all messages")
+      return
+
+    trigram_exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='messages_trigram'")).first() is not None
+    if not trigram_exists:
+      connection.execute(text("CREATE VIRTUAL TABLE messages_trigram USING fts5(content, tokenize='trigram')"))
+      connection.execute(text("INSERT INTO messages_trigram(rowid, content) SELECT id, content FROM messages WHERE content IS NOT NULL"))
+
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_trigram_insert AFTER INSERT ON messages WHEN new.content IS NOT NULL BEGIN "
+                            "INSERT INTO messages_trigram(rowid, content) VALUES (new.id, new.content); END"))
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_trigram_delete AFTER DELETE ON messages BEGIN "
+                            "DELETE FROM messages_trigram WHERE rowid = old.id; END"))
+    connection.execute(text("CREATE TRIGGER IF NOT EXISTS messages_trigram_update AFTER UPDATE OF content ON messages BEGIN "
+                            "DELETE FROM messages_trigram WHERE rowid = old.id; "
+                            "INSERT INTO messages_trigram(rowid, content) SELECT new.id, new.content WHERE new.content IS NOT NULL; END"))
+    trigram_index_available = True
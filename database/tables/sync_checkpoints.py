@@ -0,0 +1,13 @@
+from sqlalchemy import Column, ForeignKey
+
+from database import database, BigIntegerType, DateTimeType
+
+# Id of newest message of channel or thread that is known to be collected, history sync continues after it
+class SyncCheckpoint(database.base):
+  __tablename__ = "sync_checkpoints"
+
+  id = Column(BigIntegerType, primary_key=True, autoincrement=False, unique=True, index=True)
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), nullable=False, index=True)
+
+  last_message_id = Column(BigIntegerType, nullable=False)
+  updated_at = Column(DateTimeType, nullable=False)
@@ -1,8 +1,8 @@
 import disnake
 import datetime
-from sqlalchemy import Column, DateTime, ForeignKey, String
+from sqlalchemy import Column, ForeignKey, String, Float
 
-from database import database, BigIntegerType
+from database import database, BigIntegerType, DateTimeType
 from util import general_util
 
 class UserMetrics(database.base):
@@ -10,8 +10,8 @@ class UserMetrics(database.base):
 
   id = Column(BigIntegerType, primary_key=True, unique=True, index=True, autoincrement=True)
 
-  guild_id = Column(String, ForeignKey("guilds.id", ondelete="CASCADE"))
-  timestamp = Column(DateTime, index=True)
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"))
+  timestamp = Column(DateTimeType, index=True)
   online = Column(BigIntegerType)
   idle = Column(BigIntegerType)
   offline = Column(BigIntegerType)
@@ -19,4 +19,23 @@ class UserMetrics(database.base):
   @classmethod
   def from_guild(cls, guild: disnake.Guild):
     online, idle, offline = general_util.get_user_stats(guild)
-    return cls(guild_id=str(guild.id), timestamp=datetime.datetime.utcnow(), online=online, idle=idle, offline=offline)
+    return cls(guild_id=guild.id, timestamp=datetime.datetime.utcnow(), online=online, idle=idle, offline=offline)
+
+# Downsampled user metrics, resolution is `hour` or `day`
+class UserMetricsRollup(database.base):
+  __tablename__ = "user_metrics_rollups"
+
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), primary_key=True)
+  resolution = Column(String, primary_key=True)
+  timestamp = Column(DateTimeType, primary_key=True, index=True)
+
+  samples = Column(BigIntegerType, nullable=False)
+  online_min = Column(BigIntegerType)
+  online_avg = Column(Float)
+  online_max = Column(BigIntegerType)
+  idle_min = Column(BigIntegerType)
+  idle_avg = Column(Float)
+  idle_max = Column(BigIntegerType)
+  offline_min = Column(BigIntegerType)
+  offline_avg = Column(Float)
+  offline_max = Column(BigIntegerType)
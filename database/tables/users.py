@@ -1,19 +1,19 @@
 import disnake
 from typing import Union, Optional
-from sqlalchemy import Column, DateTime, String, UniqueConstraint, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, String, UniqueConstraint, ForeignKey, Boolean, Enum
 from sqlalchemy.orm import relationship
 
 from util import general_util
-from database import database, BigIntegerType
+from database import database, BigIntegerType, DateTimeType
 from features.base_bot import BaseAutoshardedBot
 
 class User(database.base):
   __tablename__ = "users"
 
-  id = Column(String, primary_key=True, unique=True, index=True)
+  id = Column(BigIntegerType, primary_key=True, autoincrement=False, unique=True, index=True)
   name = Column(String, index=True, nullable=True)
 
-  created_at = Column(DateTime, nullable=False)
+  created_at = Column(DateTimeType, nullable=False)
 
   is_bot = Column(Boolean, nullable=False)
   is_system = Column(Boolean, nullable=False)
@@ -27,13 +27,13 @@ class User(database.base):
 
   @classmethod
   def from_user(cls, user: Union[disnake.Member, disnake.User]):
-    return cls(id=str(user.id), created_at=user.created_at, is_bot=user.bot, is_system=user.system, name=user.name, status=user.status if isinstance(user.status, disnake.Status) and isinstance(user, disnake.Member) else None)
+    return cls(id=user.id, created_at=user.created_at, is_bot=user.bot, is_system=user.system, name=user.name, status=user.status if isinstance(user.status, disnake.Status) and isinstance(user, disnake.Member) else None)
 
   async def to_object(self, bot: BaseAutoshardedBot) -> Optional[disnake.User]:
-    user = bot.get_user(int(self.id))
+    user = bot.get_user(self.id)
     if user is None:
       try:
-        user = await bot.fetch_user(int(self.id))
+        user = await bot.fetch_user(self.id)
       except disnake.NotFound:
         return None
     return user
@@ -42,8 +42,8 @@ class Member(database.base):
   __tablename__ = "members"
   __table_args__ = (UniqueConstraint("id", "guild_id", name="guild_member_id"),)
 
-  id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
-  guild_id = Column(String, ForeignKey("guilds.id", ondelete="CASCADE"), index=True, nullable=False)
+  id = Column(BigIntegerType, ForeignKey("users.id", ondelete="CASCADE"), index=True, nullable=False)
+  guild_id = Column(BigIntegerType, ForeignKey("guilds.id", ondelete="CASCADE"), index=True, nullable=False)
   member_iid = Column(BigIntegerType, index=True, autoincrement=True, unique=True, primary_key=True)
 
   nick = Column(String, nullable=False)
@@ -53,8 +53,8 @@ class Member(database.base):
   user = relationship("User", back_populates="members", uselist=False)
   guild = relationship("Guild", back_populates="members", uselist=False)
 
-  joined_at = Column(DateTime, nullable=False, index=True)
-  left_at = Column(DateTime, index=True)
+  joined_at = Column(DateTimeType, nullable=False, index=True)
+  left_at = Column(DateTimeType, index=True)
 
   audit_logs = relationship("AuditLog", back_populates="member", uselist=True)
   messages = relationship("Message", back_populates="member", uselist=True)
@@ -63,10 +63,10 @@ class Member(database.base):
 
   @classmethod
   def from_member(cls, member: disnake.Member):
-    return cls(id=str(member.id), guild_id=str(member.guild.id), joined_at=member.joined_at, nick=member.display_name, icon_url=member.display_avatar.url, premium=member.premium_since is not None)
+    return cls(id=member.id, guild_id=member.guild.id, joined_at=member.joined_at, nick=member.display_name, icon_url=member.display_avatar.url, premium=member.premium_since is not None)
 
   async def to_object(self, bot: BaseAutoshardedBot) -> Optional[disnake.Member]:
-    guild = await self.guild.to_object(bot)
+    guild = await general_util.get_or_fetch_guild(bot, self.guild_id)
     if guild is None: return None
-    member = await general_util.get_or_fetch_member(guild, int(self.id))
+    member = await general_util.get_or_fetch_member(guild, self.id)
     return member
\ No newline at end of file
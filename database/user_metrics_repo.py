@@ -1,25 +1,101 @@
 import disnake
 import datetime
-from typing import List, Tuple
+from typing import List, Tuple, Optional
+from sqlalchemy import select, delete, func, or_, literal_column
+from sqlalchemy.orm import aliased
 
-from database import session
-from database.tables.user_metrics import UserMetrics
+from config import config
+from database import database, session_maker, dialect_insert, time_bucket, time_bucket_expression
+from database.tables.user_metrics import UserMetrics, UserMetricsRollup
 from database import guilds_repo
 
-def add_user_metrics(guild: disnake.Guild, commit: bool=True) -> UserMetrics:
-  guilds_repo.get_or_create_guild_if_not_exist(guild)
+async def add_user_metrics(guild: disnake.Guild) -> UserMetrics:
+  await guilds_repo.ensure_guild(guild)
 
-  item = UserMetrics.from_guild(guild)
-  session.add(item)
-  if commit:
-    session.commit()
+  async with session_maker() as session:
+    item = UserMetrics.from_guild(guild)
+    session.add(item)
+    await session.commit()
   return item
 
-def get_user_metrics(guild_id: int, days_back: int) -> List[Tuple[datetime.datetime, int, int, int]]:
+ROLLUP_COLUMNS = [UserMetricsRollup.guild_id, UserMetricsRollup.timestamp, UserMetricsRollup.resolution, UserMetricsRollup.samples,
+                  UserMetricsRollup.online_min, UserMetricsRollup.online_avg, UserMetricsRollup.online_max,
+                  UserMetricsRollup.idle_min, UserMetricsRollup.idle_avg, UserMetricsRollup.idle_max,
+                  UserMetricsRollup.offline_min, UserMetricsRollup.offline_avg, UserMetricsRollup.offline_max]
+
+def raw_to_hourly_query():
+  # Labeled bucket because grouping by name timestamp would group by raw column
+  return select(UserMetrics.guild_id, time_bucket_expression(UserMetrics.timestamp, "hour", database.db.dialect.name).label("bucket"), literal_column("'hour'"), func.count(UserMetrics.id),
+                func.min(UserMetrics.online), func.avg(UserMetrics.online), func.max(UserMetrics.online),
+                func.min(UserMetrics.idle), func.avg(UserMetrics.idle), func.max(UserMetrics.idle),
+                func.min(UserMetrics.offline), func.avg(UserMetrics.offline), func.max(UserMetrics.offline))
+
+def hourly_to_daily_query():
+  def weighted_avg(column):
+    return func.sum(column * UserMetricsRollup.samples) / func.sum(UserMetricsRollup.samples)
+
+  return select(UserMetricsRollup.guild_id, time_bucket_expression(UserMetricsRollup.timestamp, "day", database.db.dialect.name).label("bucket"), literal_column("'day'"), func.sum(UserMetricsRollup.samples),
+                func.min(UserMetricsRollup.online_min), weighted_avg(UserMetricsRollup.online_avg), func.max(UserMetricsRollup.online_max),
+                func.min(UserMetricsRollup.idle_min), weighted_avg(UserMetricsRollup.idle_avg), func.max(UserMetricsRollup.idle_max),
+                func.min(UserMetricsRollup.offline_min), weighted_avg(UserMetricsRollup.offline_avg), func.max(UserMetricsRollup.offline_max)).filter(UserMetricsRollup.resolution == "hour")
+
+# Rolls up complete buckets newer than last rolled up bucket of their guild (guild added later has its own progress)
+# and all buckets before keep_after, whose source rows are deleted after this, so samples stored late into already rolled up bucket aren't lost
+async def roll_up(session, resolution: str, source_query, source_timestamp_column, source_guild_column, keep_after: Optional[datetime.datetime]):
+  end = time_bucket(datetime.datetime.utcnow(), resolution)
+  bucket = time_bucket_expression(source_timestamp_column, resolution, database.db.dialect.name)
+
+  rollup = aliased(UserMetricsRollup)
+  last_bucket = select(func.max(rollup.timestamp)).filter(rollup.resolution == resolution, rollup.guild_id == source_guild_column).scalar_subquery()
+  conditions = [last_bucket == None, bucket > last_bucket]
+  if keep_after is not None:
+    conditions.append(source_timestamp_column < keep_after)
+
+  query = source_query.filter(source_timestamp_column < end, or_(*conditions)).group_by(literal_column("guild_id"), literal_column("bucket"))
+
+  statement = dialect_insert(UserMetricsRollup).from_select(ROLLUP_COLUMNS, query)
+  statement = statement.on_conflict_do_update(index_elements=[UserMetricsRollup.guild_id, UserMetricsRollup.resolution, UserMetricsRollup.timestamp],
+                                              set_={column.name: statement.excluded[column.name] for column in ROLLUP_COLUMNS[3:]})
+  await session.execute(statement)
+
+# Roll raw samples up to hourly and hourly to daily, then delete raw and hourly samples older than their retention
+# Deletion is aligned to whole buckets so bucket is never rolled up again from only part of its samples
+async def downsample_user_metrics(raw_retention_days: int, hourly_retention_days: int):
+  now = datetime.datetime.utcnow()
+  raw_threshold = time_bucket(now - datetime.timedelta(days=raw_retention_days), "hour") if raw_retention_days >= 0 else None
+  hourly_threshold = time_bucket(now - datetime.timedelta(days=hourly_retention_days), "day") if hourly_retention_days >= 0 else None
+
+  async with session_maker() as session:
+    await roll_up(session, "hour", raw_to_hourly_query(), UserMetrics.timestamp, UserMetrics.guild_id, raw_threshold)
+    await roll_up(session, "day", hourly_to_daily_query(), UserMetricsRollup.timestamp, UserMetricsRollup.guild_id, hourly_threshold)
+
+    if raw_threshold is not None:
+      await session.execute(delete(UserMetrics).filter(UserMetrics.timestamp < raw_threshold))
+    if hourly_threshold is not None:
+      await session.execute(delete(UserMetricsRollup).filter(UserMetricsRollup.resolution == "hour", UserMetricsRollup.timestamp < hourly_threshold))
+
+    await session.commit()
+
+def get_tier_for_range(days_back: float) -> str:
+  raw_retention_days = config.essentials.user_metrics_raw_retention_days
+  hourly_retention_days = config.essentials.user_metrics_hourly_retention_days
+
+  if raw_retention_days < 0 or days_back <= raw_retention_days:
+    return "raw"
+  if hourly_retention_days < 0 or days_back <= hourly_retention_days:
+    return "hour"
+  return "day"
+
+# Returns (timestamp, online, idle, offline) from finest tier that still covers whole range, rolled up tiers return averages
+async def get_user_metrics(guild_id: int, days_back: int) -> List[Tuple[datetime.datetime, float, float, float]]:
   threshold_date = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
-  data:List[UserMetrics] = session.query(UserMetrics).filter(UserMetrics.timestamp > threshold_date, UserMetrics.guild_id == str(guild_id)).order_by(UserMetrics.timestamp.desc()).all()
+  tier = get_tier_for_range(days_back)
+
+  if tier == "raw":
+    query = select(UserMetrics.timestamp, UserMetrics.online, UserMetrics.idle, UserMetrics.offline).filter(UserMetrics.timestamp > threshold_date, UserMetrics.guild_id == guild_id).order_by(UserMetrics.timestamp.desc())
+  else:
+    query = select(UserMetricsRollup.timestamp, UserMetricsRollup.online_avg, UserMetricsRollup.idle_avg, UserMetricsRollup.offline_avg).filter(UserMetricsRollup.resolution == tier, UserMetricsRollup.timestamp > threshold_date, UserMetricsRollup.guild_id == guild_id).order_by(UserMetricsRollup.timestamp.desc())
 
-  output = []
-  for d in data:
-    output.append((d.timestamp, d.online, d.idle, d.offline))
-  return output
+  async with session_maker() as session:
+    result = await session.execute(query)
+    return [tuple(row) for row in result.all()]
@@ -1,83 +1,207 @@
 import datetime
 
 import disnake
-from typing import Optional, List, Union, Iterator
+from typing import Optional, List, Union, AsyncIterator, Iterable, Dict, Tuple
+from sqlalchemy import select, update, delete, exists, tuple_
+from sqlalchemy.orm import selectinload
 
-from database import session
+from database import session_maker, to_row, upsert, upsert_returning, identity_cache, delete_in_chunks
+from database.identity_cache import MemberIdentity
 from database.tables.users import User, Member
-from database import guilds_repo
-
-def get_user(user_id: int) -> Optional[User]:
-  return session.query(User).filter(User.id == str(user_id)).one_or_none()
-
-def get_member(member_id: int, guild_id: int) -> Optional[Member]:
-  member = session.query(Member).filter(Member.id == str(member_id), Member.guild_id == str(guild_id)).one_or_none()
-  if member is not None and member.left_at is not None:
-    member.left_at = None
-    session.commit()
-  return member
-
-def get_all_users_iterator() -> Iterator[User]:
-  def get_users(index: int):
-    return session.query(User).offset(2000 * index).limit(2000).all()
-
-  iter_index = 0
-  users = get_users(iter_index)
+from database.tables.messages import Message
+from database import guilds_repo, message_rollups_repo
+
+async def get_user(user_id: int) -> Optional[User]:
+  async with session_maker() as session:
+    result = await session.execute(select(User).filter(User.id == user_id))
+    return result.scalar_one_or_none()
+
+async def get_member(member_id: int, guild_id: int) -> Optional[Member]:
+  async with session_maker() as session:
+    result = await session.execute(select(Member).filter(Member.id == member_id, Member.guild_id == guild_id))
+    member = result.scalar_one_or_none()
+    if member is not None and member.left_at is not None:
+      member.left_at = None
+      await session.commit()
+    return member
+
+# Iterate all users ordered by id, pages are seeked by id of last user so every page costs the same
+async def get_all_users_iterator(batch_size: int=2000) -> AsyncIterator[User]:
+  async def get_users(last_user_id: Optional[int]):
+    query = select(User).options(selectinload(User.members))
+    if last_user_id is not None:
+      query = query.filter(User.id > last_user_id)
+
+    async with session_maker() as session:
+      result = await session.execute(query.order_by(User.id).limit(batch_size))
+      return result.scalars().all()
+
+  users = await get_users(None)
   while users:
     for user in users:
       yield user
 
-    iter_index += 1
-    users = get_users(iter_index)
-
-def get_or_create_user_if_not_exist(user: Union[disnake.Member, disnake.User]) -> User:
-  user_it = get_user(user.id)
-  if user_it is None:
-    user_it = User.from_user(user)
-    session.add(user_it)
-    session.commit()
-  else:
-    if isinstance(user, disnake.Member):
-      if user_it.status != user.status:
-        user_it.status = user.status
-        session.commit()
+    if len(users) < batch_size: break
+    users = await get_users(users[-1].id)
+
+async def get_or_create_user_if_not_exist(user: Union[disnake.Member, disnake.User]) -> User:
+  # Status is known only for members
+  statement = upsert(User, to_row(User.from_user(user)), [User.id], update_columns=["status"] if isinstance(user, disnake.Member) else ())
+  async with session_maker() as session:
+    user_it = await upsert_returning(session, User, statement, [User.id == user.id])
+    await session.commit()
+  identity_cache.users.set(user.id, True)
   return user_it
 
-def get_or_create_member_if_not_exist(member: disnake.Member) -> Member:
-  member_it = get_member(member.id, member.guild.id)
-  user_it = get_or_create_user_if_not_exist(member)
+async def ensure_user(user: Union[disnake.Member, disnake.User]):
+  if identity_cache.users.get(user.id) is None:
+    await get_or_create_user_if_not_exist(user)
 
-  if member_it is None:
-    member_it = Member.from_member(member)
-    session.add(member_it)
-    session.commit()
+async def get_or_create_member_if_not_exist(member: disnake.Member) -> Member:
+  await guilds_repo.ensure_guild(member.guild)
+  await get_or_create_user_if_not_exist(member)
 
-  if user_it.status != member.status:
-    user_it.status = member.status
-    session.commit()
+  # Returning member is not marked as left anymore
+  statement = upsert(Member, to_row(Member.from_member(member)), [Member.id, Member.guild_id], set_={"left_at": None})
+  async with session_maker() as session:
+    member_it = await upsert_returning(session, Member, statement, [Member.id == member.id, Member.guild_id == member.guild.id])
+    await session.commit()
 
+  identity_cache.members.set((member.id, member.guild.id), MemberIdentity(member_it.member_iid, member_it.collect_data))
   return member_it
 
-def set_member_left(member: disnake.Member):
-  session.query(Member).filter(Member.id == str(member.id), Member.guild_id == str(member.guild.id)).update({Member.left_at: datetime.datetime.utcnow()})
-  session.commit()
+# Make sure that member exists in database, answered from identity cache when possible
+async def ensure_member(member: disnake.Member) -> MemberIdentity:
+  identity = identity_cache.members.get((member.id, member.guild.id))
+  if identity is None:
+    member_it = await get_or_create_member_if_not_exist(member)
+    identity = MemberIdentity(member_it.member_iid, member_it.collect_data)
+  return identity
+
+# Bulk version of ensure_member, returns identities keyed by (user_id, guild_id)
+async def get_or_create_members(members: Iterable[disnake.Member]) -> Dict[Tuple[int, int], MemberIdentity]:
+  identities = {}
+  uncached_members = {}
+  for member in members:
+    key = (member.id, member.guild.id)
+    if key in identities.keys() or key in uncached_members.keys(): continue
+
+    identity = identity_cache.members.get(key)
+    if identity is not None:
+      identities[key] = identity
+    else:
+      uncached_members[key] = member
+
+  if uncached_members:
+    for key, member_it in (await _get_or_create_members(uncached_members)).items():
+      identities[key] = MemberIdentity(member_it.member_iid, member_it.collect_data)
+      identity_cache.members.set(key, identities[key])
+      identity_cache.users.set(key[0], True)
+  return identities
+
+async def _get_or_create_members(members: Dict[Tuple[int, int], disnake.Member], chunk_size: int=500) -> Dict[Tuple[int, int], Member]:
+  await guilds_repo.create_missing_guilds(member.guild for member in members.values())
+
+  users = {member.id: to_row(User.from_user(member)) for member in members.values()}
+  member_rows = [to_row(Member.from_member(member)) for member in members.values()]
+
+  async with session_maker() as session:
+    user_rows = list(users.values())
+    for i in range(0, len(user_rows), chunk_size):
+      await session.execute(upsert(User, user_rows[i:i + chunk_size], [User.id]))
+    for i in range(0, len(member_rows), chunk_size):
+      await session.execute(upsert(Member, member_rows[i:i + chunk_size], [Member.id, Member.guild_id], set_={"left_at": None}, where=Member.left_at != None))
+
+    # Selected in chunks too so large guilds don't exceed limit of bound parameters
+    existing_members = {}
+    member_keys = list(members.keys())
+    for i in range(0, len(member_keys), chunk_size):
+      result = await session.execute(select(Member).filter(tuple_(Member.id, Member.guild_id).in_(member_keys[i:i + chunk_size])))
+      existing_members.update({(member.id, member.guild_id): member for member in result.scalars().all()})
+    await session.commit()
+  return existing_members
+
+async def update_member(member: disnake.Member):
+  member_identity = await ensure_member(member)
+
+  async with session_maker() as session:
+    await session.execute(update(Member).filter(Member.member_iid == member_identity.member_iid).values(nick=member.display_name, icon_url=member.display_avatar.url, premium=member.premium_since is not None))
+    await session.commit()
+
+async def update_user(user: Union[disnake.Member, disnake.User]):
+  await ensure_user(user)
+
+  async with session_maker() as session:
+    await session.execute(update(User).filter(User.id == user.id).values(name=user.name))
+    await session.commit()
+
+async def update_users_status(members: Iterable[disnake.Member], chunk_size: int=500):
+  users = list({member.id: to_row(User.from_user(member)) for member in members}.values())
+  async with session_maker() as session:
+    for i in range(0, len(users), chunk_size):
+      await session.execute(upsert(User, users[i:i + chunk_size], [User.id], update_columns=["status"]))
+    await session.commit()
+
+async def set_member_left(member: disnake.Member):
+  async with session_maker() as session:
+    await session.execute(update(Member).filter(Member.id == member.id, Member.guild_id == member.guild.id).values(left_at=datetime.datetime.utcnow()))
+    await session.commit()
+  # Next activity of this member have to go to database to reset left_at
+  identity_cache.members.invalidate((member.id, member.guild.id))
+
+# Messages of deleted members are deleted with them (explicitly, SQLite doesn't enforce cascade) and subtracted from rollups in same transaction
+async def delete_left_members(days_after_left: int, chunk_size: int=5000) -> int:
+  async def delete_messages(session, member_iids: list):
+    message_filter = Message.member_iid.in_(member_iids)
+    await message_rollups_repo.apply_changes(session, await message_rollups_repo.get_deleted_messages_changes(session, message_filter))
+    await session.execute(delete(Message).filter(message_filter).execution_options(synchronize_session=False))
 
-def delete_left_members(days_after_left: int, commit: bool=True):
   threshold = datetime.datetime.utcnow() - datetime.timedelta(days=days_after_left)
-  session.query(Member).filter(Member.left_at != None, Member.left_at <= threshold).delete()
-  if commit:
-    session.commit()
-
-def members_joined_in_timeframe(from_date: datetime.datetime, to_date: datetime.datetime, guild_id: int) -> List[Member]:
-  return session.query(Member).filter(Member.joined_at >= from_date, Member.joined_at <= to_date, Member.guild_id == str(guild_id)).order_by(Member.joined_at.desc()).all()
-
-def member_identifier_to_member_iid(user_id: int, guild_id: int) -> Optional[int]:
-  data = session.query(Member.member_iid).filter(Member.id == str(user_id), Member.guild_id == str(guild_id)).one_or_none()
-  if data is None: return None
-  return data[0]
-
-def can_collect_data(user_id: int, guild_id: int) -> bool:
-  data = session.query(Member.collect_data).filter(Member.id == str(user_id), Member.guild_id == str(guild_id)).one_or_none()
-  if data is None: return True
-  if data[0]: return True
+  deleted = await delete_in_chunks(Member.member_iid, [Member.left_at != None, Member.left_at <= threshold], chunk_size, delete_messages)
+  identity_cache.members.clear()
+  identity_cache.last_metric_messages.clear()
+  return deleted
+
+async def delete_users_without_members() -> int:
+  async with session_maker() as session:
+    result = await session.execute(delete(User).filter(~exists().where(Member.id == User.id)).execution_options(synchronize_session=False))
+    await session.commit()
+  identity_cache.users.clear()
+  return result.rowcount
+
+async def members_joined_in_timeframe(from_date: datetime.datetime, to_date: datetime.datetime, guild_id: int) -> List[Member]:
+  async with session_maker() as session:
+    result = await session.execute(select(Member).filter(Member.joined_at >= from_date, Member.joined_at <= to_date, Member.guild_id == guild_id).order_by(Member.joined_at.desc()))
+    return result.scalars().all()
+
+# Stored display names of members, including members which already left guild
+async def get_member_nicks(guild_id: int, member_ids: Iterable[int]) -> Dict[int, str]:
+  member_ids = list(member_ids)
+  if not member_ids: return {}
+
+  async with session_maker() as session:
+    result = await session.execute(select(Member.id, Member.nick).filter(Member.guild_id == guild_id, Member.id.in_(member_ids)))
+    return {member_id: nick for member_id, nick in result.all()}
+
+async def get_member_identity(user_id: int, guild_id: int) -> Optional[MemberIdentity]:
+  identity = identity_cache.members.get((user_id, guild_id))
+  if identity is None:
+    async with session_maker() as session:
+      result = await session.execute(select(Member.member_iid, Member.collect_data).filter(Member.id == user_id, Member.guild_id == guild_id))
+      data = result.one_or_none()
+    if data is None: return None
+
+    identity = MemberIdentity(data[0], data[1])
+    identity_cache.members.set((user_id, guild_id), identity)
+  return identity
+
+async def member_identifier_to_member_iid(user_id: int, guild_id: int) -> Optional[int]:
+  identity = await get_member_identity(user_id, guild_id)
+  if identity is None: return None
+  return identity.member_iid
+
+async def can_collect_data(user_id: int, guild_id: int) -> bool:
+  identity = await get_member_identity(user_id, guild_id)
+  if identity is None: return True
+  if identity.collect_data: return True
   return False
@@ -1,23 +1,29 @@
 from typing import Optional
+from sqlalchemy import select, delete
 
-from database import session
+from database import session_maker
 from database.tables.weather_settings import WeatherSettings
 
-def get_weather_settings(user_id: int) -> Optional[WeatherSettings]:
-  return session.query(WeatherSettings).filter(WeatherSettings.user_id == str(user_id)).one_or_none()
+async def get_weather_settings(user_id: int) -> Optional[WeatherSettings]:
+  async with session_maker() as session:
+    result = await session.execute(select(WeatherSettings).filter(WeatherSettings.user_id == user_id))
+    return result.scalar_one_or_none()
 
-def set_weather_settings(user_id: int, place: str) -> WeatherSettings:
-  weather_it = get_weather_settings(user_id)
-  if weather_it is None:
-    weather_it = WeatherSettings(user_id=str(user_id), place=place)
-    session.add(weather_it)
-  else:
-    weather_it.place = place
+async def set_weather_settings(user_id: int, place: str) -> WeatherSettings:
+  async with session_maker() as session:
+    result = await session.execute(select(WeatherSettings).filter(WeatherSettings.user_id == user_id))
+    weather_it = result.scalar_one_or_none()
+    if weather_it is None:
+      weather_it = WeatherSettings(user_id=user_id, place=place)
+      session.add(weather_it)
+    else:
+      weather_it.place = place
 
-  session.commit()
+    await session.commit()
   return weather_it
 
-def remove_weather_settings(user_id: int) -> bool:
-  deleted = session.query(WeatherSettings).filter(WeatherSettings.user_id == str(user_id)).delete() == 1
-  session.commit()
-  return deleted
+async def remove_weather_settings(user_id: int) -> bool:
+  async with session_maker() as session:
+    result = await session.execute(delete(WeatherSettings).filter(WeatherSettings.user_id == user_id))
+    await session.commit()
+  return result.rowcount == 1
@@ -0,0 +1,162 @@
+# Backfill of message history from discord to database
+# Histories of several channels are fetched concurrently and written in pages, rate limits per route are handled by disnake
+# Progress of every channel and thread is stored as checkpoint so incremental sync can continue where last run ended
+
+import asyncio
+import datetime
+import time
+import traceback
+import disnake
+from typing import List, Optional, Union, Dict
+
+from database import messages_repo, users_repo, channels_repo, sync_checkpoints_repo
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+HistoryChannel = Union[disnake.TextChannel, disnake.VoiceChannel, disnake.Thread]
+
+class HistoryBackfill:
+  # When after is None only messages after stored checkpoints are fetched (incremental sync)
+  # Without discovery only cached channels and threads are synced and members and archived threads aren't fetched, used after gateway resume
+  def __init__(self, bot: disnake.Client, after: Optional[datetime.datetime], concurrency: int, page_size: int, max_retries: int=10, discover: bool=True):
+    self.bot = bot
+    self.after = after
+    self.discover = discover
+    self.page_size = page_size
+    self.max_retries = max_retries
+    self.semaphore = asyncio.Semaphore(concurrency)
+
+    self.checkpoints: Dict[int, int] = {}
+
+    self.fetched_messages = 0
+    self.inserted_messages = 0
+    self.finished_channels = 0
+    self.skipped_channels = 0
+    self.failed_channels = 0
+
+  @property
+  def incremental(self) -> bool:
+    return self.after is None
+
+  async def get_archived_threads(self, channel: Union[disnake.TextChannel, disnake.ForumChannel]) -> List[disnake.Thread]:
+    threads = []
+    for private in (False, True):
+      try:
+        async for thread in channel.archived_threads(limit=None, private=private):
+          threads.append(thread)
+      except disnake.Forbidden:
+        pass
+      except disnake.HTTPException:
+        logger.warning(f"Failed to fetch archived threads of channel `{channel.id}`")
+    return threads
+
+  async def get_channels(self, guilds: List[disnake.Guild]) -> List[HistoryChannel]:
+    if not self.discover:
+      return [channel for guild in guilds for channel in (*guild.text_channels, *guild.voice_channels, *guild.threads)]
+
+    channels = {}
+    for guild in guilds:
+      for channel in await guild.fetch_channels():
+        if isinstance(channel, (disnake.TextChannel, disnake.VoiceChannel)):
+          channels[channel.id] = channel
+        if isinstance(channel, (disnake.TextChannel, disnake.ForumChannel)):
+          for thread in await self.get_archived_threads(channel):
+            channels[thread.id] = thread
+
+      for thread in await guild.active_threads():
+        channels[thread.id] = thread
+    return list(channels.values())
+
+  # Create all users, members and channels before messages so writing of pages don't have to check them one by one
+  async def prepare(self, guilds: List[disnake.Guild]) -> List[HistoryChannel]:
+    start_time = time.perf_counter()
+    if self.discover:
+      await users_repo.get_or_create_members(member for guild in guilds for member in guild.members if not member.bot and not member.system)
+
+    channels = await self.get_channels(guilds)
+    await channels_repo.create_missing_text_channels(channels)
+
+    if self.incremental:
+      self.checkpoints = await sync_checkpoints_repo.get_checkpoints(channel.id for channel in channels)
+
+      # Channels synced for first time continue from newest stored message, channels without any are only marked from now on
+      unknown_channels = [channel for channel in channels if channel.id not in self.checkpoints.keys()]
+      if unknown_channels:
+        newest_stored = await sync_checkpoints_repo.get_newest_stored_message_ids(guild.id for guild in guilds)
+        new_checkpoints = []
+        for channel in unknown_channels:
+          message_id = newest_stored.get(channel.id, channel.last_message_id)
+          if message_id is None: continue
+          self.checkpoints[channel.id] = message_id
+          new_checkpoints.append((channel.id, channel.guild.id, message_id))
+        await sync_checkpoints_repo.set_checkpoints(new_checkpoints)
+
+    logger.info(f"Backfill prepared {len(channels)} channels in {time.perf_counter() - start_time:.1f}s")
+    return channels
+
+  async def write_page(self, channel: HistoryChannel, page: List[disnake.Message], last_author_id: Optional[int]) -> Optional[int]:
+    inserted, last_author_id = await messages_repo.insert_history_page([message for message in page if not message.author.bot and not message.author.system], last_author_id)
+    await sync_checkpoints_repo.set_checkpoint(channel.id, channel.guild.id, page[-1].id)
+
+    self.fetched_messages += len(page)
+    self.inserted_messages += inserted
+    return last_author_id
+
+  async def backfill_channel(self, channel: HistoryChannel):
+    if self.incremental:
+      if channel.id not in self.checkpoints.keys() or (channel.last_message_id is not None and channel.last_message_id <= self.checkpoints[channel.id]):
+        # Nothing new, don't waste request
+        self.skipped_channels += 1
+        return
+      after = disnake.Object(self.checkpoints[channel.id])
+    else:
+      after = self.after
+
+    async with self.semaphore:
+      last_author_id = None
+      retries = 0
+
+      while True:
+        page = []
+        try:
+          async for message in channel.history(limit=None, oldest_first=True, after=after):
+            page.append(message)
+            if len(page) >= self.page_size:
+              last_author_id = await self.write_page(channel, page, last_author_id)
+              after = page[-1]
+              page = []
+
+          if page:
+            last_author_id = await self.write_page(channel, page, last_author_id)
+          self.finished_channels += 1
+          return
+        except disnake.Forbidden:
+          self.skipped_channels += 1
+          return
+        except disnake.HTTPException:
+          # Continue after last written message
+          if page:
+            last_author_id = await self.write_page(channel, page, last_author_id)
+            after = page[-1]
+
+          retries += 1
+          if retries > self.max_retries:
+            logger.warning(f"Backfill of channel `{channel.id}` failed {self.max_retries}x, skipping")
+            self.failed_channels += 1
+            return
+
+          delay = min(2 ** retries, 60)
+          logger.warning(f"Backfill of channel `{channel.id}` failed, retrying in {delay}s")
+          await asyncio.sleep(delay)
+        except Exception:
+          logger.error(f"Backfill of channel `{channel.id}` failed\n{traceback.format_exc()}")
+          self.failed_channels += 1
+          return
+
+  async def run(self, guilds: List[disnake.Guild]):
+    start_time = time.perf_counter()
+    channels = await self.prepare(guilds)
+
+    await asyncio.gather(*[self.backfill_channel(channel) for channel in channels])
+    logger.info(f"{'Sync' if self.incremental else 'Backfill'} finished in {time.perf_counter() - start_time:.1f}s, {self.finished_channels} channels done, {self.skipped_channels} skipped, {self.failed_channels} failed, {self.fetched_messages} messages fetched, {self.inserted_messages} new")
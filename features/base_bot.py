@@ -1,3 +1,5 @@
+import asyncio
+import collections
 import datetime
 import disnake
 from disnake.ext import commands
@@ -6,6 +8,10 @@ import traceback
 from util import general_util
 from config import config
 from util.logger import setup_custom_logger
+from database.database_manipulation import close_database
+from features.loop_monitor import LoopLagSampler, SlowCallbackDetector
+from features import handler_metrics
+from features.gateway_recorder import GatewayRecorder
 
 logger = setup_custom_logger(__name__)
 
@@ -34,6 +40,20 @@ class BaseAutoshardedBot(commands.AutoShardedBot):
     self.last_error = None
     self.start_time = datetime.datetime.utcnow()
 
+    self.loop_lag_sampler = LoopLagSampler(config.monitoring.loop_lag_sample_interval_ms, config.monitoring.loop_lag_warning_ms, config.monitoring.loop_lag_samples)
+    self.slow_callback_detector = SlowCallbackDetector(config.monitoring.slow_callback_threshold_ms, config.monitoring.slow_callbacks_kept) if config.monitoring.slow_callback_threshold_ms >= 0 else None
+    self.event_counts = collections.Counter()
+    self.metrics_server = None
+    if config.monitoring.metrics_endpoint_port > 0:
+      # Reads statistics of database and extensions which import this module
+      from features.metrics_server import MetricsServer
+      self.metrics_server = MetricsServer(self, config.monitoring.metrics_endpoint_host, config.monitoring.metrics_endpoint_port)
+
+    self.gateway_recorder = None
+    if config.monitoring.record_gateway_events_file:
+      self.gateway_recorder = GatewayRecorder(config.monitoring.record_gateway_events_file)
+      self.gateway_recorder.install(self._connection)
+
     self.event(self.on_ready)
 
     for cog in config.cogs.protected:
@@ -55,6 +75,70 @@ class BaseAutoshardedBot(commands.AutoShardedBot):
         logger.warning(f"Failed to load {cog} module\n{output}")
     logger.info("Defaul modules loaded")
 
+  async def start(self, *args, **kwargs):
+    self.loop_lag_sampler.start()
+    if self.slow_callback_detector is not None:
+      self.slow_callback_detector.install()
+    if self.metrics_server is not None:
+      await self.metrics_server.start()
+
+    await super(BaseAutoshardedBot, self).start(*args, **kwargs)
+
+  def dispatch(self, event_name: str, *args, **kwargs):
+    self.event_counts[event_name] += 1
+    super(BaseAutoshardedBot, self).dispatch(event_name, *args, **kwargs)
+
+  # Every listener of every event is run through this
+  # Errors are caught by disnake and passed to on_error, so listener itself is wrapped to see them
+  async def _run_event(self, coro, event_name: str, *args, **kwargs):
+    name = getattr(coro, "__qualname__", event_name)
+
+    async def measured_listener(*listener_args, **listener_kwargs):
+      with handler_metrics.measure("listener", name):
+        await coro(*listener_args, **listener_kwargs)
+
+    await super(BaseAutoshardedBot, self)._run_event(measured_listener, event_name, *args, **kwargs)
+
+  async def invoke(self, ctx: commands.Context):
+    if ctx.command is None:
+      return await super(BaseAutoshardedBot, self).invoke(ctx)
+
+    with handler_metrics.measure("command", ctx.command.qualified_name) as measurement:
+      await super(BaseAutoshardedBot, self).invoke(ctx)
+      measurement.failed = ctx.command_failed
+
+  async def process_application_commands(self, interaction: disnake.ApplicationCommandInteraction):
+    # Name with subcommands, command objects are resolved only during processing
+    names = [interaction.data.name]
+    options = interaction.data.options
+    while options and options[0].type in (disnake.OptionType.sub_command, disnake.OptionType.sub_command_group):
+      names.append(options[0].name)
+      options = options[0].options
+
+    with handler_metrics.measure("app_command", " ".join(names)) as measurement:
+      await super(BaseAutoshardedBot, self).process_application_commands(interaction)
+      measurement.failed = interaction.command_failed
+
+  async def close(self):
+    # Let cogs flush their pending work while database is still available
+    cogs_shutdown_futures = [cog.handle_shutdown() for cog in self.cogs.values() if hasattr(cog, "handle_shutdown")]
+    results = await asyncio.gather(*cogs_shutdown_futures, return_exceptions=True)
+    for result in results:
+      if isinstance(result, Exception):
+        logger.warning(f"Failed to execute shutdown handler\n{''.join(traceback.format_exception(type(result), result, result.__traceback__))}")
+
+    await super(BaseAutoshardedBot, self).close()
+    await close_database()
+
+    if self.metrics_server is not None:
+      await self.metrics_server.stop()
+    if self.gateway_recorder is not None:
+      await self.gateway_recorder.close()
+
+    self.loop_lag_sampler.stop()
+    if self.slow_callback_detector is not None:
+      self.slow_callback_detector.uninstall()
+
   async def on_ready(self):
     logger.info(f"Logged in as: {self.user} (ID: {self.user.id}) on {self.shard_count} shards")
     await self.change_presence(activity=disnake.Game(name=config.base.status_message, type=0), status=disnake.Status.online)
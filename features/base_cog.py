@@ -1,12 +1,23 @@
 # Precursor for extension
 import disnake
-from disnake.ext import commands
+from disnake.ext import commands, tasks
+import functools
 from pathlib import Path
 from typing import Optional, Union
 
 from features.before_message_context import BeforeMessageContext
 from features.base_bot import BaseAutoshardedBot
 from features.reaction_context import ReactionContext
+from features import handler_metrics
+
+HANDLERS = ("handle_reaction_add", "handle_message_edited", "handle_message_deleted", "handle_shutdown")
+
+def measured(method, kind: str):
+  @functools.wraps(method)
+  async def wrapper(*args, **kwargs):
+    with handler_metrics.measure(kind, method.__qualname__):
+      return await method(*args, **kwargs)
+  return wrapper
 
 class Base_Cog(commands.Cog):
   def __init__(self, bot:BaseAutoshardedBot, file:str, hidden:bool=False):
@@ -14,6 +25,15 @@ class Base_Cog(commands.Cog):
     self.file = str(Path(file).stem) # Stores filename of that extension for later use in extension manipulating extensions and help
     self.hidden = hidden
 
+  # Handlers overridden by extensions and iterations of their task loops are measured, empty default handlers would only add noise
+  def __init_subclass__(cls, **kwargs):
+    super().__init_subclass__(**kwargs)
+    for name, value in list(cls.__dict__.items()):
+      if name in HANDLERS:
+        setattr(cls, name, measured(value, "handler"))
+      elif isinstance(value, tasks.Loop):
+        value.coro = measured(value.coro, "task")
+
   async def handle_reaction_add(self, ctx: ReactionContext):
     pass
 
@@ -22,3 +42,6 @@ class Base_Cog(commands.Cog):
 
   async def handle_message_deleted(self, message: Union[disnake.RawMessageDeleteEvent, BeforeMessageContext]):
     pass
+
+  async def handle_shutdown(self):
+    pass
@@ -4,6 +4,7 @@ from typing import List, Union, Optional
 import dataclasses
 
 from features.base_bot import BaseAutoshardedBot
+from util import general_util
 from database import messages_repo
 
 @dataclasses.dataclass
@@ -35,20 +36,22 @@ class BeforeMessageContext:
 
   @classmethod
   async def from_database(cls, message_item: messages_repo.Message, bot: BaseAutoshardedBot):
-    if message_item.member_iid is not None:
-      author = await message_item.member.to_object(bot)
-    else:
-      author = await message_item.user.to_object(bot)
+    guild = await general_util.get_or_fetch_guild(bot, message_item.guild_id) if message_item.guild_id is not None else None
+
+    author = None
+    if guild is not None:
+      author = await general_util.get_or_fetch_member(guild, message_item.author_id)
+    if author is None:
+      author = bot.get_user(message_item.author_id)
+      if author is None:
+        try:
+          author = await bot.fetch_user(message_item.author_id)
+        except disnake.NotFound:
+          author = None
+
     content = message_item.content
     created_at = message_item.created_at
     edited_at = message_item.edited_at
-    if not message_item.is_DM:
-      if message_item.thread_id is not None:
-        channel = await message_item.thread.to_object(bot)
-      else:
-        channel = await message_item.channel.to_object(bot)
-    else:
-      channel = None
-    guild = await message_item.guild.to_object(bot) if message_item.guild_id is not None else None
-    attachments = [Attachment(att["filename"], att["url"]) for att in message_item.data["attachments"]]
-    return cls(int(message_item.id), author, created_at, edited_at, channel, guild, content, attachments)
+    channel = await general_util.get_or_fetch_channel(bot, message_item.thread_id if message_item.thread_id is not None else message_item.channel_id)
+    attachments = [Attachment(att["filename"], att["url"]) for att in message_item.data["attachments"]] if message_item.data is not None else []
+    return cls(message_item.id, author, created_at, edited_at, channel, guild, content, attachments)
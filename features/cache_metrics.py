@@ -0,0 +1,38 @@
+# Hit/miss counters of in-memory caches used by extensions
+# Caches are registered by name so reloaded extension continues with same counters
+
+from typing import Callable, Dict, Optional
+
+class CacheMetrics:
+  def __init__(self, name: str, size_getter: Callable[[], int], maxsize: Optional[int]):
+    self.name = name
+    self.size_getter = size_getter
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+
+  def hit(self):
+    self.hits += 1
+
+  def miss(self):
+    self.misses += 1
+
+  @property
+  def size(self) -> int:
+    return self.size_getter()
+
+  @property
+  def hit_rate(self) -> float:
+    requests = self.hits + self.misses
+    return self.hits / requests if requests > 0 else 0.0
+
+caches: Dict[str, CacheMetrics] = {}
+
+def register(name: str, size_getter: Callable[[], int], maxsize: Optional[int]=None) -> CacheMetrics:
+  metrics = caches.get(name)
+  if metrics is None:
+    metrics = caches[name] = CacheMetrics(name, size_getter, maxsize)
+  else:
+    metrics.size_getter = size_getter
+    metrics.maxsize = maxsize
+  return metrics
@@ -0,0 +1,126 @@
+# Size bounded on-disk cache of rendered charts
+# Each chart is file `{guild_id}_{chart}_{version}.png`, version identifies data chart was rendered from so unchanged data doesn't have to be rendered again
+# Cache survives reload of extension and restart of bot, least recently used charts are removed when directory grows over limit
+
+import asyncio
+import dataclasses
+import datetime
+import os
+from typing import Dict, Optional, Tuple
+
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+@dataclasses.dataclass
+class CachedChart:
+  guild_id: int
+  chart: str
+  version: str
+  size: int
+  rendered_at: datetime.datetime
+  last_access: datetime.datetime
+
+class ChartCache:
+  def __init__(self, directory: str, max_bytes: int):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.entries: Dict[Tuple[int, str], CachedChart] = {}
+
+    os.makedirs(directory, exist_ok=True)
+    self.load_entries()
+
+  def get_path(self, guild_id: int, chart: str, version: str) -> str:
+    return os.path.join(self.directory, f"{guild_id}_{chart}_{version}.png")
+
+  def load_entries(self):
+    for file_name in os.listdir(self.directory):
+      name, extension = os.path.splitext(file_name)
+      parts = name.split("_")
+      if extension != ".png" or len(parts) != 3 or not parts[0].isdigit():
+        continue
+
+      stat = os.stat(os.path.join(self.directory, file_name))
+      modified_at = datetime.datetime.utcfromtimestamp(stat.st_mtime)
+      entry = CachedChart(int(parts[0]), parts[1], parts[2], stat.st_size, modified_at, modified_at)
+
+      # Leftovers of interrupted replacement, only newest version is kept
+      previous = self.entries.get((entry.guild_id, entry.chart))
+      if previous is not None:
+        older = previous if previous.rendered_at <= entry.rendered_at else entry
+        self.remove_file(older)
+        if older is entry: continue
+      self.entries[(entry.guild_id, entry.chart)] = entry
+
+    logger.info(f"Loaded {len(self.entries)} cached charts")
+
+  @property
+  def size(self) -> int:
+    return sum(entry.size for entry in self.entries.values())
+
+  def get(self, guild_id: int, chart: str) -> Optional[CachedChart]:
+    return self.entries.get((guild_id, chart))
+
+  async def read(self, guild_id: int, chart: str) -> Optional[Tuple[bytes, datetime.datetime]]:
+    entry = self.entries.get((guild_id, chart))
+    if entry is None: return None
+
+    try:
+      data = await asyncio.to_thread(self.read_file, self.get_path(guild_id, chart, entry.version))
+    except OSError as e:
+      logger.warning(f"Failed to read cached chart `{chart}` of guild {guild_id}\n{e}")
+      self.entries.pop((guild_id, chart), None)
+      return None
+
+    entry.last_access = datetime.datetime.utcnow()
+    return data, entry.rendered_at
+
+  async def store(self, guild_id: int, chart: str, version: str, data: bytes):
+    previous = self.entries.get((guild_id, chart))
+    now = datetime.datetime.utcnow()
+    await asyncio.to_thread(self.write_file, self.get_path(guild_id, chart, version), data)
+    self.entries[(guild_id, chart)] = CachedChart(guild_id, chart, version, len(data), now, now)
+
+    if previous is not None and previous.version != version:
+      await asyncio.to_thread(self.remove_file, previous)
+    await self.evict()
+
+  # Data didn't change since chart was rendered so it's as fresh as newly rendered one
+  async def touch(self, guild_id: int, chart: str):
+    entry = self.entries.get((guild_id, chart))
+    if entry is None: return
+
+    entry.rendered_at = datetime.datetime.utcnow()
+    try:
+      await asyncio.to_thread(os.utime, self.get_path(guild_id, chart, entry.version))
+    except OSError:
+      pass
+
+  async def evict(self):
+    total_size = self.size
+    if total_size <= self.max_bytes: return
+
+    for entry in sorted(self.entries.values(), key=lambda item: item.last_access):
+      if total_size <= self.max_bytes: break
+      self.entries.pop((entry.guild_id, entry.chart))
+      await asyncio.to_thread(self.remove_file, entry)
+      total_size -= entry.size
+
+  @staticmethod
+  def read_file(path: str) -> bytes:
+    with open(path, "rb") as fd:
+      return fd.read()
+
+  @staticmethod
+  def write_file(path: str, data: bytes):
+    # Written under temporary name so partially written file is never served
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as fd:
+      fd.write(data)
+    os.replace(temporary_path, path)
+
+  def remove_file(self, entry: CachedChart):
+    try:
+      os.remove(self.get_path(entry.guild_id, entry.chart, entry.version))
+    except FileNotFoundError:
+      pass
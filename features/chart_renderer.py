@@ -0,0 +1,174 @@
+# Rendering of stats charts in worker processes
+# Charts are drawn with object oriented Figure API from plain data (lists of tuples) and returned as PNG bytes, so render never blocks event loop of bot
+# Workers are spawned (not forked) so they don't inherit connections and threads of bot, this module is imported in them and must stay free of bot and database imports
+
+import asyncio
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import pickle
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import matplotlib
+import matplotlib.ticker as mticker
+import matplotlib.dates as mdates
+from matplotlib import style
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+style.use("dark_background")
+font_prop = FontProperties()
+font_prop.set_file("static_data/STIXTwoText-Bold.ttf")
+matplotlib.rcParams["font.family"] = font_prop.get_family()
+
+# (name, message count)
+NamedCounts = List[Tuple[str, int]]
+
+def figure_to_png(fig: Figure) -> bytes:
+  buf = io.BytesIO()
+  fig.savefig(buf, facecolor=fig.get_facecolor(), format="png")
+  return buf.getvalue()
+
+def user_activity_chart(overall: NamedCounts, in_help: NamedCounts, days_back: int, bg_color: str) -> bytes:
+  fig = Figure(facecolor=bg_color, dpi=200)
+
+  for idx, (counts, title, xlabel) in enumerate(((overall, f"General User Activity (past {days_back} days)", "Message Volume"),
+                                                  (in_help, f"Help Channel Activity (past {days_back} days)", "Help Channel\nMsg Volume"))):
+    ax = fig.add_subplot(2, 1, idx + 1)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_facecolor(bg_color)
+
+    # Largest at top
+    users = [name for name, _ in counts[::-1]]
+    msgs = [count for _, count in counts[::-1]]
+    y_pos = np.arange(len(users))
+    ax.barh(y_pos, msgs, align='center', alpha=0.5)
+    ax.set_yticks(y_pos)
+    ax.set_yticklabels(users)
+
+  fig.subplots_adjust(left=0.30, bottom=0.15, right=0.99, top=0.95, wspace=0.2, hspace=0.55)
+  return figure_to_png(fig)
+
+# message_volume are rows of (hour, author_id, channel_id, count), users_metrics rows of (timestamp, online, idle, offline)
+def community_report_chart(message_volume: List[tuple], users_metrics: List[tuple], bg_color: str) -> bytes:
+  message_df = pd.DataFrame.from_records(
+    message_volume,
+    columns=["hour", "author_id", "channel_id", "count"]
+  )
+  volume_df = (
+    message_df
+    .assign(date=lambda df: pd.to_datetime(df.hour))
+    .groupby('date')["count"]
+    .sum()
+  )
+
+  users_metrics_df = pd.DataFrame.from_records(
+    users_metrics,
+    columns=["timestamp", "online", "idle", "offline"]
+  )
+  users_metrics_df = (
+    users_metrics_df
+    .assign(date=lambda df: pd.to_datetime(df.timestamp, unit='s').dt.floor('H'),
+            total=lambda df: df.online + df.offline + df.idle)
+    .drop(columns='timestamp')
+    .groupby('date')
+    .mean()
+  )
+  users_metrics_dataframe = pd.concat(
+    [users_metrics_df, volume_df.rename('count')],
+    axis=1
+  ).fillna(0)
+
+  fig = Figure(facecolor=bg_color, dpi=200)
+
+  ax1 = fig.add_subplot(3, 1, 1)
+  ax1.set_ylabel("Active Users")
+  ax1.set_title("Community Report")
+  ax1.set_facecolor(bg_color)
+  ax1v = ax1.twinx()
+  ax1v.set_ylabel("Message Volume")
+
+  ax2 = fig.add_subplot(3, 1, 2)
+  ax2.set_ylabel("Users")
+  ax2.set_facecolor(bg_color)
+
+  ax3 = fig.add_subplot(3, 1, 3)
+  ax3.set_ylabel("Total Users")
+  ax3.set_facecolor(bg_color)
+
+  ax1.plot(users_metrics_dataframe.index, users_metrics_dataframe.online, label="Active Users\n(Not Idle)")
+  ax1v.fill_between(users_metrics_dataframe.index, 0, users_metrics_dataframe["count"], facecolor="w", alpha=0.2, label="Message Volume")
+  ax1.legend(loc=2)
+  ax1v.legend(loc=9)
+
+  ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.online.rolling(3).mean(), label="Online Users")
+  ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.idle.rolling(3).mean(), label="Idle Users")
+  ax2.plot(users_metrics_dataframe.index, users_metrics_dataframe.offline.rolling(3).mean(), label="Offline Users")
+  ax2.legend(loc=2)
+  ax2.get_xaxis().set_visible(False)
+
+  ax3.plot(users_metrics_dataframe.index, users_metrics_dataframe.total, label="Total Users")
+  ax3.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d\n%H:%M'))
+  ax3.xaxis.set_major_locator(mticker.MaxNLocator(nbins=5, prune='lower'))
+  ax3.legend()
+
+  fig.subplots_adjust(left=0.11, bottom=0.10, right=0.89, top=0.95, wspace=0.2, hspace=0)
+  ax1.get_xaxis().set_visible(False)
+
+  if not users_metrics_dataframe.empty:
+    ax1v.set_ylim(0, 3 * users_metrics_dataframe["count"].values.max())
+
+  return figure_to_png(fig)
+
+# Version of chart is hash of data it's rendered from, chart is rendered only when version differs from known one
+# Returns (version, PNG bytes or None when data didn't change)
+def render_versioned(function: Callable[..., bytes], known_version: Optional[str], *args) -> Tuple[str, Optional[bytes]]:
+  version = hashlib.sha1(pickle.dumps(args)).hexdigest()[:16]
+  if version == known_version:
+    return version, None
+  return version, function(*args)
+
+class ChartRenderer:
+  def __init__(self, workers: int, timeout: float):
+    self.workers = workers
+    self.timeout = timeout
+    self.pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+  def get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+    if self.pool is None:
+      self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+    return self.pool
+
+  # Returns result of function run in worker or None when it failed or timed out
+  async def render(self, function: Callable, *args):
+    loop = asyncio.get_running_loop()
+    name = args[0].__name__ if function is render_versioned else function.__name__
+    try:
+      return await asyncio.wait_for(loop.run_in_executor(self.get_pool(), function, *args), self.timeout)
+    except asyncio.TimeoutError:
+      logger.warning(f"Rendering `{name}` took more than {self.timeout}s, restarting workers")
+      # Running render can't be cancelled, workers are killed so they don't stay occupied by it
+      self.close(terminate=True)
+    except concurrent.futures.process.BrokenProcessPool:
+      logger.warning(f"Workers died while rendering `{name}`, restarting them")
+      self.close(terminate=True)
+    except Exception as e:
+      logger.error(f"Rendering `{name}` failed\n{e}")
+    return None
+
+  def close(self, terminate: bool=False):
+    if self.pool is None: return
+
+    pool, self.pool = self.pool, None
+    if terminate and pool._processes:
+      for process in list(pool._processes.values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
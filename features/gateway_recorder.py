@@ -0,0 +1,64 @@
+# Recording of received gateway events to file for later replay by benchmarks.gateway_replay
+# Raw payloads are captured before disnake parses them, each line of file is JSON object {"time": seconds since start, "t": event name, "d": payload}
+
+import asyncio
+import json
+import time
+from typing import List, Optional
+
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Guilds are recorded too so replay has state (channels, members, roles) to resolve other events against
+RECORDED_EVENTS = (
+  "GUILD_CREATE", "GUILD_MEMBER_ADD", "GUILD_MEMBER_REMOVE", "GUILD_MEMBER_UPDATE",
+  "MESSAGE_CREATE", "MESSAGE_UPDATE", "MESSAGE_DELETE", "MESSAGE_DELETE_BULK",
+  "MESSAGE_REACTION_ADD", "MESSAGE_REACTION_REMOVE",
+  "THREAD_CREATE", "THREAD_UPDATE", "THREAD_DELETE",
+  "VOICE_STATE_UPDATE", "PRESENCE_UPDATE"
+)
+
+class GatewayRecorder:
+  def __init__(self, path: str, flush_every: int=500):
+    self.path = path
+    self.flush_every = flush_every
+    self.start_time = time.perf_counter()
+    self.buffer: List[str] = []
+    self.recorded = 0
+    self.flush_task: Optional[asyncio.Task] = None
+
+  # Wrap parsers of connection state, they are called with decoded payload of every dispatched event
+  def install(self, connection_state):
+    for event in RECORDED_EVENTS:
+      parser = connection_state.parsers.get(event)
+      if parser is not None:
+        connection_state.parsers[event] = self.wrap_parser(event, parser)
+    logger.info(f"Recording gateway events to `{self.path}`")
+
+  def wrap_parser(self, event: str, parser):
+    def recording_parser(data):
+      self.record(event, data)
+      return parser(data)
+    return recording_parser
+
+  def record(self, event: str, data):
+    self.buffer.append(json.dumps({"time": time.perf_counter() - self.start_time, "t": event, "d": data}))
+    self.recorded += 1
+    if len(self.buffer) >= self.flush_every and (self.flush_task is None or self.flush_task.done()):
+      self.flush_task = asyncio.ensure_future(self.flush())
+
+  def write_lines(self, lines: List[str]):
+    with open(self.path, "a", encoding="utf-8") as fd:
+      fd.write("\n".join(lines) + "\n")
+
+  async def flush(self):
+    if not self.buffer: return
+    lines, self.buffer = self.buffer, []
+    await asyncio.to_thread(self.write_lines, lines)
+
+  async def close(self):
+    if self.flush_task is not None:
+      await self.flush_task
+    await self.flush()
+    logger.info(f"Recorded {self.recorded} gateway events to `{self.path}`")
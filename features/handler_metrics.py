@@ -0,0 +1,91 @@
+# Latency of event listeners, cog handle_* hooks and commands
+# Rolling percentiles are computed from last samples of each handler, totals are kept since start
+
+import collections
+import contextlib
+import datetime
+import json
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+from config import config
+
+class HandlerStats:
+  def __init__(self, kind: str, name: str, samples: int):
+    self.kind = kind
+    self.name = name
+    self.samples: Deque[float] = collections.deque(maxlen=samples)
+    self.count = 0
+    self.failures = 0
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+
+  def record(self, duration_ms: float, failed: bool):
+    self.samples.append(duration_ms)
+    self.count += 1
+    self.total_ms += duration_ms
+    self.max_ms = max(self.max_ms, duration_ms)
+    if failed:
+      self.failures += 1
+
+  @property
+  def average_ms(self) -> float:
+    return self.total_ms / self.count if self.count > 0 else 0.0
+
+  # Percentiles of last samples
+  def percentiles_ms(self, *percentiles: float) -> List[float]:
+    if not self.samples: return [0.0 for _ in percentiles]
+    ordered = sorted(self.samples)
+    return [ordered[min(int(len(ordered) * percentile), len(ordered) - 1)] for percentile in percentiles]
+
+  def to_dict(self) -> Dict[str, Any]:
+    p50, p95, p99 = self.percentiles_ms(0.5, 0.95, 0.99)
+    return {"kind": self.kind, "name": self.name, "count": self.count, "failures": self.failures, "total_ms": self.total_ms, "average_ms": self.average_ms,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": self.max_ms}
+
+# Key: (kind, name)
+handlers: Dict[tuple, HandlerStats] = {}
+
+def record(kind: str, name: str, duration_ms: float, failed: bool=False):
+  stats = handlers.get((kind, name))
+  if stats is None:
+    stats = handlers[(kind, name)] = HandlerStats(kind, name, config.monitoring.handler_latency_samples)
+  stats.record(duration_ms, failed)
+
+# Callers which see failure only as result (commands catch their errors) set failed on yielded measurement
+class Measurement:
+  def __init__(self):
+    self.failed = False
+
+@contextlib.contextmanager
+def measure(kind: str, name: str):
+  measurement = Measurement()
+  start_time = time.perf_counter()
+  try:
+    yield measurement
+  except BaseException:
+    measurement.failed = True
+    raise
+  finally:
+    record(kind, name, (time.perf_counter() - start_time) * 1000, measurement.failed)
+
+def get_top_handlers(order_by: str="total", limit: Optional[int]=None) -> List[HandlerStats]:
+  if order_by == "count":
+    key = lambda stats: stats.count
+  elif order_by == "p95":
+    key = lambda stats: stats.percentiles_ms(0.95)[0]
+  else:
+    key = lambda stats: stats.total_ms
+  result = sorted(handlers.values(), key=key, reverse=True)
+  return result[:limit] if limit is not None else result
+
+def snapshot() -> Dict[str, Any]:
+  return {"generated_at": datetime.datetime.utcnow().isoformat(), "handlers": [stats.to_dict() for stats in get_top_handlers()]}
+
+# Snapshot has to be made on event loop, writing it can be done in other thread
+def write_snapshot(data: Dict[str, Any], path: str):
+  with open(path, "w", encoding="utf-8") as fd:
+    json.dump(data, fd, indent=2)
+
+def reset():
+  handlers.clear()
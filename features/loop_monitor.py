@@ -0,0 +1,152 @@
+# Monitoring of event loop responsiveness
+# Lag sampler measures how late periodic wake up happens, every blocking step delays it (and gateway heartbeats with it)
+# Slow callback detector times every step run by loop, watchdog thread captures stack of loop thread while step is still blocking it
+
+import asyncio
+import collections
+import dataclasses
+import datetime
+import statistics
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, List, Optional
+
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Innermost frames of captured stacks
+STACK_LIMIT = 20
+
+@dataclasses.dataclass
+class SlowCallback:
+  timestamp: datetime.datetime
+  callback: str
+  duration_ms: float
+  # Stack of loop thread captured while callback was blocking, None when it finished before watchdog noticed it
+  stack: Optional[str]
+
+def describe_callback(handle: asyncio.Handle) -> str:
+  callback = handle._callback
+  owner = getattr(callback, "__self__", None)
+  if isinstance(owner, asyncio.Task):
+    coro = owner.get_coro()
+    return f"task `{owner.get_name()}` coroutine `{getattr(coro, '__qualname__', repr(coro))}`"
+  return f"callback `{getattr(callback, '__qualname__', repr(callback))}`"
+
+class LoopLagSampler:
+  def __init__(self, interval_ms: float, warning_ms: float, samples: int):
+    self.interval = interval_ms / 1000
+    self.warning_ms = warning_ms
+    self.samples: Deque[float] = collections.deque(maxlen=samples)
+    self.max_lag_ms = 0.0
+    self.task: Optional[asyncio.Task] = None
+
+  async def run(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      start_time = loop.time()
+      await asyncio.sleep(self.interval)
+      lag_ms = max(loop.time() - start_time - self.interval, 0) * 1000
+
+      self.samples.append(lag_ms)
+      self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+      if 0 <= self.warning_ms <= lag_ms:
+        logger.warning(f"Event loop lag {lag_ms:.0f}ms")
+
+  def start(self):
+    if self.task is None:
+      self.task = asyncio.create_task(self.run(), name="loop_lag_sampler")
+
+  def stop(self):
+    if self.task is not None:
+      self.task.cancel()
+      self.task = None
+
+  @property
+  def current_ms(self) -> float:
+    return self.samples[-1] if self.samples else 0.0
+
+  @property
+  def average_ms(self) -> float:
+    return statistics.fmean(self.samples) if self.samples else 0.0
+
+  def percentile_ms(self, percentile: float) -> float:
+    if not self.samples: return 0.0
+    ordered = sorted(self.samples)
+    return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+class SlowCallbackDetector:
+  def __init__(self, threshold_ms: float, kept: int):
+    self.threshold = threshold_ms / 1000
+    self.slow_callbacks: Deque[SlowCallback] = collections.deque(maxlen=kept)
+
+    self.loop_thread_id: Optional[int] = None
+    # Step currently run by loop, read by watchdog thread
+    self.run_id = 0
+    self.run_start: Optional[float] = None
+    self.captured_run_id = -1
+    self.captured_stack: Optional[str] = None
+
+    self.original_run = None
+    self.stop_event = threading.Event()
+    self.watchdog: Optional[threading.Thread] = None
+
+  def install(self):
+    if self.original_run is not None: return
+
+    self.loop_thread_id = threading.get_ident()
+    self.original_run = original_run = asyncio.Handle._run
+    detector = self
+
+    def timed_run(handle: asyncio.Handle):
+      detector.run_id += 1
+      run_id = detector.run_id
+      start_time = detector.run_start = time.perf_counter()
+      try:
+        original_run(handle)
+      finally:
+        detector.run_start = None
+        duration = time.perf_counter() - start_time
+        if duration >= detector.threshold:
+          detector.report(handle, run_id, duration)
+
+    # Every callback and task step scheduled on loop goes through this method
+    asyncio.Handle._run = timed_run
+
+    self.stop_event.clear()
+    self.watchdog = threading.Thread(target=self.watch, name="slow_callback_watchdog", daemon=True)
+    self.watchdog.start()
+
+  def uninstall(self):
+    if self.original_run is None: return
+
+    asyncio.Handle._run = self.original_run
+    self.original_run = None
+    self.stop_event.set()
+    self.watchdog = None
+
+  def watch(self):
+    while not self.stop_event.wait(self.threshold / 2):
+      run_id, run_start = self.run_id, self.run_start
+      if run_start is None or run_id == self.captured_run_id or time.perf_counter() - run_start < self.threshold: continue
+
+      frame = sys._current_frames().get(self.loop_thread_id)
+      if frame is not None:
+        self.captured_stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+        self.captured_run_id = run_id
+
+  def report(self, handle: asyncio.Handle, run_id: int, duration: float):
+    stack = self.captured_stack if self.captured_run_id == run_id else None
+    slow_callback = SlowCallback(datetime.datetime.utcnow(), describe_callback(handle), duration * 1000, stack)
+    self.slow_callbacks.append(slow_callback)
+
+    if stack is not None:
+      logger.warning(f"Event loop blocked for {slow_callback.duration_ms:.0f}ms by {slow_callback.callback}\n{stack}")
+    else:
+      logger.warning(f"Event loop blocked for {slow_callback.duration_ms:.0f}ms by {slow_callback.callback}")
+
+  def get_slow_callbacks(self) -> List[SlowCallback]:
+    return list(reversed(self.slow_callbacks))
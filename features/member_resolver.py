@@ -0,0 +1,98 @@
+# Resolution of batches of member ids to members and display names
+# Guild cache is used first, names of members which aren't cached are taken from database and the rest is requested by gateway member chunk queries (up to 100 ids each) instead of REST call for each member
+# Results, including members which weren't found, are remembered for short time so repeated reports don't query gateway again
+
+import asyncio
+import cachetools
+from typing import Dict, Iterable, List
+
+import disnake
+
+from config import config
+from database import users_repo
+from features import cache_metrics
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Maximum number of user ids in one request of guild members
+QUERY_LIMIT = 100
+
+# Key: (guild_id, member_id), Values: disnake.Member or None when member isn't in guild
+members = cachetools.TTLCache(maxsize=config.essentials.identity_cache_size, ttl=config.essentials.member_resolver_cache_seconds)
+# Key: (guild_id, member_id), Values: display name
+names = cachetools.TTLCache(maxsize=config.essentials.identity_cache_size, ttl=config.essentials.member_resolver_cache_seconds)
+
+members_metrics = cache_metrics.register("resolved_members", lambda: len(members), members.maxsize)
+names_metrics = cache_metrics.register("resolved_member_names", lambda: len(names), names.maxsize)
+
+async def query_members(guild: disnake.Guild, member_ids: List[int]) -> Dict[int, disnake.Member]:
+  found = {}
+  for idx in range(0, len(member_ids), QUERY_LIMIT):
+    chunk = member_ids[idx:idx + QUERY_LIMIT]
+    try:
+      result = await guild.query_members(user_ids=chunk, limit=len(chunk))
+    except (asyncio.TimeoutError, RuntimeError, disnake.ClientException) as e:
+      # Members of failed query are not remembered as missing so next call tries them again
+      logger.warning(f"Failed to query {len(chunk)} members of guild {guild.id}\n{e}")
+      continue
+
+    for member in result:
+      found[member.id] = member
+    for member_id in chunk:
+      members[(guild.id, member_id)] = found.get(member_id)
+  return found
+
+# Returns member id -> member for members which are in guild
+async def get_members(guild: disnake.Guild, member_ids: Iterable[int]) -> Dict[int, disnake.Member]:
+  result = {}
+  missing = []
+  for member_id in dict.fromkeys(member_ids):
+    member = guild.get_member(member_id)
+    if member is not None:
+      result[member_id] = member
+      continue
+
+    key = (guild.id, member_id)
+    if key in members:
+      members_metrics.hit()
+      if members[key] is not None:
+        result[member_id] = members[key]
+      continue
+
+    members_metrics.miss()
+    missing.append(member_id)
+
+  if missing:
+    result.update(await query_members(guild, missing))
+  return result
+
+# Returns member id -> display name, members which left guild have name they had when they were last seen
+async def get_names(guild: disnake.Guild, member_ids: Iterable[int]) -> Dict[int, str]:
+  result = {}
+  missing = []
+  for member_id in dict.fromkeys(member_ids):
+    member = guild.get_member(member_id)
+    if member is not None:
+      result[member_id] = member.display_name
+      continue
+
+    name = names.get((guild.id, member_id))
+    if name is not None:
+      names_metrics.hit()
+      result[member_id] = name
+      continue
+
+    names_metrics.miss()
+    missing.append(member_id)
+
+  if not missing: return result
+
+  stored_names = await users_repo.get_member_nicks(guild.id, missing)
+  for member_id, name in stored_names.items():
+    names[(guild.id, member_id)] = result[member_id] = name
+
+  queried_members = await get_members(guild, [member_id for member_id in missing if member_id not in stored_names.keys()])
+  for member_id, member in queried_members.items():
+    names[(guild.id, member_id)] = result[member_id] = member.display_name
+  return result
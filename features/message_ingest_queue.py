@@ -0,0 +1,145 @@
+# Write-behind queue for collected messages
+# Events are coalesced per message id and written to database in batches
+# Events of failed batch are returned to queue and retried with growing delay, they are dropped only after too many failed attempts
+
+import asyncio
+import dataclasses
+import time
+import traceback
+import disnake
+from typing import Dict, List, Optional, Set
+
+from database import messages_repo, sync_checkpoints_repo
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+# Totals since start over all queues
+@dataclasses.dataclass
+class IngestStats:
+  received_events: int = 0
+  written_messages: int = 0
+  written_deletions: int = 0
+  failed_batches: int = 0
+  dropped_events: int = 0
+  pending: int = 0
+
+ingest_stats = IngestStats()
+
+# Final flushes of queues of unloaded cogs, referenced until they finish so they are not garbage collected
+closing_tasks: Set[asyncio.Future] = set()
+
+class MessageIngestQueue:
+  def __init__(self, max_batch_size: int, max_attempts: int, max_retry_delay: float):
+    self.max_batch_size = max_batch_size
+    self.max_attempts = max_attempts
+    self.max_retry_delay = max_retry_delay
+
+    # Latest state of each message, None marks deleted message
+    self.pending: Dict[int, Optional[disnake.Message]] = {}
+    self.flush_lock = asyncio.Lock()
+    self.flush_task: Optional[asyncio.Future] = None
+
+    # Checkpoints of history sync are moved by written messages only after sync in current gateway session finished, until then there can be gap before them
+    self.advance_checkpoints = False
+
+    # Number of failed writes of events waiting for retry
+    self.attempts: Dict[int, int] = {}
+    self.retry_delay = 0.0
+    self.retry_at = 0.0
+
+  def __len__(self):
+    return len(self.pending)
+
+  def push_message(self, message: disnake.Message):
+    if message.id in self.pending.keys() and self.pending[message.id] is None:
+      # Message was already deleted
+      return
+
+    self.pending[message.id] = message
+    ingest_stats.received_events += 1
+    self._schedule_flush_if_full()
+
+  def push_delete(self, message_id: int):
+    self.pending[message_id] = None
+    ingest_stats.received_events += 1
+    self._schedule_flush_if_full()
+
+  def _schedule_flush_if_full(self):
+    ingest_stats.pending = len(self.pending)
+    if len(self.pending) >= self.max_batch_size and (self.flush_task is None or self.flush_task.done()) and time.monotonic() >= self.retry_at:
+      self.flush_task = asyncio.ensure_future(self.flush())
+
+  # Failed events are returned under newer events of same messages, deletion always wins over older or newer message state
+  def requeue(self, failed: Dict[int, Optional[disnake.Message]]):
+    dropped = 0
+    for message_id, message in failed.items():
+      attempts = self.attempts.get(message_id, 0) + 1
+      if attempts >= self.max_attempts:
+        self.attempts.pop(message_id, None)
+        dropped += 1
+        continue
+
+      self.attempts[message_id] = attempts
+      if message is None or message_id not in self.pending.keys():
+        self.pending[message_id] = message
+
+    ingest_stats.pending = len(self.pending)
+    if dropped:
+      ingest_stats.dropped_events += dropped
+      logger.error(f"Dropped {dropped} message events after {self.max_attempts} failed attempts to write them")
+
+  # Flush is postponed after failed write, force is used on shutdown to make last attempt anyway
+  async def flush(self, force: bool=False):
+    async with self.flush_lock:
+      if not self.pending: return
+      if not force and time.monotonic() < self.retry_at: return
+
+      pending, self.pending = self.pending, {}
+      ingest_stats.pending = 0
+      messages = [message for message in pending.values() if message is not None]
+      deleted_message_ids = [message_id for message_id, message in pending.items() if message is None]
+
+      start_time = time.perf_counter()
+      try:
+        await messages_repo.write_messages_batch(messages, deleted_message_ids)
+      except Exception:
+        self.retry_delay = min(max(self.retry_delay * 2, 1.0), self.max_retry_delay)
+        self.retry_at = time.monotonic() + self.retry_delay
+        logger.error(f"Failed to write batch of {len(pending)} message events, retrying in {self.retry_delay:.0f}s\n{traceback.format_exc()}")
+        ingest_stats.failed_batches += 1
+        self.requeue(pending)
+        return
+
+      self.retry_delay = self.retry_at = 0.0
+      for message_id in pending.keys():
+        self.attempts.pop(message_id, None)
+
+      ingest_stats.written_messages += len(messages)
+      ingest_stats.written_deletions += len(deleted_message_ids)
+
+      if self.advance_checkpoints:
+        await self.write_checkpoints(messages)
+
+      logger.debug(f"Written {len(messages)} messages and {len(deleted_message_ids)} deletions in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+  # Newest written message of each channel and thread, next sync doesn't have to fetch them again
+  @staticmethod
+  async def write_checkpoints(messages: List[disnake.Message]):
+    checkpoints = [(message.channel.id, message.guild.id, message.id) for message in messages if message.guild is not None]
+    try:
+      await sync_checkpoints_repo.set_checkpoints(checkpoints)
+    except Exception:
+      logger.warning(f"Failed to update sync checkpoints\n{traceback.format_exc()}")
+
+  # Wait for scheduled flush and write the rest
+  async def close(self):
+    if self.flush_task is not None:
+      await self.flush_task
+    await self.flush(force=True)
+
+  # Close from synchronous code (cog unload) without losing the task
+  def close_in_background(self):
+    task = asyncio.ensure_future(self.close())
+    closing_tasks.add(task)
+    task.add_done_callback(closing_tasks.discard)
@@ -0,0 +1,144 @@
+# HTTP endpoint exposing metrics of bot in Prometheus text format
+# Runs on event loop of bot, values are only read from in-memory statistics so scrape never waits for database or discord
+
+import aiohttp.web
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import database, identity_cache, query_stats
+from features import handler_metrics, cache_metrics
+from features.message_ingest_queue import ingest_stats
+from util.logger import setup_custom_logger
+
+logger = setup_custom_logger(__name__)
+
+PREFIX = "sentdebot"
+QUANTILES = (0.5, 0.95, 0.99)
+
+def escape_label_value(value) -> str:
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_sample(name: str, labels: Optional[Dict[str, object]], value: float) -> str:
+  if labels:
+    formatted_labels = ",".join(f'{key}="{escape_label_value(label)}"' for key, label in labels.items())
+    return f"{name}{{{formatted_labels}}} {value}"
+  return f"{name} {value}"
+
+class MetricsWriter:
+  def __init__(self):
+    self.lines: List[str] = []
+
+  def metric(self, name: str, metric_type: str, help_text: str, samples: Iterable[Tuple[Optional[Dict[str, object]], float]]):
+    name = f"{PREFIX}_{name}"
+    self.lines.append(f"# HELP {name} {help_text}")
+    self.lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+      self.lines.append(format_sample(name, labels, value))
+
+  # Samples of histograms and summaries have suffixed names
+  def raw(self, name: str, metric_type: str, help_text: str, samples: Iterable[Tuple[str, Optional[Dict[str, object]], float]]):
+    name = f"{PREFIX}_{name}"
+    self.lines.append(f"# HELP {name} {help_text}")
+    self.lines.append(f"# TYPE {name} {metric_type}")
+    for suffix, labels, value in samples:
+      self.lines.append(format_sample(name + suffix, labels, value))
+
+  def render(self) -> str:
+    return "\n".join(self.lines) + "\n"
+
+def write_gateway_metrics(writer: MetricsWriter, bot):
+  # Latency is NaN until first heartbeat of shard
+  writer.metric("gateway_latency_seconds", "gauge", "Heartbeat latency of shard", (({"shard": shard_id}, latency) for shard_id, latency in bot.latencies if not math.isnan(latency)))
+  writer.metric("gateway_events_total", "counter", "Dispatched gateway events by type", (({"event": event}, count) for event, count in sorted(bot.event_counts.items())))
+  writer.metric("loop_lag_seconds", "gauge", "Last measured event loop lag", [(None, bot.loop_lag_sampler.current_ms / 1000)])
+
+def write_ingest_metrics(writer: MetricsWriter):
+  writer.metric("ingest_received_events_total", "counter", "Message events received by ingest queue", [(None, ingest_stats.received_events)])
+  writer.metric("ingest_written_messages_total", "counter", "Messages written to database by ingest queue", [(None, ingest_stats.written_messages)])
+  writer.metric("ingest_written_deletions_total", "counter", "Message deletions written to database by ingest queue", [(None, ingest_stats.written_deletions)])
+  writer.metric("ingest_failed_batches_total", "counter", "Batches of ingest queue which failed to be written", [(None, ingest_stats.failed_batches)])
+  writer.metric("ingest_dropped_events_total", "counter", "Message events dropped after too many failed writes", [(None, ingest_stats.dropped_events)])
+  writer.metric("ingest_pending_events", "gauge", "Message events waiting in ingest queue", [(None, ingest_stats.pending)])
+
+def write_database_metrics(writer: MetricsWriter):
+  pool = database.db.sync_engine.pool
+  # Not every pool class (SQLite uses NullPool or StaticPool) keeps these numbers
+  if hasattr(pool, "checkedout"):
+    writer.metric("db_pool_size", "gauge", "Configured size of connection pool", [(None, pool.size())])
+    writer.metric("db_pool_checked_out", "gauge", "Connections currently used", [(None, pool.checkedout())])
+    writer.metric("db_pool_overflow", "gauge", "Connections over pool size", [(None, pool.overflow())])
+
+  # Statements of each caller are merged to keep number of series low
+  callers: Dict[str, Tuple[List[int], float, int]] = {}
+  for stats in query_stats.statements.values():
+    buckets, total_ms, count = callers.get(stats.caller, ([0] * len(query_stats.BUCKETS), 0.0, 0))
+    callers[stats.caller] = ([bucket + added for bucket, added in zip(buckets, stats.buckets)], total_ms + stats.total_ms, count + stats.count)
+
+  samples = []
+  for caller, (buckets, total_ms, count) in sorted(callers.items()):
+    cumulative = 0
+    for bound, bucket in zip(query_stats.BUCKETS, buckets):
+      cumulative += bucket
+      samples.append(("_bucket", {"caller": caller, "le": "+Inf" if bound == float("inf") else bound / 1000}, cumulative))
+    samples.append(("_sum", {"caller": caller}, total_ms / 1000))
+    samples.append(("_count", {"caller": caller}, count))
+  writer.raw("db_query_duration_seconds", "histogram", "Duration of database queries by repo function", samples)
+
+def write_cache_metrics(writer: MetricsWriter):
+  caches = [(name, stats["hits"], stats["misses"], stats["size"]) for name, stats in identity_cache.get_stats().items()]
+  caches.extend((name, metrics.hits, metrics.misses, metrics.size) for name, metrics in cache_metrics.caches.items())
+
+  writer.metric("cache_hits_total", "counter", "Cache lookups which found value", (({"cache": name}, hits) for name, hits, _, _ in caches))
+  writer.metric("cache_misses_total", "counter", "Cache lookups which didn't find value", (({"cache": name}, misses) for name, _, misses, _ in caches))
+  writer.metric("cache_size", "gauge", "Number of items in cache", (({"cache": name}, size) for name, _, _, size in caches))
+
+# Listeners, handle_* hooks, commands and task loop iterations
+def write_handler_metrics(writer: MetricsWriter):
+  samples = []
+  for stats in handler_metrics.get_top_handlers():
+    labels = {"kind": stats.kind, "name": stats.name}
+    for quantile, value in zip(QUANTILES, stats.percentiles_ms(*QUANTILES)):
+      samples.append(("", {**labels, "quantile": quantile}, value / 1000))
+    samples.append(("_sum", labels, stats.total_ms / 1000))
+    samples.append(("_count", labels, stats.count))
+  writer.raw("handler_duration_seconds", "summary", "Duration of event listeners, handlers, commands and task loop iterations", samples)
+
+def render_metrics(bot) -> str:
+  writer = MetricsWriter()
+  write_gateway_metrics(writer, bot)
+  write_ingest_metrics(writer)
+  write_database_metrics(writer)
+  write_cache_metrics(writer)
+  write_handler_metrics(writer)
+  return writer.render()
+
+class MetricsServer:
+  def __init__(self, bot, host: str, port: int):
+    self.bot = bot
+    self.host = host
+    self.port = port
+    self.runner: Optional[aiohttp.web.AppRunner] = None
+
+  async def handle_metrics(self, _: aiohttp.web.Request) -> aiohttp.web.Response:
+    return aiohttp.web.Response(body=render_metrics(self.bot).encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+  async def start(self):
+    if self.runner is not None: return
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/metrics", self.handle_metrics)
+
+    self.runner = aiohttp.web.AppRunner(app, access_log=None)
+    await self.runner.setup()
+    try:
+      await aiohttp.web.TCPSite(self.runner, self.host, self.port).start()
+    except OSError as e:
+      logger.error(f"Failed to start metrics endpoint on {self.host}:{self.port}\n{e}")
+      await self.stop()
+      return
+    logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+  async def stop(self):
+    if self.runner is not None:
+      await self.runner.cleanup()
+      self.runner = None
@@ -1,17 +1,23 @@
+import asyncio
+
 from config import config
 from util.logger import setup_custom_logger
-from features.base_bot import BaseAutoshardedBot
-from database.database_manipulation import init_tables
 
 logger = setup_custom_logger(__name__)
 
-if config.base.discord_api_key is None:
-  logger.error("Discord API key is missing!")
-  exit(-1)
+# Worker processes (features.chart_renderer) are spawned and import this module again, bot is started only in main process
+if __name__ == "__main__":
+  from features.base_bot import BaseAutoshardedBot
+  from database.database_manipulation import init_tables
+
+  if config.base.discord_api_key is None:
+    logger.error("Discord API key is missing!")
+    exit(-1)
 
-# Init database tables
-init_tables()
+  # Init database tables on the same loop that bot will use for the rest of its life
+  loop = asyncio.get_event_loop()
+  loop.run_until_complete(init_tables())
 
-bot = BaseAutoshardedBot()
+  bot = BaseAutoshardedBot()
 
-bot.run(config.base.discord_api_key)
+  bot.run(config.base.discord_api_key)
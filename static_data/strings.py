@@ -35,6 +35,18 @@ class Strings(metaclass=formattable):
 
   system_logout_brief = "Turn off bot"
 
+  system_db_stats_brief = "Show database queries with highest total time and count"
+  system_db_stats_disabled = "Query statistics are disabled in config"
+  system_db_stats_empty = "No queries recorded yet"
+
+  system_loop_stats_brief = "Show event loop lag and steps which blocked it"
+  system_loop_stats_detector_disabled = "Detection is disabled, set `slow_callback_threshold_ms` in config to enable it"
+
+  system_handler_stats_brief = "Show latency of event listeners, handlers and commands"
+  system_handler_stats_empty = "No handlers measured yet"
+  system_handler_stats_exported = "Handler latency statistics written to `{path}`"
+  system_handler_stats_export_disabled = "Export file is not set in config"
+
   # Help
   help_brief = "Show all message commands and help for them"
   help_name_param_description = "Specify name of command or name of extension as parameter to search help only for thing you want"
@@ -88,6 +100,7 @@ class Strings(metaclass=formattable):
   stats_community_report_brief = "Show recent numbers of users on server"
 
   stats_main_guild_not_set = "Main guild is not loaded"
+  stats_render_failed = "Failed to render chart, try it later"
 
   # Help Threader
   help_threader_announcement = "```Help channel now using threads for solving problems so use them and post new message outside of this thread only if thread gets locked (after 3 days) or with different problem. Thank you```"
@@ -172,12 +185,18 @@ class Strings(metaclass=formattable):
   admin_tools_pull_data_description = "Pull guild data and save to database"
   admin_tools_pull_data_pulling_complete = "**Data pulling completed**"
 
+  admin_tools_sync_history_description = "Collect messages sent after last synced message of each channel"
+  admin_tools_sync_history_complete = "**History synced**, `{messages}` new messages"
+
   admin_tools_purge_bot_messages_description = "Clear old bots messages"
   admin_tools_purge_bot_messages_invalid_channel = "Invalid channel"
 
   admin_tools_remove_message_data_description = "Remove collected message data from database"
   admin_tools_remove_message_data_deleted = "Your data were removed"
 
+  admin_tools_rebuild_rollups_description = "Recompute message statistics of this guild from stored messages"
+  admin_tools_rebuild_rollups_rebuilt = "Message statistics rebuilt in `{time:.1f}s`"
+
   # Weather
   weather_set_place_brief = "Set default weather place"
   weather_set_place_invalid_place = "Place is not valid"
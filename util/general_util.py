@@ -148,6 +148,15 @@ async def get_or_fetch_channel(source: Union[disnake.Guild, commands.BotBase], c
 
   return channel
 
+async def get_or_fetch_guild(bot: commands.BotBase, guild_id: int):
+  guild = bot.get_guild(guild_id)
+  if guild is None:
+    try:
+      guild = await bot.fetch_guild(guild_id)
+    except:
+      return None
+  return guild
+
 async def get_or_fetch_message(bot: commands.BotBase, source: Optional[Union[disnake.TextChannel, disnake.Thread]], message_id: int):
   message = bot.get_message(message_id)
   if message is None and source is not None:
@@ -166,8 +175,11 @@ async def get_or_fetch_member(source: Union[disnake.Guild, commands.BotBase], me
       except:
         return None
   else:
-    users = source.get_all_members()
-    user = disnake.utils.get(users, id=member_id)
+    # Lookup by id in each guild instead of scanning all members of all guilds
+    user = None
+    for guild in source.guilds:
+      user = guild.get_member(member_id)
+      if user is not None: break
   return user
 
 def get_avatar(user: Union[disnake.Member, disnake.User], size: int=256) -> disnake.Asset: